@@ -0,0 +1,175 @@
+"""
+Запись результатов `analyze_text` в таблицу `call_analysis` пачками.
+
+Обработчики STT (потоки пула `run.py`, `stt_worker.py`) только кладут строку в буфер
+(`record_analysis`), а отдельный поток записи сбрасывает буфер одним запросом
+`INSERT ... VALUES (...), (...) ON CONFLICT (transcript) DO UPDATE`, когда в нем
+набралось `ANALYSIS_BATCH_SIZE` строк или прошло `ANALYSIS_FLUSH_SECONDS` секунд с
+первой строки. Поэтому поток анализа не ждет БД, а нагрузка на БД - один запрос на
+пачку, а не на каждый сегмент. Повторный анализ той же транскрипции обновляет строку.
+
+Если запись не удалась, строки возвращаются в буфер и пишутся со следующей пачкой
+(при недоступной БД хранится не больше `ANALYSIS_BUFFER_LIMIT` последних строк).
+При завершении процесса буфер сбрасывается.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from config import ANALYSIS_BATCH_SIZE, ANALYSIS_BUFFER_LIMIT, ANALYSIS_DB_ENABLED, ANALYSIS_FLUSH_SECONDS
+from kpi import FLAG_COLUMNS, SALE_CONFIRMED, negative_percentage, positive_percentage
+from metrics import DB_SAVE_SECONDS, FILES_PROCESSED, QUEUE_DEPTH
+from models.models import call_analysis_table
+
+# Ответ xaridni_aniqlash при ошибке GPT: вердикт неизвестен
+SALE_UNKNOWN = "Xatolik yuz berdi."
+
+UPDATE_COLUMNS = [c.name for c in call_analysis_table.columns if c.name not in ("id", "transcript", "analyzed_at")]
+
+
+def analysis_row(analysis: Dict, transcript: str, metadata: Optional[Dict] = None, role: str = None) -> Dict:
+    """Строка `call_analysis` из результата `analyze_text` для файла транскрипции `transcript`."""
+    metadata = metadata or {}
+    checks = analysis.get("analysis_result", {})
+    sentiment = checks.get("sentiment")
+    sale_result = analysis.get("sale_result")
+    row = {
+        "transcript": transcript,
+        "call": metadata.get("call"),
+        "segment": metadata.get("segment"),
+        "role": role,
+        "word_count": analysis["word_count"],
+        "unique_words": analysis["unique_words"],
+        "avg_word_length": float(analysis["avg_word_length"]),
+        "positive_pct": positive_percentage(sentiment),
+        "negative_pct": negative_percentage(sentiment),
+        "sale_result": sale_result,
+        "sale_confirmed": None if sale_result in (None, SALE_UNKNOWN) else int(sale_result == SALE_CONFIRMED),
+    }
+    for key, column in FLAG_COLUMNS.items():
+        row[column] = int(checks.get(key) or 0)
+    return row
+
+
+class AnalysisWriter:
+    """Буфер строк `call_analysis` и поток, сбрасывающий его пачками."""
+
+    def __init__(self, batch_size: int = ANALYSIS_BATCH_SIZE, flush_seconds: float = ANALYSIS_FLUSH_SECONDS,
+                 buffer_limit: int = ANALYSIS_BUFFER_LIMIT, database_url: str = None):
+        self.batch_size = max(batch_size, 1)
+        self.flush_seconds = flush_seconds
+        self.buffer_limit = max(buffer_limit, self.batch_size)
+        self.database_url = database_url
+        self.buffer: List[Dict] = []
+        self.first_added = None
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopping = False
+
+    def add(self, row: Dict):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="analysis-writer", daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+            first = not self.buffer
+            if first:
+                self.first_added = time.monotonic()
+            self.buffer.append(row)
+            QUEUE_DEPTH.labels("analysis_buffer").set(len(self.buffer))
+            # Первая строка запускает отсчет ANALYSIS_FLUSH_SECONDS в потоке записи
+            if first or len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+
+    def _take(self) -> List[Dict]:
+        """Ждет, пока пачка наберется или истечет время с первой строки, и забирает буфер."""
+        with self.condition:
+            while not self.stopping:
+                if len(self.buffer) >= self.batch_size:
+                    break
+                if self.buffer and time.monotonic() - self.first_added >= self.flush_seconds:
+                    break
+                timeout = self.flush_seconds
+                if self.buffer:
+                    timeout -= time.monotonic() - self.first_added
+                self.condition.wait(max(timeout, 0.0))
+            rows, self.buffer = self.buffer, []
+            QUEUE_DEPTH.labels("analysis_buffer").set(0)
+            return rows
+
+    def _requeue(self, rows: List[Dict]):
+        with self.condition:
+            self.buffer = (rows + self.buffer)[-self.buffer_limit:]
+            self.first_added = time.monotonic()
+            QUEUE_DEPTH.labels("analysis_buffer").set(len(self.buffer))
+
+    async def write(self, engine, rows: List[Dict]):
+        """Пишет строки пачками по `batch_size` (один многострочный INSERT на пачку)."""
+        table = call_analysis_table
+        insert = sqlite_insert if engine.dialect.name == "sqlite" else pg_insert
+        async with engine.begin() as conn:
+            for start in range(0, len(rows), self.batch_size):
+                # При повторном анализе в одной пачке остается последний результат транскрипции
+                batch = list({row["transcript"]: row for row in rows[start:start + self.batch_size]}.values())
+                stmt = insert(table).values(batch)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.c.transcript],
+                    set_={**{name: stmt.excluded[name] for name in UPDATE_COLUMNS}, "analyzed_at": func.now()},
+                )
+                await conn.execute(stmt)
+
+    def _run(self):
+        # Свой цикл событий и свой engine: соединения async engine привязаны к циклу, в котором созданы
+        from database import DATABASE_URL
+
+        loop = asyncio.new_event_loop()
+        engine = create_async_engine(self.database_url or DATABASE_URL, pool_size=1, max_overflow=0)
+        try:
+            while True:
+                rows = self._take()
+                if rows:
+                    try:
+                        with DB_SAVE_SECONDS.time():
+                            loop.run_until_complete(self.write(engine, rows))
+                        FILES_PROCESSED.labels("analysis_db", "ok").inc(len(rows))
+                    except Exception as e:
+                        FILES_PROCESSED.labels("analysis_db", "error").inc(len(rows))
+                        logging.error(f"Failed to save {len(rows)} analysis rows: {e}")
+                        if not self.stopping:
+                            self._requeue(rows)
+                            time.sleep(self.flush_seconds)
+                if self.stopping and not self.buffer:
+                    break
+        finally:
+            loop.run_until_complete(engine.dispose())
+            loop.close()
+
+    def close(self, timeout: float = 30.0):
+        """Сбрасывает буфер и останавливает поток записи."""
+        with self.condition:
+            if self.thread is None:
+                return
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join(timeout)
+
+
+writer = AnalysisWriter()
+
+
+def record_analysis(analysis: Dict, transcript: str, metadata: Optional[Dict] = None, role: str = None):
+    """Ставит результат анализа транскрипции в очередь записи в `call_analysis`."""
+    if not ANALYSIS_DB_ENABLED:
+        return
+    try:
+        writer.add(analysis_row(analysis, transcript, metadata, role))
+    except Exception as e:
+        logging.warning(f"Failed to queue analysis of {transcript}: {e}")
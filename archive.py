@@ -0,0 +1,344 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from pydub import AudioSegment
+from sqlalchemy import select, update
+
+from audio_processor import CHANNEL_TAGS
+from config import (ARCHIVE_CODEC, ARCHIVE_COMPACT_INTERVAL, ARCHIVE_DIR, ARCHIVE_FLAC_DAYS,
+                    ARCHIVE_FORCE_AFTER_HOURS, ARCHIVE_IO_RATE_MB, ARCHIVE_OPUS_BITRATE, ARCHIVE_RETENTION_DAYS,
+                    PROCESSED_FILES_PATH, STEREO_OPERATOR_CHANNEL, UPLOAD_FOLDER)
+from database import async_session_maker
+from kpi import analysis_path
+from metrics import ARCHIVE_BYTES, ARCHIVE_SECONDS, FILES_PROCESSED
+from models.models import call_info_table
+from outbox import release_result
+from transcripts import TRANSCRIPTIONS_DIR, merged_transcript_path, segment_metadata_path, transcription_names
+
+SEGMENT_MANIFEST = "segments.json"
+ARCHIVE_MARKER = "archive.json"
+CODEC_SUFFIXES = {"flac": ".flac", "opus": ".opus"}
+
+
+class IoThrottle:
+    """
+    Ограничивает среднюю скорость ввода-вывода компактора (token bucket).
+
+    `consume()` возвращает паузу в секундах, которую нужно выдержать после
+    обработки указанного количества байт.
+    """
+
+    def __init__(self, bytes_per_second: float):
+        self.rate = bytes_per_second
+        self.allowance = bytes_per_second
+        self.updated = time.monotonic()
+
+    def consume(self, nbytes: int) -> float:
+        if not self.rate:
+            return 0.0
+        now = time.monotonic()
+        self.allowance = min(self.rate, self.allowance + (now - self.updated) * self.rate)
+        self.updated = now
+        self.allowance -= nbytes
+        return max(0.0, -self.allowance / self.rate)
+
+
+def record_segments(upload_dir: Path, segment_paths):
+    """Дописывает сегменты загруженного аудио в манифест папки запроса."""
+    segments = load_segments(upload_dir)
+    segments.extend(str(path) for path in segment_paths)
+    (Path(upload_dir) / SEGMENT_MANIFEST).write_text(json.dumps(segments), encoding="utf-8")
+
+
+def load_segments(upload_dir: Path) -> List[str]:
+    """Возвращает пути сегментов из манифеста папки запроса (пустой список, если манифеста нет)."""
+    manifest = Path(upload_dir) / SEGMENT_MANIFEST
+    if not manifest.exists():
+        return []
+    return json.loads(manifest.read_text(encoding="utf-8"))
+
+
+def archived_audio_path(upload_dir: Path) -> Optional[str]:
+    """Путь к архиву звонка, если аудио папки запроса уже заархивировано."""
+    marker = Path(upload_dir) / ARCHIVE_MARKER
+    if not marker.exists():
+        return None
+    return json.loads(marker.read_text(encoding="utf-8")).get("audio_path")
+
+
+def segments_merged(call: str, segments: List[str]) -> bool:
+    """
+    Проверяет, что все сегменты звонка транскрибированы и их транскрипции уже объединены,
+    т.е. сегменты и промежуточные транскрипции больше не нужны.
+    """
+    merged = merged_transcript_path(call)
+    if segments and not merged.exists():
+        return False
+    for segment in segments:
+        for name in transcription_names(segment):
+            transcript = TRANSCRIPTIONS_DIR / name
+            if not transcript.exists() or merged.stat().st_mtime < transcript.stat().st_mtime:
+                return False
+    return True
+
+
+def export_audio(audio: AudioSegment, target: Path, codec: str):
+    """Атомарно сохраняет аудио в кодеке архива (через временный `.part` файл)."""
+    partial = target.with_name(target.name + ".part")
+    try:
+        if codec == "opus":
+            audio.export(partial, format="ogg", codec="libopus", bitrate=ARCHIVE_OPUS_BITRATE)
+        else:
+            audio.export(partial, format="flac")
+    except Exception:
+        partial.unlink(missing_ok=True)
+        raise
+    os.replace(partial, target)
+
+
+def merge_channels(operator: AudioSegment, client: AudioSegment) -> AudioSegment:
+    """
+    Объединяет отдельные записи MIC и SPEAKER в одну стерео запись.
+
+    Канал оператора записывается в `STEREO_OPERATOR_CHANNEL`, как в стерео загрузках,
+    более короткая запись дополняется тишиной.
+    """
+    frame_rate = max(operator.frame_rate, client.frame_rate)
+    tracks = []
+    for audio in (operator, client):
+        audio = audio.set_channels(1).set_frame_rate(frame_rate).set_sample_width(2)
+        tracks.append(np.frombuffer(audio.raw_data, dtype=np.int16))
+
+    length = max(len(track) for track in tracks)
+    stereo = np.zeros((length, 2), dtype=np.int16)
+    stereo[:len(tracks[0]), STEREO_OPERATOR_CHANNEL] = tracks[0]
+    stereo[:len(tracks[1]), 1 - STEREO_OPERATOR_CHANNEL] = tracks[1]
+    return AudioSegment(data=stereo.tobytes(), sample_width=2, frame_rate=frame_rate, channels=2)
+
+
+def transcode_call_audio(audio_files: List[Path], call_name: str, codec: str = ARCHIVE_CODEC) -> List[Path]:
+    """
+    Перекодирует оригиналы звонка в архив `ARCHIVE_DIR/<год>/<месяц>/`.
+
+    Пара записей MIC/SPEAKER сохраняется одним стерео файлом, остальные записи -
+    каждая отдельным файлом.
+
+    Возвращает:
+        List[Path]: Пути к файлам архива (первый - основной путь звонка).
+    """
+    suffix = CODEC_SUFFIXES[codec]
+    target_dir = ARCHIVE_DIR / call_name[:4] / call_name[4:6]
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    by_tag = {}
+    for path in audio_files:
+        for tag in CHANNEL_TAGS.values():
+            if tag in path.stem.upper():
+                by_tag[tag] = path
+
+    if len(audio_files) == 2 and len(by_tag) == 2:
+        target = target_dir / f"{call_name}{suffix}"
+        audio = merge_channels(AudioSegment.from_file(by_tag[CHANNEL_TAGS["operator"]]),
+                               AudioSegment.from_file(by_tag[CHANNEL_TAGS["client"]]))
+        export_audio(audio, target, codec)
+        return [target]
+
+    targets = []
+    for path in audio_files:
+        name = call_name if len(audio_files) == 1 else f"{call_name}_{path.stem}"
+        target = target_dir / f"{name}{suffix}"
+        export_audio(AudioSegment.from_file(path), target, codec)
+        targets.append(target)
+    return targets
+
+
+def archive_upload_folder(upload_dir: Path, force: bool = False) -> Optional[str]:
+    """
+    Архивирует аудио папки запроса: перекодирует оригиналы, удаляет их,
+    сегменты из `incoming_audio` и промежуточные транскрипции.
+
+    Пока сегменты не транскрибированы и не объединены, архивирование откладывается
+    (возвращается None), если не указан `force`.
+
+    Возвращает:
+        Optional[str]: Путь к архиву звонка или None, если архивирование отложено.
+    """
+    upload_dir = Path(upload_dir)
+    audio_files = sorted(upload_dir.glob("*.wav"))
+    if not audio_files:
+        return archived_audio_path(upload_dir)
+
+    segments = load_segments(upload_dir)
+    if not force and not segments_merged(upload_dir.name, segments):
+        print(f"Archive deferred, segments are not merged yet: {upload_dir}")
+        return None
+
+    started = time.perf_counter()
+    try:
+        targets = transcode_call_audio(audio_files, upload_dir.name)
+    except Exception:
+        FILES_PROCESSED.labels("archive", "error").inc()
+        raise
+    ARCHIVE_SECONDS.observe(time.perf_counter() - started)
+    ARCHIVE_BYTES.labels("in").inc(sum(path.stat().st_size for path in audio_files))
+    ARCHIVE_BYTES.labels("out").inc(sum(path.stat().st_size for path in targets))
+
+    archive_path = str(targets[0])
+    (upload_dir / ARCHIVE_MARKER).write_text(
+        json.dumps({"audio_path": archive_path, "files": [str(path) for path in targets]}), encoding="utf-8"
+    )
+
+    for segment in segments:
+        Path(segment).unlink(missing_ok=True)
+        segment_metadata_path(segment).unlink(missing_ok=True)
+        for name in transcription_names(segment):
+            (TRANSCRIPTIONS_DIR / name).unlink(missing_ok=True)
+            analysis_path(TRANSCRIPTIONS_DIR / name).unlink(missing_ok=True)
+    for path in audio_files:
+        path.unlink()
+
+    FILES_PROCESSED.labels("archive", "ok").inc()
+    print(f"Archived {upload_dir} -> {archive_path}")
+    return archive_path
+
+
+async def update_audio_path(condition, audio_path: Optional[str]):
+    """Обновляет `call_info.audio_path` для записей, удовлетворяющих условию."""
+    async with async_session_maker() as session:
+        await session.execute(update(call_info_table).where(condition).values(audio_path=audio_path))
+        await session.commit()
+
+
+async def archive_call(order_id: str, upload_dir: Path, force: bool = False) -> Optional[str]:
+    """
+    Архивирует аудио сохраненного звонка, записывает путь к архиву в `call_info.audio_path`
+    и отпускает ожидающую архивации запись звонка в `result_outbox`.
+
+    Перекодирование выполняется в пуле потоков, чтобы не блокировать event loop.
+    """
+    loop = asyncio.get_running_loop()
+    archive_path = await loop.run_in_executor(None, archive_upload_folder, Path(upload_dir), force)
+    if archive_path:
+        await update_audio_path(call_info_table.c.order_id == order_id, archive_path)
+        await release_result(order_id, archive_path)
+    return archive_path
+
+
+def transcode_archive_file(path: Path, codec: str) -> Path:
+    """Перекодирует файл архива в другой кодек, сохраняя время изменения исходного файла."""
+    target = path.with_suffix(CODEC_SUFFIXES[codec])
+    export_audio(AudioSegment.from_file(path), target, codec)
+    stat = path.stat()
+    os.utime(target, (stat.st_atime, stat.st_mtime))
+    path.unlink()
+    return target
+
+
+def folder_age_hours(upload_dir: Path) -> float:
+    """Возраст папки запроса в часах по метке времени в имени (или по времени изменения)."""
+    try:
+        created = datetime.strptime(upload_dir.name[:15], "%Y%m%d_%H%M%S").timestamp()
+    except ValueError:
+        created = upload_dir.stat().st_mtime
+    return (time.time() - created) / 3600
+
+
+async def archive_pending_calls(throttle: IoThrottle):
+    """Архивирует сохраненные звонки, аудио которых все еще лежит в `UPLOAD_FOLDER`."""
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(call_info_table.c.order_id, call_info_table.c.audio_path)
+            .where(call_info_table.c.audio_path.like(f"{UPLOAD_FOLDER}%"))
+        )
+        rows = result.fetchall()
+
+    for row in rows:
+        upload_dir = Path(row.audio_path).parent
+        if not upload_dir.exists():
+            continue
+        size = sum(path.stat().st_size for path in upload_dir.glob("*.wav"))
+        try:
+            archive_path = await archive_call(row.order_id, upload_dir,
+                                              force=folder_age_hours(upload_dir) >= ARCHIVE_FORCE_AFTER_HOURS)
+        except Exception as e:
+            logging.error(f"Failed to archive {upload_dir}: {e}")
+            continue
+        if archive_path:
+            await asyncio.sleep(throttle.consume(size + Path(archive_path).stat().st_size))
+
+
+async def apply_retention(throttle: IoThrottle):
+    """
+    Переводит файлы архива между уровнями хранения: FLAC старше `ARCHIVE_FLAC_DAYS`
+    перекодируется в Opus, файлы старше `ARCHIVE_RETENTION_DAYS` удаляются.
+    """
+    now = time.time()
+    for path in sorted(ARCHIVE_DIR.rglob("*")):
+        if not path.is_file() or path.suffix not in CODEC_SUFFIXES.values():
+            continue
+        age_days = (now - path.stat().st_mtime) / 86400
+
+        if ARCHIVE_RETENTION_DAYS and age_days >= ARCHIVE_RETENTION_DAYS:
+            size = path.stat().st_size
+            path.unlink()
+            await update_audio_path(call_info_table.c.audio_path == str(path), None)
+            FILES_PROCESSED.labels("archive_expire", "ok").inc()
+            await asyncio.sleep(throttle.consume(size))
+        elif path.suffix == ".flac" and ARCHIVE_FLAC_DAYS and age_days >= ARCHIVE_FLAC_DAYS:
+            size = path.stat().st_size
+            try:
+                target = transcode_archive_file(path, "opus")
+            except Exception as e:
+                logging.error(f"Failed to transcode {path}: {e}")
+                continue
+            await update_audio_path(call_info_table.c.audio_path == str(path), str(target))
+            FILES_PROCESSED.labels("archive_opus", "ok").inc()
+            await asyncio.sleep(throttle.consume(size + target.stat().st_size))
+
+
+def prune_upload_folders():
+    """
+    Удаляет папки запросов, которые уже отправлены (есть в `PROCESSED_FILES_PATH`)
+    и не содержат аудио, чтобы сканирование `UPLOAD_FOLDER` не замедлялось со временем.
+    """
+    if not PROCESSED_FILES_PATH.exists():
+        return
+    processed = set(PROCESSED_FILES_PATH.read_text(encoding="utf-8").splitlines())
+    for upload_dir in UPLOAD_FOLDER.iterdir():
+        if upload_dir.is_dir() and upload_dir.name in processed and not any(upload_dir.glob("*.wav")):
+            shutil.rmtree(upload_dir)
+
+
+async def compact(once: bool = False):
+    """
+    Фоновый компактор архива: дозаписывает отложенные архивы, применяет уровни
+    хранения и чистит отправленные папки запросов с ограничением скорости ввода-вывода.
+    """
+    throttle = IoThrottle(ARCHIVE_IO_RATE_MB * 1024 * 1024)
+    while True:
+        started = time.perf_counter()
+        await archive_pending_calls(throttle)
+        await apply_retention(throttle)
+        prune_upload_folders()
+        logging.info(f"Archive compaction pass finished in {time.perf_counter() - started:.1f}s")
+        if once:
+            return
+        await asyncio.sleep(ARCHIVE_COMPACT_INTERVAL)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Audio archive compactor")
+    parser.add_argument("--once", action="store_true", help="Run a single compaction pass and exit")
+    args = parser.parse_args()
+
+    asyncio.run(compact(args.once))
@@ -1,7 +1,15 @@
 import os
+import wave
+from typing import Dict, List
+
 import numpy as np
 from pydub import AudioSegment
 
+from config import STEREO_OPERATOR_CHANNEL
+
+STEREO_TAG = "STEREO"
+CHANNEL_TAGS = {"operator": "MIC", "client": "SPEAKER"}
+
 
 def preprocess_audio(file_path: str) -> np.ndarray:
     """
@@ -32,3 +40,72 @@ def preprocess_audio(file_path: str) -> np.ndarray:
     samples = samples / np.max(np.abs(samples))
 
     return samples
+
+
+def split_channels(samples: np.ndarray, channels: int) -> List[np.ndarray]:
+    """
+    Разделяет чередующиеся (interleaved) сэмплы на отдельные каналы без копирования.
+
+    Каждый канал возвращается как strided view исходного буфера, поэтому
+    разделение стерео записи не выделяет дополнительную память.
+
+    Параметры:
+    samples (np.ndarray): Одномерный массив чередующихся сэмплов.
+    channels (int): Количество каналов.
+
+    Возвращает:
+    List[np.ndarray]: Список view для каждого канала.
+    """
+    frames = samples[: len(samples) - len(samples) % channels]
+    return [frames[channel::channels] for channel in range(channels)]
+
+
+def load_stereo_channels(file_path: str, frame_rate: int = 16000) -> Dict[str, np.ndarray]:
+    """
+    Загружает стерео запись звонка и возвращает каналы оператора и клиента.
+
+    Канал оператора (MIC) задается настройкой `STEREO_OPERATOR_CHANNEL`,
+    второй канал считается каналом клиента (SPEAKER).
+
+    Параметры:
+    file_path (str): Путь к стерео аудиофайлу.
+    frame_rate (int): Частота дискретизации для модели STT.
+
+    Возвращает:
+    Dict[str, np.ndarray]: Аудиоданные float32 в диапазоне от -1 до 1 по ролям.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Аудиофайл {file_path} не найден.")
+
+    audio = AudioSegment.from_file(file_path).set_frame_rate(frame_rate).set_sample_width(2)
+    if audio.channels != 2:
+        raise ValueError(f"Ожидалась стерео запись, получено каналов: {audio.channels}")
+
+    samples = np.frombuffer(audio.raw_data, dtype=np.int16)
+    channels = split_channels(samples, audio.channels)
+    operator = channels[STEREO_OPERATOR_CHANNEL]
+    client = channels[1 - STEREO_OPERATOR_CHANNEL]
+
+    # Единственная копия: int16 view -> float32 для модели
+    return {
+        "operator": np.multiply(operator, 1 / 32768, dtype=np.float32),
+        "client": np.multiply(client, 1 / 32768, dtype=np.float32),
+    }
+
+
+def is_stereo_file(file_path: str) -> bool:
+    """Проверяет, является ли сегмент стерео записью звонка (по метке в имени файла)."""
+    return f"_{STEREO_TAG}" in os.path.basename(file_path).upper()
+
+
+def audio_duration(file_path: str) -> float:
+    """
+    Возвращает длительность аудиофайла в секундах.
+
+    Для WAV читается только заголовок, для остальных форматов файл декодируется.
+    """
+    try:
+        with wave.open(str(file_path), "rb") as wav:
+            return wav.getnframes() / float(wav.getframerate())
+    except (wave.Error, EOFError):
+        return len(AudioSegment.from_file(file_path)) / 1000
@@ -0,0 +1,307 @@
+"""
+Повторная обработка сохраненных звонков после обновления модели STT или ключевых слов.
+
+Звонки выбираются из `call_info` по периоду и/или диапазону операторов и распределяются
+по пулу процессов; каждый процесс один раз загружает и прогревает модели. Результаты
+(тексты и флаги анализа, KPI операторов обновляются на разницу) записываются в БД
+пачками, обработанные звонки отмечаются в файле контрольной точки, поэтому после сбоя
+запуск с теми же параметрами продолжает с места остановки.
+
+Режимы:
+    stt       - заново транскрибировать аудио звонка и проанализировать текст;
+    analysis  - только заново проанализировать сохраненные тексты (после изменения sentiment.py).
+
+Примеры:
+    python backfill.py --date-from 2024-01-01 --date-to 2024-01-31 --workers 2 --rate 600
+    python backfill.py --mode analysis --operator-from 10 --operator-to 20
+"""
+import argparse
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from pydub import AudioSegment
+from sqlalchemy import bindparam, select, update
+
+from audio_processor import CHANNEL_TAGS, load_stereo_channels
+from config import (BACKFILL_BATCH_SIZE, BACKFILL_CHECKPOINT_DIR, BACKFILL_NICE, BACKFILL_RATE_PER_HOUR,
+                    BACKFILL_WORKERS)
+from database import async_session_maker
+from kpi import call_day, day_start, record_call_flags, summarize_analyses
+from models.models import call_info_table
+from transcripts import SEGMENT_SECONDS, absolute_time, dialog_columns, transcript_lines
+
+SAMPLING_RATE = 16000
+
+
+# --- Процессы пула ---------------------------------------------------------------
+
+def init_worker(mode: str, threads: int, nice: int):
+    """
+    Инициализация процесса пула: понижение приоритета, ограничение потоков torch,
+    загрузка и прогрев моделей (один раз на процесс, а не на звонок).
+    """
+    if nice:
+        os.nice(nice)
+    import torch
+
+    torch.set_num_threads(threads)
+
+    from text_analysis import analyze_text
+
+    analyze_text("assalomu alaykum")
+    if mode == "stt":
+        import stt_model
+
+        silence = np.zeros(SAMPLING_RATE, dtype=np.float32)
+        stt_model.pipe({"raw": silence, "sampling_rate": SAMPLING_RATE}, return_timestamps=True)
+
+
+def load_mono(path: Path) -> np.ndarray:
+    audio = AudioSegment.from_file(path).set_channels(1).set_frame_rate(SAMPLING_RATE).set_sample_width(2)
+    return np.multiply(np.frombuffer(audio.raw_data, dtype=np.int16), 1 / 32768, dtype=np.float32)
+
+
+def call_tracks(audio_path: str) -> Dict[str, np.ndarray]:
+    """
+    Возвращает аудио звонка по ролям.
+
+    Архив и стерео загрузки содержат оба канала в одном файле. Для незаархивированных
+    звонков с отдельными файлами MIC/SPEAKER берутся все записи из папки запроса.
+    """
+    path = Path(audio_path)
+    if AudioSegment.from_file(path).channels == 2:
+        return load_stereo_channels(str(path), SAMPLING_RATE)
+
+    tracks = {}
+    for candidate in sorted(path.parent.glob("*.wav")) or [path]:
+        for role, tag in CHANNEL_TAGS.items():
+            if tag in candidate.stem.upper():
+                tracks[role] = load_mono(candidate)
+    return tracks or {"operator": load_mono(path)}
+
+
+def transcribe_call(audio_path: str) -> List[List[Dict]]:
+    """
+    Транскрибирует звонок окнами по `SEGMENT_SECONDS`, как в живом конвейере.
+
+    Возвращает:
+        List[List[Dict]]: Строки структурированной транскрипции по каждому окну.
+    """
+    import stt_model
+
+    windows, metadata = [], []
+    step = SEGMENT_SECONDS * SAMPLING_RATE
+    for role, samples in call_tracks(audio_path).items():
+        for index, start in enumerate(range(0, len(samples), step)):
+            windows.append({"raw": samples[start:start + step], "sampling_rate": SAMPLING_RATE})
+            metadata.append((role, {"segment": index, "offset": float(index * SEGMENT_SECONDS)}))
+
+    results = stt_model.pipe(windows, batch_size=min(8, len(windows)), return_timestamps=True) if windows else []
+    return [transcript_lines(result, role, meta) for result, (role, meta) in zip(results, metadata)]
+
+
+def process_call(call: Dict, mode: str) -> Dict:
+    """Обрабатывает один звонок в процессе пула и возвращает тексты и флаги для записи в БД."""
+    from text_analysis import analyze_text
+
+    output = {"id": call["id"], "operator_id": call["operator_id"], "datetime": call["datetime"]}
+    if mode == "stt":
+        segments = transcribe_call(call["audio_path"])
+        texts = [" ".join(line["text"] for line in lines) for lines in segments]
+        output["texts"] = dialog_columns(heapq.merge(*segments, key=absolute_time))
+    else:
+        texts = [call["operator_txt"], call["client_txt"]]
+
+    output["flags"] = summarize_analyses([analyze_text(text) for text in texts if text])
+    return output
+
+
+# --- Основной процесс ------------------------------------------------------------
+
+class Checkpoint:
+    """Файл контрольной точки: по строке на звонок, результаты которого записаны в БД."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done = set()
+        if path.exists():
+            self.done = {int(line) for line in path.read_text(encoding="utf-8").split()}
+
+    def add(self, call_ids):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(f"{call_id}\n" for call_id in call_ids))
+        self.done.update(call_ids)
+
+
+class RateLimiter:
+    """Равномерно распределяет запуск обработки звонков: не более `per_hour` в час (0 - без ограничения)."""
+
+    def __init__(self, per_hour: float):
+        self.interval = 3600 / per_hour if per_hour else 0
+        self.next_at = time.monotonic()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_at > now:
+            await asyncio.sleep(self.next_at - now)
+        self.next_at = max(now, self.next_at) + self.interval
+
+
+class Progress:
+    def __init__(self, total: int, report_every: float = 30.0):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+        self.report_every = report_every
+
+    def add(self, done: int = 0, failed: int = 0):
+        self.done += done
+        self.failed += failed
+        if time.monotonic() - self.reported >= self.report_every:
+            self.report()
+
+    def report(self):
+        self.reported = time.monotonic()
+        elapsed = self.reported - self.started
+        rate = (self.done + self.failed) / elapsed * 3600 if elapsed else 0
+        remaining = self.total - self.done - self.failed
+        eta = remaining / rate * 3600 if rate else None
+        eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta is not None else "?"
+        logging.info(f"Backfill: {self.done}/{self.total} done, {self.failed} failed, "
+                     f"{rate:.0f} calls/hour, ETA {eta_text}")
+
+
+def selection_statement(args):
+    table = call_info_table
+    stmt = select(table.c.id, table.c.operator_id, table.c.datetime, table.c.audio_path,
+                  table.c.operator_txt, table.c.client_txt).order_by(table.c.id)
+    # Фильтр по call_ts отсекает секции call_info за другие месяцы
+    if args.date_from:
+        stmt = stmt.where(table.c.call_ts >= day_start(args.date_from))
+    if args.date_to:
+        stmt = stmt.where(table.c.call_ts < day_start(args.date_to) + timedelta(days=1))
+    if args.operator_from is not None:
+        stmt = stmt.where(table.c.operator_id >= args.operator_from)
+    if args.operator_to is not None:
+        stmt = stmt.where(table.c.operator_id <= args.operator_to)
+    if args.mode == "stt":
+        stmt = stmt.where(table.c.audio_path.is_not(None))
+    return stmt
+
+
+def checkpoint_path(args) -> Path:
+    """Контрольная точка определяется параметрами выборки, поэтому повторный запуск продолжает ту же работу."""
+    selection = [args.mode, args.date_from, args.date_to, args.operator_from, args.operator_to]
+    digest = hashlib.sha1(json.dumps(selection).encode()).hexdigest()[:12]
+    return Path(args.checkpoint_dir) / f"backfill_{args.mode}_{digest}.ckpt"
+
+
+async def write_batch(results: List[Dict]):
+    """Записывает пачку результатов одной транзакцией: тексты звонков, флаги и KPI."""
+    async with async_session_maker() as session:
+        texts = [{"b_id": r["id"], **r["texts"]} for r in results if r.get("texts")]
+        if texts:
+            await session.execute(
+                update(call_info_table).where(call_info_table.c.id == bindparam("b_id")).values(
+                    operator_txt=bindparam("operator_txt"), client_txt=bindparam("client_txt"),
+                    dialog_txt=bindparam("dialog_txt"),
+                ),
+                texts,
+            )
+        for r in results:
+            if r.get("flags"):
+                await record_call_flags(session, r["id"], r["operator_id"], call_day(r["datetime"]), r["flags"])
+        await session.commit()
+
+
+async def run_backfill(args):
+    checkpoint = Checkpoint(checkpoint_path(args))
+    async with async_session_maker() as session:
+        rows = (await session.execute(selection_statement(args))).fetchall()
+    calls = [dict(row._mapping) for row in rows if row.id not in checkpoint.done]
+    logging.info(f"Backfill: {len(rows)} calls selected, {len(rows) - len(calls)} already done "
+                 f"(checkpoint {checkpoint.path})")
+    if not calls:
+        return
+
+    progress = Progress(len(calls))
+    limiter = RateLimiter(args.rate)
+    in_flight = asyncio.Semaphore(args.workers * 2)
+    batch: List[Dict] = []
+    batch_lock = asyncio.Lock()
+    threads = args.threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    async def flush():
+        if not batch:
+            return
+        pending = batch[:]
+        batch.clear()
+        await write_batch(pending)
+        checkpoint.add([r["id"] for r in pending])
+        progress.add(done=len(pending))
+
+    loop = asyncio.get_running_loop()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=init_worker,
+                             initargs=(args.mode, threads, args.nice)) as pool:
+        async def handle(call):
+            try:
+                result = await loop.run_in_executor(pool, process_call, call, args.mode)
+            except Exception as e:
+                logging.error(f"Backfill of call {call['id']} failed: {e}")
+                progress.add(failed=1)
+                return
+            finally:
+                in_flight.release()
+            async with batch_lock:
+                batch.append(result)
+                if len(batch) >= args.batch_size:
+                    await flush()
+
+        tasks = []
+        for call in calls:
+            await in_flight.acquire()
+            await limiter.wait()
+            tasks.append(asyncio.create_task(handle(call)))
+        await asyncio.gather(*tasks)
+        async with batch_lock:
+            await flush()
+    progress.report()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Re-transcribe and re-analyze stored calls")
+    parser.add_argument("--mode", choices=("stt", "analysis"), default="stt")
+    parser.add_argument("--date-from", default=None, help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--date-to", default=None, help="YYYY-MM-DD, inclusive")
+    parser.add_argument("--operator-from", type=int, default=None, help="Operator id range start, inclusive")
+    parser.add_argument("--operator-to", type=int, default=None, help="Operator id range end, inclusive")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS)
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads per worker (default cpu/workers)")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument("--rate", type=float, default=BACKFILL_RATE_PER_HOUR, help="Max calls per hour, 0 = no limit")
+    parser.add_argument("--nice", type=int, default=BACKFILL_NICE, help="Niceness increment for worker processes")
+    parser.add_argument("--checkpoint-dir", default=str(BACKFILL_CHECKPOINT_DIR))
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    Path(args.checkpoint_dir).mkdir(parents=True, exist_ok=True)
+    asyncio.run(run_backfill(args))
@@ -0,0 +1,76 @@
+import json
+import math
+import resource
+import sys
+import wave
+from pathlib import Path
+
+import numpy as np
+
+
+def percentile(values, q):
+    """Перцентиль q (0-100) методом ближайшего ранга."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(seconds):
+    """Сводка латентностей в миллисекундах."""
+    if not seconds:
+        return {}
+    return {
+        "count": len(seconds),
+        "mean_ms": round(sum(seconds) / len(seconds) * 1000, 3),
+        "p50_ms": round(percentile(seconds, 50) * 1000, 3),
+        "p95_ms": round(percentile(seconds, 95) * 1000, 3),
+        "p99_ms": round(percentile(seconds, 99) * 1000, 3),
+        "max_ms": round(max(seconds) * 1000, 3),
+    }
+
+
+def peak_rss_mb():
+    """Пиковое потребление памяти процессом (RSS) в мегабайтах."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def write_synthetic_call(path: Path, seconds: float, role: str, seed: int, frame_rate: int = 8000, channels: int = 1):
+    """
+    Записывает синтетический WAV звонка: чередующиеся "реплики" (шум с огибающей) и паузы.
+
+    Реплики оператора (MIC) и клиента (SPEAKER) сдвинуты друг относительно друга,
+    как в реальном диалоге. При channels=2 оба канала пишутся в один стерео файл.
+    """
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * frame_rate)
+    t = np.arange(frames) / frame_rate
+    turn = 4.0
+    phase = 0.0 if role == "MIC" else turn
+
+    def voice(offset):
+        active = ((t + offset) % (2 * turn)) < turn
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+        return (rng.standard_normal(frames) * 3000 * envelope * active).astype(np.int16)
+
+    if channels == 2:
+        samples = np.column_stack([voice(0.0), voice(turn)]).reshape(-1)
+    else:
+        samples = voice(phase)
+
+    with wave.open(str(path), "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(frame_rate)
+        wav.writeframes(samples.tobytes())
+
+
+def write_report(report: dict, output: str = None):
+    """Печатает отчет в формате JSON и при необходимости сохраняет его в файл."""
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if output:
+        Path(output).write_text(text + "\n", encoding="utf-8")
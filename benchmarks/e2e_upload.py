@@ -0,0 +1,221 @@
+"""
+Сквозной нагрузочный бенчмарк: синтетические звонки -> /upload -> STT -> слияние -> отправка.
+
+Генерирует синтетические MIC/SPEAKER WAV звонки заданной длины, параллельно отправляет
+их в `/upload` через in-process ASGI клиент, выполняет поставленные задачи приема
+(сегментация), затем прогоняет этапы наблюдателя (STT и
+анализ), слияния транскрипций и отправки результата. Модели заменены заглушками
+(`benchmarks/stubs.py`), внешний `/test-api` поднимается локально, БД - SQLite или
+локальный Postgres. Результат - JSON с пропускной способностью, p50/p95/p99 и пиковым RSS.
+
+Запуск из корня репозитория:
+    python -m benchmarks.e2e_upload --calls 20 --seconds 90 --concurrency 8 --output bench_e2e.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.common import latency_summary, peak_rss_mb, write_report, write_synthetic_call  # noqa: E402
+from benchmarks.stubs import install_model_stubs  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End-to-end /upload pipeline benchmark")
+    parser.add_argument("--calls", type=int, default=20, help="Number of synthetic calls")
+    parser.add_argument("--seconds", type=float, default=90, help="Length of each call in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent /upload requests")
+    parser.add_argument("--stereo", action="store_true", help="Upload one stereo file instead of MIC/SPEAKER pair")
+    parser.add_argument("--frame-rate", type=int, default=8000)
+    parser.add_argument("--stt-workers", type=int, default=4, help="Watcher pool threads running the STT stage")
+    parser.add_argument("--stt-rtf", type=float, default=0.0, help="Simulated STT real-time factor")
+    parser.add_argument("--sentiment-latency", type=float, default=0.0, help="Simulated sentiment latency, s")
+    parser.add_argument("--database-url", default=None, help="Defaults to a temporary SQLite database")
+    parser.add_argument("--workdir", default=None, help="Defaults to a temporary directory")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    return parser.parse_args()
+
+
+def form_data(i):
+    return {"salesman_username": f"bench_operator_{i}", "call_id": f"bench-call-{i}", "call_info": "benchmark"}
+
+
+def json_data(i):
+    return {"call": {"USER_NAME": f"bench_operator_{i}", "1C_OUTPUT": {
+        "field_101": f"+99890{i:07d}", "field_2": f"bench-order-{i}", "field_36": "new",
+        "field_3": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }}}
+
+
+async def start_receiver():
+    """Локальная заглушка внешнего API результатов. Возвращает (runner, url, полученные записи)."""
+    from aiohttp import web
+
+    received = []
+
+    async def handle(request):
+        received.append(await request.json())
+        return web.json_response({"status": "success"})
+
+    app = web.Application()
+    app.router.add_post("/test-api", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/test-api", received
+
+
+async def run(args, calls_dir: Path, received: list):
+    import httpx
+    from sqlalchemy import func, select
+
+    import ingest
+    import main
+    from database import engine
+    from example import merge_transcription_files
+    from file_watcher import AudioFileHandler
+    from models.models import call_info_table, metadata
+    from outbox import OutboxDispatcher
+    from utils import send_result_to_api
+
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, errors = [], 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+        async def upload(files):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/upload", files=files, timeout=None)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code not in (200, 202) or "error" in response.json():
+                    errors += 1
+
+        def call_files(i):
+            files = [("files", ("form_data.json", json.dumps(form_data(i)).encode(), "application/json"))]
+            audio_names = [f"call_{i}.wav"] if args.stereo else [f"call_{i}_MIC.wav", f"call_{i}_SPEAKER.wav"]
+            for name in audio_names:
+                files.append(("files", (name, (calls_dir / name).read_bytes(), "audio/wav")))
+            return files
+
+        upload_started = time.perf_counter()
+        tasks = []
+        for i in range(args.calls):
+            tasks.append(upload(call_files(i)))
+            tasks.append(upload([("files", ("json_data.json", json.dumps(json_data(i)).encode(), "application/json"))]))
+        await asyncio.gather(*tasks)
+        upload_seconds = time.perf_counter() - upload_started
+
+    # ASGI транспорт не запускает lifespan, поэтому задачи приема (UPLOAD_ASYNC) выполняются здесь
+    ingest_started = time.perf_counter()
+    ingest_jobs = 0
+    while await ingest.process_next("bench-ingest"):
+        ingest_jobs += 1
+    ingest_seconds = time.perf_counter() - ingest_started
+
+    # STT через пул наблюдателя run.py, как при обходе папки после запуска
+    handler = AudioFileHandler("transcriptions", workers=args.stt_workers)
+    stt_started = time.perf_counter()
+    segments = handler.sweep("incoming_audio", min_age=0)
+    handler.wait()
+    handler.shutdown()
+    stt_seconds = time.perf_counter() - stt_started
+
+    merge_started = time.perf_counter()
+    await merge_transcription_files()
+    merge_seconds = time.perf_counter() - merge_started
+
+    send_started = time.perf_counter()
+    await send_result_to_api()
+    await OutboxDispatcher().run(until_idle=True)
+    send_seconds = time.perf_counter() - send_started
+
+    async with engine.connect() as conn:
+        saved = await conn.scalar(select(func.count()).select_from(call_info_table))
+    await engine.dispose()
+
+    audio_seconds = args.calls * args.seconds * (1 if args.stereo else 2)
+    total_seconds = upload_seconds + ingest_seconds + stt_seconds + merge_seconds + send_seconds
+    return {
+        "upload": {
+            "requests": len(latencies),
+            "errors": errors,
+            "seconds": round(upload_seconds, 3),
+            "requests_per_second": round(len(latencies) / upload_seconds, 2),
+            "latency": latency_summary(latencies),
+        },
+        "ingest": {"jobs": ingest_jobs, "seconds": round(ingest_seconds, 3)},
+        "stt": {
+            "segments": segments,
+            "seconds": round(stt_seconds, 3),
+            "segments_per_second": round(segments / stt_seconds, 2) if stt_seconds else None,
+            "audio_seconds_per_second": round(audio_seconds / stt_seconds, 2) if stt_seconds else None,
+        },
+        "merge": {"seconds": round(merge_seconds, 3)},
+        "send": {"seconds": round(send_seconds, 3), "records_saved": saved,
+                 "api_received": len(received)},
+        "end_to_end": {
+            "calls": args.calls,
+            "seconds": round(total_seconds, 3),
+            "calls_per_second": round(args.calls / total_seconds, 3),
+        },
+    }
+
+
+async def bench(args):
+    receiver, url, received = await start_receiver()
+    os.environ["RESULT_API_URL"] = url
+    try:
+        return await run(args, Path("calls").resolve(), received)
+    finally:
+        await receiver.cleanup()
+
+
+def main():
+    args = parse_args()
+    output = Path(args.output).resolve() if args.output else None
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="dialdeep_bench_")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    # Модули проекта используют относительные пути (uploads, incoming_audio, transcriptions)
+    os.chdir(workdir)
+    for folder in ("calls", "incoming_audio", "transcriptions"):
+        Path(folder).mkdir(exist_ok=True)
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{workdir / 'bench.db'}"
+
+    for i in range(args.calls):
+        if args.stereo:
+            write_synthetic_call(Path("calls") / f"call_{i}.wav", args.seconds, "STEREO", i, args.frame_rate, 2)
+        else:
+            write_synthetic_call(Path("calls") / f"call_{i}_MIC.wav", args.seconds, "MIC", i, args.frame_rate)
+            write_synthetic_call(Path("calls") / f"call_{i}_SPEAKER.wav", args.seconds, "SPEAKER", i, args.frame_rate)
+
+    install_model_stubs(stt_rtf=args.stt_rtf, sentiment_latency=args.sentiment_latency)
+    started = time.perf_counter()
+    results = asyncio.run(bench(args))
+
+    report = {
+        "benchmark": "e2e_upload",
+        "config": {k: v for k, v in vars(args).items() if k not in ("output",)},
+        "workdir": str(workdir),
+        **results,
+        "wall_seconds": round(time.perf_counter() - started, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    write_report(report, output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Микробенчмарки компонентов: анализ текста, сегментация аудио, слияние транскрипций, запись в БД.
+
+Модели заменены детерминированными заглушками (`benchmarks/stubs.py`), поэтому результаты
+стабильны на машинах только с CPU. Результаты сохраняются в JSON и сравниваются с базовой
+линией: медиана каждого кейса, выросшая больше чем на `--threshold`, считается регрессией
+(код выхода 1). Режим прогона (`--quick` или полный) записывается в базовую линию: размеры
+входов в режимах разные, поэтому с базовой линией другого режима результаты не сравниваются
+(код выхода 2).
+
+Запуск из корня репозитория:
+    python -m benchmarks.micro --save-baseline                 # записать базовую линию
+    python -m benchmarks.micro --output micro.json             # сравнить с базовой линией
+    python -m benchmarks.micro --only sentiment --quick        # быстрый прогон части кейсов
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.common import peak_rss_mb, write_report, write_synthetic_call  # noqa: E402
+from benchmarks.stubs import install_model_stubs, synthetic_text  # noqa: E402
+
+DEFAULT_BASELINE = REPO_ROOT / "benchmarks" / "results" / "micro_baseline.json"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Component microbenchmarks")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs for a fast smoke run")
+    parser.add_argument("--only", default=None, help="Run only cases whose name contains this substring")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed median slowdown vs baseline")
+    parser.add_argument("--output", default=None)
+    return parser.parse_args()
+
+
+def measure(func, repeats):
+    """Выполняет функцию `repeats` раз и возвращает статистику времени выполнения."""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return {
+        "repeats": repeats,
+        "min_s": round(min(timings), 6),
+        "median_s": round(statistics.median(timings), 6),
+        "mean_s": round(statistics.fmean(timings), 6),
+    }
+
+
+def build_cases(args, loop):
+    """Готовит входные данные и возвращает список (имя кейса, функция, число повторов)."""
+    import sentiment
+
+    import ingest
+    from database import engine
+    from example import merge_transcription_files
+    from models.models import metadata
+    from text_analysis import analyze_text
+    from transcripts import TRANSCRIPT_SUFFIX, transcript_lines, write_transcript
+    from utils import save_data_to_db
+
+    transcripts = {
+        "short": synthetic_text("short", 10, "operator"),
+        "long": synthetic_text("long", 600 if args.quick else 10000, "operator"),
+    }
+    checks = [sentiment.check_greeting, sentiment.check_name_asked, sentiment.check_company_discussed,
+              sentiment.check_medicine_info, sentiment.check_name_medicine, sentiment.check_seller_info,
+              sentiment.check_illness_symptoms]
+
+    cases = []
+    for size, text in transcripts.items():
+        cleaned = sentiment.clean_text(text)
+        cases.append((f"sentiment.analyze_conversation[{size}]", lambda t=text: sentiment.analyze_conversation(t),
+                      args.repeats))
+        cases.append((f"text_analysis.analyze_text[{size}]", lambda t=text: analyze_text(t), args.repeats))
+        for check in checks:
+            cases.append((f"sentiment.{check.__name__}[{size}]", lambda c=check, t=cleaned: c(t), args.repeats))
+
+    audio_dir = Path("calls")
+    audio_dir.mkdir(exist_ok=True)
+    for label, minutes in (("1min", 1), ("10min", 10) if args.quick else ("2h", 120)):
+        audio_path = audio_dir / f"call_{label}_MIC.wav"
+        write_synthetic_call(audio_path, minutes * 60, "MIC", seed=minutes)
+
+        def segment(path=audio_path):
+            for old in ingest.INCOMING_AUDIO_DIR.glob("*.wav"):
+                old.unlink()
+            ingest.save_audio_segments(str(path))
+
+        cases.append((f"ingest.save_audio_segments[{label}]", segment, 1 if minutes > 1 else args.repeats))
+
+    transcript_count = 1000 if args.quick else 10000
+    transcriptions = Path("transcriptions")
+    transcriptions.mkdir(exist_ok=True)
+    for i in range(transcript_count):
+        role = "operator" if i % 2 else "client"
+        stem = f"audio_part_{i // 20:05d}_{i % 20:03d}_{'MIC' if i % 2 else 'SPEAKER'}"
+        words = synthetic_text(stem, 30, role).split()
+        result = {"chunks": [{"timestamp": (j * 5.0, j * 5.0 + 5.0), "text": " ".join(words[j * 10:j * 10 + 10])}
+                             for j in range(6)]}
+        segment_info = {"call": f"call_{i // 20:05d}", "segment": i % 20 // 2, "offset": float(i % 20 // 2 * 30)}
+        write_transcript(transcript_lines(result, role, segment_info), transcriptions / f"{stem}{TRANSCRIPT_SUFFIX}")
+        (ingest.INCOMING_AUDIO_DIR / f"{stem}.wav").touch()
+    cases.append((f"example.merge_transcription_files[{transcript_count}]",
+                  lambda: loop.run_until_complete(merge_transcription_files()), max(1, args.repeats // 2)))
+
+    loop.run_until_complete(_create_tables(engine, metadata))
+    counter = iter(range(10 ** 9))
+
+    def records(batch_size):
+        run = next(counter)
+        return [{
+            "operator": {"id": f"op_{i % 50}", "name": f"op_{i % 50}"},
+            "client": {"id": f"+99890{i:07d}", "phone": f"+99890{i:07d}"},
+            "order_id": f"order-{run}-{i}", "status_1c": "new", "status_ai": "approved",
+            "call_id": f"call-{run}-{i}", "call_info": "micro", "datetime": "2024-01-01 10:00:00",
+            "audio_path": None,
+        } for i in range(batch_size)]
+
+    for batch_size in (1, 10, 100) if args.quick else (1, 10, 100, 1000):
+        cases.append((f"utils.save_data_to_db[{batch_size}]",
+                      lambda b=batch_size: loop.run_until_complete(save_data_to_db(records(b))), args.repeats))
+
+    return cases, engine.dispose
+
+
+async def _create_tables(engine, metadata):
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+
+
+def compare(results, baseline, threshold):
+    """Сравнивает медианы с базовой линией и возвращает список регрессий."""
+    comparison, regressions = {}, []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        ratio = stats["median_s"] / base["median_s"] if base["median_s"] else None
+        comparison[name] = {"baseline_median_s": base["median_s"], "ratio": round(ratio, 3) if ratio else None}
+        if ratio and ratio > 1 + threshold:
+            regressions.append(name)
+    return comparison, regressions
+
+
+def run_mode(args) -> str:
+    return "quick" if args.quick else "full"
+
+
+def main():
+    args = parse_args()
+    output = Path(args.output).resolve() if args.output else None
+    baseline_path = Path(args.baseline).resolve()
+    workdir = Path(tempfile.mkdtemp(prefix="dialdeep_micro_"))
+
+    # Модули проекта используют относительные пути (uploads, incoming_audio, transcriptions)
+    os.chdir(workdir)
+    Path("incoming_audio").mkdir(exist_ok=True)
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{workdir / 'micro.db'}"
+    install_model_stubs()
+
+    loop = asyncio.new_event_loop()
+    cases, cleanup = build_cases(args, loop)
+
+    results = {}
+    # Отладочный вывод измеряемых функций не должен смешиваться с JSON отчетом
+    with contextlib.redirect_stdout(sys.stderr):
+        for name, func, repeats in cases:
+            if args.only and args.only not in name:
+                continue
+            func()  # прогрев
+            results[name] = measure(func, repeats)
+            print(f"{name}: median {results[name]['median_s'] * 1000:.3f} ms")
+        loop.run_until_complete(cleanup())
+    loop.close()
+
+    mode = run_mode(args)
+    report = {"benchmark": "micro", "mode": mode, "results": results, "peak_rss_mb": peak_rss_mb()}
+
+    regressions, mismatch = [], None
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline = {"mode": mode, "results": results}
+        baseline_path.write_text(json.dumps(baseline, indent=2) + "\n", encoding="utf-8")
+        report["baseline_saved"] = str(baseline_path)
+    elif baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        # Базовая линия без режима - старый формат (только результаты)
+        baseline_mode = baseline.get("mode") if "results" in baseline else None
+        if baseline_mode != mode:
+            mismatch = (f"baseline {baseline_path} was recorded in {baseline_mode or 'unknown'} mode, "
+                        f"this run is {mode}; re-run in the same mode or re-save the baseline")
+            report["baseline_mismatch"] = mismatch
+            print(f"Not comparing: {mismatch}", file=sys.stderr)
+        else:
+            report["comparison"], regressions = compare(results, baseline["results"], args.threshold)
+            report["regressions"] = regressions
+
+    write_report(report, output)
+    if mismatch:
+        sys.exit(2)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
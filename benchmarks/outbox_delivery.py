@@ -0,0 +1,168 @@
+"""
+Бенчмарк доставки результатов из `result_outbox` (`outbox.py`) в локальную заглушку API.
+
+Заполняет outbox синтетическими записями звонков и отправляет их `OutboxDispatcher`
+в локальный приемник, который отвечает с задержкой и внедряет сбои:
+- `--failure-rate` - доля запросов с ответом 503 без приема записей;
+- `--lost-ack-rate` - доля запросов, записи которых приняты, но ответ 503
+  (потерянное подтверждение: запись будет доставлена повторно).
+
+Проверяется доставка "хотя бы один раз": каждая запись должна дойти до приемника
+(код выхода 1, если какая-то запись потеряна или осталась в dead-letter).
+Результат - JSON с пропускной способностью, латентностью запросов и числом повторов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.outbox_delivery --records 2000 --max-in-flight 16 --batch-size 20 --failure-rate 0.1
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.common import latency_summary, peak_rss_mb, write_report  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Result outbox delivery benchmark")
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--max-in-flight", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=1, help="Records per request (above 1 - JSON array)")
+    parser.add_argument("--latency", type=float, default=0.005, help="Receiver latency per request, s")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered 503")
+    parser.add_argument("--lost-ack-rate", type=float, default=0.0,
+                        help="Share of requests accepted but answered 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database-url", default=None, help="Defaults to a temporary SQLite database")
+    parser.add_argument("--output", default=None)
+    return parser.parse_args()
+
+
+def record(i):
+    return {
+        "operator": {"id": f"bench_operator_{i % 50}", "name": f"bench_operator_{i % 50}"},
+        "client": {"id": f"+99890{i:07d}", "phone": f"+99890{i:07d}"},
+        "order_id": f"bench-order-{i}", "status_1c": "new", "status_ai": "approved",
+        "call_id": f"bench-call-{i}", "call_info": "benchmark", "datetime": "2024-01-01 10:00:00",
+        "audio_path": f"archive/bench_{i}.ogg", "dialog_txt": "salom " * 50, "flags": {},
+    }
+
+
+async def start_receiver(args, received: Counter, request_latencies: list):
+    """Локальная заглушка внешнего API с задержкой и внедренными сбоями."""
+    from aiohttp import web
+
+    rng = random.Random(args.seed)
+
+    async def handle(request):
+        started = time.perf_counter()
+        body = await request.json()
+        await asyncio.sleep(args.latency)
+        roll = rng.random()
+        if roll < args.failure_rate:
+            return web.json_response({"status": "unavailable"}, status=503)
+        for item in body if isinstance(body, list) else [body]:
+            received[item["order_id"]] += 1
+        request_latencies.append(time.perf_counter() - started)
+        if roll < args.failure_rate + args.lost_ack_rate:
+            return web.json_response({"status": "unavailable"}, status=503)
+        return web.json_response({"status": "success"})
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/test-api", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/test-api"
+
+
+async def run(args):
+    from sqlalchemy import func, select
+
+    from database import async_session_maker, engine
+    from models.models import metadata, result_outbox_table
+    from outbox import OutboxDispatcher, enqueue_results, pending_count
+
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+    async with async_session_maker() as session:
+        for start in range(0, args.records, 500):
+            indexes = range(start, min(start + 500, args.records))
+            await enqueue_results(session, [record(i) for i in indexes], [f"bench_call_{i}" for i in indexes])
+        await session.commit()
+
+    received, request_latencies = Counter(), []
+    runner, url = await start_receiver(args, received, request_latencies)
+    dispatcher = OutboxDispatcher(url, args.max_in_flight, args.batch_size, max_attempts=50, poll_interval=0.05)
+    started = time.perf_counter()
+    try:
+        # Строки, ждущие повтора, становятся доступными позже: отправляем, пока очередь не опустеет
+        while True:
+            await dispatcher.run(until_idle=True)
+            async with async_session_maker() as session:
+                if not await pending_count(session):
+                    break
+            await asyncio.sleep(0.05)
+        seconds = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+
+    async with async_session_maker() as session:
+        statuses = dict((await session.execute(
+            select(result_outbox_table.c.status, func.count()).group_by(result_outbox_table.c.status)
+        )).fetchall())
+        attempts = await session.scalar(select(func.sum(result_outbox_table.c.attempts)))
+    await engine.dispose()
+
+    expected = {record(i)["order_id"] for i in range(args.records)}
+    missing = len(expected - set(received))
+    return {
+        "delivery": {
+            "records": args.records,
+            "seconds": round(seconds, 3),
+            "records_per_second": round(args.records / seconds, 1),
+            "attempts": attempts,
+            "statuses": statuses,
+            "received": sum(received.values()),
+            "duplicates": sum(count - 1 for count in received.values()),
+            "missing": missing,
+        },
+        "accepted_request_latency": latency_summary(request_latencies),
+    }, missing == 0 and not statuses.get("dead")
+
+
+def main():
+    args = parse_args()
+    output = Path(args.output).resolve() if args.output else None
+    workdir = Path(tempfile.mkdtemp(prefix="dialdeep_outbox_")).resolve()
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{workdir / 'bench.db'}"
+    # Повторы без многосекундных задержек, чтобы прогон с внедренными сбоями был коротким
+    os.environ.setdefault("RESULT_OUTBOX_RETRY_SECONDS", "0.05")
+    os.environ.setdefault("RESULT_OUTBOX_RETRY_MAX_SECONDS", "0.5")
+    os.chdir(workdir)
+
+    started = time.perf_counter()
+    results, delivered = asyncio.run(run(args))
+    report = {
+        "benchmark": "outbox_delivery",
+        "config": {k: v for k, v in vars(args).items() if k not in ("output",)},
+        **results,
+        "at_least_once": delivered,
+        "wall_seconds": round(time.perf_counter() - started, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    write_report(report, output)
+    sys.exit(0 if delivered else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Сравнение backend классификатора тональности: PyTorch (eager) и ONNX Runtime fp32/int8.
+
+Загружает настоящую модель `SENTIMENT_MODEL` (или `--model`), при необходимости
+экспортирует ее в ONNX (`sentiment_onnx.export`) во временный каталог и для каждого
+backend измеряет латентность одного вызова (токенизация + инференс, как в
+`sentiment.predict_sentiment`) на синтетических текстах разной длины, пропускную
+способность и расхождение логитов с PyTorch.
+
+Запуск из корня репозитория:
+    python -m benchmarks.sentiment_backends --texts 200 --threads 4 --output bench_sentiment.json
+    python -m benchmarks.sentiment_backends --onnx-dir onnx/sentiment   # уже экспортированная модель
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.common import latency_summary, peak_rss_mb, write_report  # noqa: E402
+from benchmarks.stubs import synthetic_text  # noqa: E402
+from config import SENTIMENT_MODEL  # noqa: E402
+import sentiment_onnx  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sentiment backend benchmark (PyTorch vs ONNX Runtime)")
+    parser.add_argument("--model", default=SENTIMENT_MODEL)
+    parser.add_argument("--onnx-dir", default=None, help="Exported models; defaults to a fresh export")
+    parser.add_argument("--texts", type=int, default=100, help="Number of synthetic texts")
+    parser.add_argument("--threads", type=int, default=1, help="Intra-op threads for both backends")
+    parser.add_argument("--optimization", default="all", choices=["disable", "basic", "extended", "all"])
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--output", default=None)
+    return parser.parse_args()
+
+
+def texts_for(count):
+    """Тексты сегментов от нескольких слов до 512+ токенов (транскрипции 5-300 секунд)."""
+    lengths = (5, 30, 90, 300)
+    return [synthetic_text(i, lengths[i % len(lengths)], "operator" if i % 2 else "client") for i in range(count)]
+
+
+def run_backend(model, tokenizer, texts, warmup):
+    import torch
+
+    for text in texts[:warmup]:
+        model(**tokenizer(text, return_tensors="pt", truncation=True, padding=True))
+    latencies = []
+    started = time.perf_counter()
+    with torch.no_grad():
+        for text in texts:
+            call_started = time.perf_counter()
+            inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
+            torch.softmax(model(**inputs).logits, dim=-1)
+            latencies.append(time.perf_counter() - call_started)
+    total = time.perf_counter() - started
+    return {"latency": latency_summary(latencies), "texts_per_second": round(len(texts) / total, 2)}
+
+
+def main():
+    args = parse_args()
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    torch.set_num_threads(args.threads)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    reference = AutoModelForSequenceClassification.from_pretrained(args.model).eval()
+    texts = texts_for(args.texts)
+
+    onnx_dir = Path(args.onnx_dir) if args.onnx_dir else Path(tempfile.mkdtemp(prefix="dialdeep_onnx_"))
+    if not (onnx_dir / sentiment_onnx.MODEL_FILE).exists():
+        sentiment_onnx.export(args.model, onnx_dir, quantize=True)
+
+    results = {"torch": run_backend(reference, tokenizer, texts, args.warmup)}
+    for quantized in (False, True):
+        path = sentiment_onnx.model_path(onnx_dir, quantized)
+        if not path.exists():
+            continue
+        options = sentiment_onnx.session_options(args.threads, 1, args.optimization)
+        model = sentiment_onnx.OnnxSequenceClassifier(path, options)
+        name = "onnx_int8" if quantized else "onnx_fp32"
+        results[name] = run_backend(model, tokenizer, texts, args.warmup)
+        results[name]["parity"] = sentiment_onnx.parity(reference, tokenizer, model, texts[:50])
+        results[name]["speedup_p50"] = round(
+            results["torch"]["latency"]["p50_ms"] / results[name]["latency"]["p50_ms"], 2)
+
+    write_report({
+        "benchmark": "sentiment_backends",
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Сравнение движков STT (`stt_engines`): transformers (PyTorch) и CTranslate2 (faster-whisper).
+
+Каждый движок загружает настоящую модель (`STT_MODEL` и `STT_CT2_MODEL`) и распознает
+одни и те же записи: `--audio` (WAV сегменты звонков) или синтетические. Аудио заранее
+декодируется в 16 кГц моно, поэтому измеряется только распознавание. В отчете время
+загрузки, латентность на запись, real-time factor и тексты первых записей для сверки.
+
+Запуск из корня репозитория:
+    python -m benchmarks.stt_engines --audio incoming_audio/*.wav --threads 4 --output bench_stt.json
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.common import latency_summary, peak_rss_mb, write_report, write_synthetic_call  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="STT engine benchmark (transformers vs CTranslate2)")
+    parser.add_argument("--engines", default="transformers,ctranslate2")
+    parser.add_argument("--audio", nargs="*", default=None, help="WAV files; defaults to synthetic 30 s segments")
+    parser.add_argument("--files", type=int, default=8, help="Number of synthetic files")
+    parser.add_argument("--threads", type=int, default=4, help="torch threads / CTranslate2 cpu_threads")
+    parser.add_argument("--output", default=None)
+    return parser.parse_args()
+
+
+def load_audio(path):
+    """WAV -> вход движка `{"raw": float32 16 кГц моно, "sampling_rate": 16000}`."""
+    import numpy as np
+    from pydub import AudioSegment
+
+    audio = AudioSegment.from_wav(path).set_channels(1).set_frame_rate(16000).set_sample_width(2)
+    samples = np.frombuffer(audio.raw_data, dtype=np.int16)
+    return {"raw": np.multiply(samples, 1 / 32768, dtype=np.float32), "sampling_rate": 16000}
+
+
+def main():
+    args = parse_args()
+    import torch
+
+    import stt_engines
+
+    torch.set_num_threads(args.threads)
+    if args.audio:
+        files = [str(Path(path)) for path in args.audio]
+    else:
+        workdir = Path(tempfile.mkdtemp(prefix="dialdeep_stt_"))
+        files = []
+        for i in range(args.files):
+            path = workdir / f"segment_{i}_MIC.wav"
+            write_synthetic_call(path, 30, "MIC", i, frame_rate=16000)
+            files.append(str(path))
+    inputs = [load_audio(path) for path in files]
+    audio_seconds = sum(len(item["raw"]) / item["sampling_rate"] for item in inputs)
+
+    results = {}
+    for name in args.engines.split(","):
+        started = time.perf_counter()
+        if name == "ctranslate2":
+            engine = stt_engines.CTranslate2Engine(cpu_threads=args.threads, workers=1)
+        else:
+            engine = stt_engines.create_engine(name)
+        load_seconds = time.perf_counter() - started
+
+        engine(inputs[0])
+        latencies, texts = [], []
+        total_started = time.perf_counter()
+        for item in inputs:
+            call_started = time.perf_counter()
+            texts.append(engine(item, return_timestamps=True)["text"])
+            latencies.append(time.perf_counter() - call_started)
+        total = time.perf_counter() - total_started
+        results[name] = {
+            "load_seconds": round(load_seconds, 3),
+            "latency": latency_summary(latencies),
+            "real_time_factor": round(total / audio_seconds, 4) if audio_seconds else None,
+            "sample_texts": texts[:3],
+        }
+
+    if "transformers" in results:
+        for name, result in results.items():
+            if result["real_time_factor"]:
+                result["speedup"] = round(results["transformers"]["real_time_factor"] / result["real_time_factor"], 2)
+
+    write_report({
+        "benchmark": "stt_engines",
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "audio")},
+        "files": len(files),
+        "audio_seconds": round(audio_seconds, 1),
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
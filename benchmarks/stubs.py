@@ -0,0 +1,141 @@
+"""
+Детерминированные заглушки моделей для бенчмарков.
+
+`install_model_stubs()` подменяет загрузку моделей в `transformers` и обращение к GPT
+в `freeGPTFix`, поэтому `stt_model`, `sentiment` и `text_analysis` работают без
+скачивания весов и без сети, а результаты стабильны на машинах только с CPU.
+Функцию нужно вызвать до импорта этих модулей.
+"""
+import time
+import zlib
+from types import SimpleNamespace
+
+import numpy as np
+
+OPERATOR_PHRASES = [
+    "assalomu alaykum euphoria kompaniyasidan bosh mutaxasis bo'laman",
+    "ismingiz nima", "sizni nima bezovta qilayobdi", "urion prostatadagi infeksiya va yallig'lanish",
+    "qon aylanishlarini yaxshilab beradi", "3 kundan 5 kun ichida effekt ko'rasiz", "buyurtmani rasmiylashtiramiz",
+]
+CLIENT_PHRASES = [
+    "salom", "ha eshitaman", "mening ismim", "qayeringiz og'riyobdi deb so'radingiz", "narxi qancha",
+    "yaxshi olaman", "manzilga yetkazib bering",
+]
+
+
+def _seed(value) -> int:
+    return zlib.crc32(str(value).encode("utf-8"))
+
+
+def synthetic_text(key, seconds: float, role: str) -> str:
+    """Детерминированный текст, пропорциональный длительности аудио (~2 слова в секунду)."""
+    phrases = OPERATOR_PHRASES if role == "operator" else CLIENT_PHRASES
+    rng = np.random.default_rng(_seed(key))
+    words = []
+    while len(words) < max(1, int(seconds * 2)):
+        words.extend(phrases[rng.integers(len(phrases))].split())
+    return " ".join(words)
+
+
+class StubASRPipeline:
+    """Заглушка `AutomaticSpeechRecognitionPipeline` с настраиваемым real-time factor."""
+
+    def __init__(self, rtf: float = 0.0, sampling_rate: int = 16000, **kwargs):
+        self.rtf = rtf
+        self.sampling_rate = sampling_rate
+
+    def _transcribe_one(self, audio, index=0):
+        from audio_processor import audio_duration
+
+        if isinstance(audio, dict):
+            seconds = len(audio["raw"]) / audio["sampling_rate"]
+            key, role = f"{index}:{len(audio['raw'])}", "operator" if index == 0 else "client"
+        else:
+            seconds = audio_duration(audio)
+            key, role = audio, "client" if "SPEAKER" in str(audio).upper() else "operator"
+
+        if self.rtf:
+            time.sleep(seconds * self.rtf)
+
+        text = synthetic_text(key, seconds, role)
+        words = text.split()
+        step = seconds / len(words)
+        chunks, start = [], 0.0
+        for i in range(0, len(words), 6):
+            end = min(seconds, start + step * 6)
+            chunks.append({"timestamp": (round(start, 2), round(end, 2)), "text": " " + " ".join(words[i:i + 6])})
+            start = end
+        return {"text": text, "chunks": chunks}
+
+    def __call__(self, inputs, batch_size=None, **kwargs):
+        if isinstance(inputs, list):
+            return [self._transcribe_one(audio, i) for i, audio in enumerate(inputs)]
+        return self._transcribe_one(inputs)
+
+
+class _StubSpeechModel:
+    def to(self, device):
+        return self
+
+
+class StubTokenizer:
+    """Заглушка токенизатора: хэш слов, не более 512 токенов."""
+
+    def __call__(self, text, return_tensors=None, truncation=True, padding=True, **kwargs):
+        import torch
+
+        ids = [_seed(word) % 30000 for word in text.split()][:512] or [0]
+        return {"input_ids": torch.tensor([ids]), "attention_mask": torch.ones(1, len(ids), dtype=torch.long)}
+
+
+class StubSequenceClassifier:
+    """Заглушка классификатора тональности с детерминированными логитами и настраиваемой задержкой."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def __call__(self, input_ids=None, **kwargs):
+        import torch
+
+        if self.latency:
+            time.sleep(self.latency)
+        seed = int(input_ids.sum().item())
+        positive = (seed % 1000) / 1000 * 4 - 2
+        return SimpleNamespace(logits=torch.tensor([[-positive, positive]], dtype=torch.float32))
+
+    def eval(self):
+        return self
+
+
+def install_model_stubs(stt_rtf: float = 0.0, sentiment_latency: float = 0.0):
+    """
+    Подменяет загрузку моделей STT и тональности и ответы GPT детерминированными заглушками.
+
+    Аргументы:
+        stt_rtf (float): Имитируемый real-time factor STT (0 - без задержки).
+        sentiment_latency (float): Имитируемая задержка инференса тональности в секундах.
+    """
+    import importlib
+
+    # transformers загружает атрибуты лениво и при этом может заменить модуль в sys.modules:
+    # сначала разрешаем имена, затем подменяем их в актуальном объекте модуля
+    for name in ("AutoModelForSpeechSeq2Seq", "AutoTokenizer", "WhisperProcessor",
+                 "AutomaticSpeechRecognitionPipeline", "AutoModelForSequenceClassification"):
+        getattr(importlib.import_module("transformers"), name)
+    transformers = importlib.import_module("transformers")
+
+    transformers.AutoModelForSpeechSeq2Seq.from_pretrained = staticmethod(lambda *a, **k: _StubSpeechModel())
+    transformers.AutoTokenizer.from_pretrained = staticmethod(lambda *a, **k: StubTokenizer())
+    transformers.WhisperProcessor.from_pretrained = staticmethod(
+        lambda *a, **k: SimpleNamespace(feature_extractor=SimpleNamespace(sampling_rate=16000))
+    )
+    transformers.AutomaticSpeechRecognitionPipeline = lambda **kwargs: StubASRPipeline(rtf=stt_rtf)
+    transformers.AutoModelForSequenceClassification.from_pretrained = staticmethod(
+        lambda *a, **k: StubSequenceClassifier(sentiment_latency)
+    )
+
+    from freeGPTFix import Client
+
+    Client.create_completion = (
+        lambda model, prompt: "Buyurtma tasdiqlandi" if _seed(prompt) % 2 else "Buyurtma tasdiqlanmadi"
+    )
@@ -6,8 +6,179 @@ UPLOAD_FOLDER = Path('uploads')
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 INCOMING_AUDIO_DIR = Path('./incoming_audio')
 
+# Стерео записи: номер канала оператора (MIC), второй канал - клиент (SPEAKER)
+STEREO_OPERATOR_CHANNEL = int(os.getenv('STEREO_OPERATOR_CHANNEL', 0))
+
 DB_NAME = os.getenv('DB_NAME')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_HOST = os.getenv('DB_HOST')
 DB_PORT = os.getenv('DB_PORT')
+# Полный URL БД (например, SQLite для бенчмарков); по умолчанию собирается из DB_*
+DATABASE_URL = os.getenv('DATABASE_URL')
+
+# Запуск API в production (`python serve.py`): количество процессов uvicorn (0 - по числу ядер)
+API_HOST = os.getenv('API_HOST', '0.0.0.0')
+API_PORT = int(os.getenv('API_PORT', 8082))
+API_WORKERS = int(os.getenv('API_WORKERS', 0))
+
+# Внешний API для отправки результатов
+RESULT_API_URL = os.getenv('RESULT_API_URL', 'http://127.0.0.1:8000/test-api')
+
+# Очередь задач в БД для распределения транскрипции по нескольким узлам
+JOB_QUEUE_ENABLED = os.getenv('JOB_QUEUE_ENABLED', 'false').lower() == 'true'
+JOB_QUEUE_INLINE_AUDIO = os.getenv('JOB_QUEUE_INLINE_AUDIO', 'false').lower() == 'true'
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 120))
+JOB_HEARTBEAT_SECONDS = int(os.getenv('JOB_HEARTBEAT_SECONDS', 30))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY_SECONDS = int(os.getenv('JOB_RETRY_DELAY_SECONDS', 10))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1.0))
+
+# Количество потоков, в которых run.py обрабатывает новые аудиофайлы
+WATCHER_WORKERS = int(os.getenv('WATCHER_WORKERS', 2))
+
+# Порты экспортеров метрик Prometheus для фоновых процессов (0 - отключено)
+WATCHER_METRICS_PORT = int(os.getenv('WATCHER_METRICS_PORT', 9101))
+MERGER_METRICS_PORT = int(os.getenv('MERGER_METRICS_PORT', 9102))
+STT_WORKER_METRICS_PORT = int(os.getenv('STT_WORKER_METRICS_PORT', 0))
+
+# Профилирование запросов /upload: заголовок Server-Timing отдается всегда,
+# профиль cProfile и tracemalloc снимается для всех запросов (PROFILING_ENABLED)
+# или по заголовку `X-Profile: 1` (PROFILING_HEADER_ENABLED)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_HEADER_ENABLED = os.getenv('PROFILING_HEADER_ENABLED', 'false').lower() == 'true'
+PROFILES_DIR = Path(os.getenv('PROFILES_DIR', 'profiles'))
+PROFILING_TRACEMALLOC_TOP = int(os.getenv('PROFILING_TRACEMALLOC_TOP', 25))
+
+# Архив аудио: после сохранения звонка в БД оригиналы перекодируются в FLAC (без потерь)
+# или Opus, промежуточные сегменты удаляются. Уровни хранения: через ARCHIVE_FLAC_DAYS дней
+# FLAC перекодируется в Opus, через ARCHIVE_RETENTION_DAYS дней архив удаляется (0 - никогда)
+ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', 'true').lower() == 'true'
+ARCHIVE_DIR = Path(os.getenv('ARCHIVE_DIR', 'archive'))
+ARCHIVE_CODEC = os.getenv('ARCHIVE_CODEC', 'flac')
+ARCHIVE_OPUS_BITRATE = os.getenv('ARCHIVE_OPUS_BITRATE', '32k')
+ARCHIVE_FLAC_DAYS = int(os.getenv('ARCHIVE_FLAC_DAYS', 30))
+ARCHIVE_RETENTION_DAYS = int(os.getenv('ARCHIVE_RETENTION_DAYS', 0))
+# Звонки, сегменты которых так и не были транскрибированы, архивируются принудительно
+ARCHIVE_FORCE_AFTER_HOURS = int(os.getenv('ARCHIVE_FORCE_AFTER_HOURS', 24))
+# Фоновый компактор: интервал проходов и ограничение скорости ввода-вывода (МБ/с, 0 - без ограничения)
+ARCHIVE_COMPACT_INTERVAL = int(os.getenv('ARCHIVE_COMPACT_INTERVAL', 600))
+ARCHIVE_IO_RATE_MB = float(os.getenv('ARCHIVE_IO_RATE_MB', 5))
+PROCESSED_FILES_PATH = Path(os.getenv('PROCESSED_FILES_PATH', 'processed_files.txt'))
+
+# Асинхронный прием /upload: ответ 202 сразу после сохранения файлов, сегментация в задаче
+# `ingest` очереди job_queue; количество воркеров приема в процессе API (0 - только `python ingest.py`)
+UPLOAD_ASYNC = os.getenv('UPLOAD_ASYNC', 'true').lower() in ('1', 'true', 'yes')
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 1))
+
+# Дедупликация /upload по ключу идемпотентности (call_id) и хешу аудио
+UPLOAD_DEDUP_ENABLED = os.getenv('UPLOAD_DEDUP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Полнотекстовый поиск по транскрипциям: максимальный размер страницы /search
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 100))
+
+# Повторная обработка звонков (backfill.py): процессы, размер пачки записи в БД,
+# ограничение скорости (звонков в час, 0 - без ограничения) и приоритет процессов
+BACKFILL_WORKERS = int(os.getenv('BACKFILL_WORKERS', 2))
+BACKFILL_BATCH_SIZE = int(os.getenv('BACKFILL_BATCH_SIZE', 20))
+BACKFILL_RATE_PER_HOUR = float(os.getenv('BACKFILL_RATE_PER_HOUR', 0))
+BACKFILL_NICE = int(os.getenv('BACKFILL_NICE', 10))
+BACKFILL_CHECKPOINT_DIR = Path(os.getenv('BACKFILL_CHECKPOINT_DIR', 'backfill'))
+
+# События обработки звонков (SSE /calls/{call}/events): брокер memory, postgres или auto
+# (postgres для PostgreSQL), количество хранимых событий звонка и время их хранения в секундах
+EVENTS_BROKER = os.getenv('EVENTS_BROKER', 'auto')
+EVENTS_HISTORY = int(os.getenv('EVENTS_HISTORY', 200))
+EVENTS_TTL = float(os.getenv('EVENTS_TTL', 3600))
+
+# Потоковая транскрипция по WebSocket: шаг промежуточного распознавания, максимальная длина
+# фразы и пауза, завершающая фразу (секунды), порог тишины (RMS), лимит одновременных
+# потоков на ядро CPU (STREAM_MAX_STREAMS > 0 задает общий лимит явно)
+STREAM_STEP_SECONDS = float(os.getenv('STREAM_STEP_SECONDS', 1.0))
+STREAM_WINDOW_SECONDS = float(os.getenv('STREAM_WINDOW_SECONDS', 10))
+STREAM_SILENCE_SECONDS = float(os.getenv('STREAM_SILENCE_SECONDS', 0.6))
+STREAM_SILENCE_RMS = float(os.getenv('STREAM_SILENCE_RMS', 0.01))
+STREAM_STREAMS_PER_CORE = float(os.getenv('STREAM_STREAMS_PER_CORE', 0.5))
+STREAM_MAX_STREAMS = int(os.getenv('STREAM_MAX_STREAMS', 0))
+
+# Классификатор тональности: backend torch (transformers) или onnx (ONNX Runtime, модель из
+# `python sentiment_onnx.py`), каталог экспортированной модели, int8 версия, потоки сессии
+# (intra - внутри оператора, inter - между операторами, 0 - по умолчанию ONNX Runtime) и
+# уровень оптимизации графа: disable, basic, extended или all
+SENTIMENT_MODEL = os.getenv('SENTIMENT_MODEL', 'blackhole33/finetuning-sentiment-model-uzb')
+SENTIMENT_BACKEND = os.getenv('SENTIMENT_BACKEND', 'torch').lower()
+SENTIMENT_ONNX_DIR = Path(os.getenv('SENTIMENT_ONNX_DIR', 'onnx/sentiment'))
+SENTIMENT_ONNX_QUANTIZED = os.getenv('SENTIMENT_ONNX_QUANTIZED', 'false').lower() in ('1', 'true', 'yes')
+SENTIMENT_ONNX_INTRA_THREADS = int(os.getenv('SENTIMENT_ONNX_INTRA_THREADS', 0))
+SENTIMENT_ONNX_INTER_THREADS = int(os.getenv('SENTIMENT_ONNX_INTER_THREADS', 0))
+SENTIMENT_ONNX_OPTIMIZATION = os.getenv('SENTIMENT_ONNX_OPTIMIZATION', 'all').lower()
+
+# Движок STT: transformers (пайплайн Whisper на PyTorch) или ctranslate2 (faster-whisper,
+# модель из `python stt_engines.py --convert`), тип вычислений CTranslate2 (int8, int8_float32,
+# float32, ...), потоки CPU на распознавание (0 - по умолчанию), количество параллельных
+# распознаваний, размер beam и язык (пусто - автоопределение)
+STT_MODEL = os.getenv('STT_MODEL', 'STT_model')
+STT_ENGINE = os.getenv('STT_ENGINE', 'transformers').lower()
+STT_CT2_MODEL = os.getenv('STT_CT2_MODEL', 'STT_model_ct2')
+STT_CT2_COMPUTE_TYPE = os.getenv('STT_CT2_COMPUTE_TYPE', 'int8')
+STT_CT2_THREADS = int(os.getenv('STT_CT2_THREADS', 0))
+STT_CT2_WORKERS = int(os.getenv('STT_CT2_WORKERS', 2))
+STT_CT2_BEAM_SIZE = int(os.getenv('STT_CT2_BEAM_SIZE', 1))
+STT_LANGUAGE = os.getenv('STT_LANGUAGE') or None
+
+# Запуск STT воркеров с общими весами моделей (prefork.py): количество процессов, потоки
+# torch на процесс (0 - ядра поровну между процессами) и интервал отчета о памяти (секунды)
+PREFORK_WORKERS = int(os.getenv('PREFORK_WORKERS', 2))
+PREFORK_THREADS = int(os.getenv('PREFORK_THREADS', 0))
+PREFORK_REPORT_INTERVAL = int(os.getenv('PREFORK_REPORT_INTERVAL', 300))
+# Перезапуск упавших воркеров prefork.py: задержка удваивается с каждым падением слота
+# (от PREFORK_RESTART_BACKOFF до PREFORK_RESTART_BACKOFF_MAX секунд); после PREFORK_MAX_RESTARTS
+# падений одного слота за PREFORK_RESTART_WINDOW секунд процесс останавливается с ошибкой
+PREFORK_RESTART_BACKOFF = float(os.getenv('PREFORK_RESTART_BACKOFF', 1))
+PREFORK_RESTART_BACKOFF_MAX = float(os.getenv('PREFORK_RESTART_BACKOFF_MAX', 60))
+PREFORK_MAX_RESTARTS = int(os.getenv('PREFORK_MAX_RESTARTS', 5))
+PREFORK_RESTART_WINDOW = float(os.getenv('PREFORK_RESTART_WINDOW', 300))
+
+# Запись результатов analyze_text в call_analysis: пачка пишется одним запросом, когда в
+# буфере набралось ANALYSIS_BATCH_SIZE строк или прошло ANALYSIS_FLUSH_SECONDS секунд;
+# при недоступной БД в буфере держится не больше ANALYSIS_BUFFER_LIMIT строк
+ANALYSIS_DB_ENABLED = os.getenv('ANALYSIS_DB_ENABLED', 'true').lower() == 'true'
+ANALYSIS_BATCH_SIZE = int(os.getenv('ANALYSIS_BATCH_SIZE', 200))
+ANALYSIS_FLUSH_SECONDS = float(os.getenv('ANALYSIS_FLUSH_SECONDS', 2.0))
+ANALYSIS_BUFFER_LIMIT = int(os.getenv('ANALYSIS_BUFFER_LIMIT', 10000))
+
+# Кэш id операторов и клиентов при сохранении звонков: количество записей на каждый кэш
+# (0 - отключен) и время жизни записи в секундах
+ID_CACHE_SIZE = int(os.getenv('ID_CACHE_SIZE', 10000))
+ID_CACHE_TTL = float(os.getenv('ID_CACHE_TTL', 3600))
+
+# Секции call_info по месяцам (partitions.py): на сколько месяцев вперед создавать секции,
+# сколько месяцев хранить звонки (0 - бессрочно) и что делать с истекшими секциями:
+# detach (отсоединить, таблица остается для выгрузки в архив) или drop (удалить)
+CALL_INFO_PARTITION_AHEAD_MONTHS = int(os.getenv('CALL_INFO_PARTITION_AHEAD_MONTHS', 3))
+CALL_INFO_RETENTION_MONTHS = int(os.getenv('CALL_INFO_RETENTION_MONTHS', 0))
+CALL_INFO_RETENTION_MODE = os.getenv('CALL_INFO_RETENTION_MODE', 'detach')
+
+# Планировщик очереди STT (scheduler.py): веса классов приоритета, интервал старения
+# (секунды, 0 - без старения), класс по источнику загрузки (поле `source` в /upload)
+# и класс загрузок без источника
+SCHEDULER_WEIGHTS = os.getenv('SCHEDULER_WEIGHTS', 'realtime=8,normal=3,bulk=1')
+SCHEDULER_AGING_SECONDS = float(os.getenv('SCHEDULER_AGING_SECONDS', 600))
+SCHEDULER_SOURCES = os.getenv('SCHEDULER_SOURCES', 'live_qa=realtime,dialer=normal,import=bulk,backfill=bulk')
+SCHEDULER_DEFAULT_CLASS = os.getenv('SCHEDULER_DEFAULT_CLASS', 'normal')
+
+# Доставка результатов во внешний API через таблицу result_outbox (outbox.py): число
+# одновременных запросов, записей в одном запросе (1 - объект, больше - JSON массив),
+# попыток до dead-letter, задержка повтора (удваивается с каждой попыткой, не больше
+# максимума), аренда строки отправителем, время ожидания архивации аудио перед отправкой,
+# интервал опроса, таймаут запроса (секунды) и запуск отправителя в процессе example.py
+RESULT_OUTBOX_MAX_IN_FLIGHT = int(os.getenv('RESULT_OUTBOX_MAX_IN_FLIGHT', 16))
+RESULT_OUTBOX_BATCH_SIZE = int(os.getenv('RESULT_OUTBOX_BATCH_SIZE', 1))
+RESULT_OUTBOX_MAX_ATTEMPTS = int(os.getenv('RESULT_OUTBOX_MAX_ATTEMPTS', 10))
+RESULT_OUTBOX_RETRY_SECONDS = float(os.getenv('RESULT_OUTBOX_RETRY_SECONDS', 5))
+RESULT_OUTBOX_RETRY_MAX_SECONDS = float(os.getenv('RESULT_OUTBOX_RETRY_MAX_SECONDS', 900))
+RESULT_OUTBOX_LEASE_SECONDS = int(os.getenv('RESULT_OUTBOX_LEASE_SECONDS', 120))
+RESULT_OUTBOX_HOLD_SECONDS = float(os.getenv('RESULT_OUTBOX_HOLD_SECONDS', 600))
+RESULT_OUTBOX_POLL_INTERVAL = float(os.getenv('RESULT_OUTBOX_POLL_INTERVAL', 1.0))
+RESULT_API_TIMEOUT = float(os.getenv('RESULT_API_TIMEOUT', 30))
+RESULT_OUTBOX_IN_MERGER = os.getenv('RESULT_OUTBOX_IN_MERGER', 'true').lower() == 'true'
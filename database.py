@@ -1,19 +1,32 @@
+from datetime import datetime, timedelta, timezone
 from typing import AsyncGenerator
 
+from sqlalchemy import func
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-from config import DB_NAME, DB_PORT, DB_HOST, DB_USER, DB_PASSWORD
+from config import DB_NAME, DB_PORT, DB_HOST, DB_USER, DB_PASSWORD, DATABASE_URL as DATABASE_URL_OVERRIDE
+from metrics import DB_POOL_CHECKED_OUT, DB_POOL_SIZE
 
-DATABASE_URL = f'postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+DATABASE_URL = DATABASE_URL_OVERRIDE or f'postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
 
 engine = create_async_engine(DATABASE_URL)
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=True)
 
+DB_POOL_CHECKED_OUT.set_function(lambda: engine.sync_engine.pool.checkedout())
+DB_POOL_SIZE.set_function(lambda: engine.sync_engine.pool.size())
+
 Base = declarative_base()
 
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+def db_time_after(session: AsyncSession, seconds: float):
+    """Момент через `seconds` секунд от текущего времени БД (SQLite не прибавляет interval к CURRENT_TIMESTAMP)."""
+    if session.bind.dialect.name == "sqlite":
+        return datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=seconds)
+    return func.now() + timedelta(seconds=seconds)
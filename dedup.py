@@ -0,0 +1,104 @@
+"""
+Идемпотентность /upload: повторы дозвонщика после таймаута не запускают обработку заново.
+
+Загрузка регистрируется в `upload_dedup` дважды:
+1. ключ идемпотентности (`call_id`) - до записи файлов; если ключ уже есть, сразу
+   возвращается существующий звонок;
+2. sha256 аудио, посчитанный потоково при записи файлов, - до декодирования и STT;
+   совпадение хеша с другой загрузкой тоже считается повтором.
+Уникальные индексы таблицы делают проверку атомарной при одновременных повторах.
+"""
+import hashlib
+from typing import Dict, Optional
+
+import aiofiles
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import UPLOAD_FOLDER
+from job_queue import find_ingest_job
+from models.models import upload_dedup_table
+from utils import call_record
+
+CHUNK_SIZE = 1024 * 1024
+
+
+async def write_hashed(upload_file, destination, hasher) -> int:
+    """Записывает загруженный файл кусками, одновременно обновляя хеш. Возвращает размер."""
+    size = 0
+    async with aiofiles.open(destination, "wb") as f:
+        while chunk := await upload_file.read(CHUNK_SIZE):
+            hasher.update(chunk)
+            await f.write(chunk)
+            size += len(chunk)
+    await upload_file.seek(0)
+    return size
+
+
+def new_hasher():
+    return hashlib.sha256()
+
+
+async def _find(session: AsyncSession, column, value):
+    result = await session.execute(select(upload_dedup_table).where(column == value))
+    return result.fetchone()
+
+
+async def claim_key(session: AsyncSession, key: str, call: str):
+    """
+    Регистрирует ключ идемпотентности за новой загрузкой.
+
+    Возвращает:
+        Row | None: Запись предыдущей загрузки с тем же ключом или None, если ключ новый.
+    """
+    try:
+        await session.execute(insert(upload_dedup_table).values(idempotency_key=key, call=call))
+        await session.commit()
+        return None
+    except IntegrityError:
+        await session.rollback()
+        return await _find(session, upload_dedup_table.c.idempotency_key, key)
+
+
+async def claim_content(session: AsyncSession, content_hash: str, call: str, key: Optional[str] = None):
+    """
+    Регистрирует хеш аудио загрузки (в строке ключа, если он был передан).
+
+    Возвращает:
+        Row | None: Запись загрузки с тем же содержимым или None, если содержимое новое.
+    """
+    try:
+        if key:
+            await session.execute(update(upload_dedup_table).where(upload_dedup_table.c.call == call)
+                                  .values(content_hash=content_hash))
+        else:
+            await session.execute(insert(upload_dedup_table).values(content_hash=content_hash, call=call))
+        await session.commit()
+        return None
+    except IntegrityError:
+        await session.rollback()
+        return await _find(session, upload_dedup_table.c.content_hash, content_hash)
+
+
+async def release(session: AsyncSession, call: str):
+    """Снимает регистрацию загрузки (повтор или ошибка обработки), чтобы следующий повтор прошел."""
+    await session.rollback()
+    await session.execute(delete(upload_dedup_table).where(upload_dedup_table.c.call == call))
+    await session.commit()
+
+
+async def duplicate_response(session: AsyncSession, previous) -> Dict:
+    """
+    Ответ на повторную загрузку: звонок первой загрузки, ее задача приема и, если звонок
+    уже сохранен, его запись.
+    """
+    response = {"message": "Duplicate upload, returning the existing call.", "call": previous.call,
+                "duplicate": True}
+    job_id = await find_ingest_job(session, UPLOAD_FOLDER / previous.call)
+    if job_id:
+        response["job_id"] = job_id
+    record = await call_record(session, previous.call)
+    if record:
+        response["result"] = record
+    return response
@@ -0,0 +1,254 @@
+"""
+События обработки звонков для потока `/calls/{call}/events` (Server-Sent Events).
+
+Этапы конвейера публикуют события по звонку (имени папки запроса):
+    segmented   - аудио разделено на сегменты (API);
+    transcribed - готова транскрипция сегмента, с частичным текстом (STT);
+    merged      - транскрипции объединены в диалог (слияние);
+    saved, archived, sent, failed - запись в БД, архив и отправка результата.
+
+Брокеры:
+    memory   - pub/sub в памяти процесса API (события других процессов не видны);
+    postgres - LISTEN/NOTIFY PostgreSQL: этапы в отдельных процессах (run.py, example.py,
+               stt_worker.py) публикуют через NOTIFY, API слушает канал и раздает события
+               подписчикам из памяти.
+Последние события звонка хранятся в памяти, поэтому клиент, подключившийся после
+завершения этапа (короткие звонки), сразу получает уже прошедшие события.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from typing import AsyncIterator, Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+
+from config import EVENTS_BROKER, EVENTS_HISTORY, EVENTS_TTL
+from database import DATABASE_URL, engine
+from metrics import EVENT_SUBSCRIBERS
+
+EVENT_CHANNEL = "call_events"
+TERMINAL_STAGES = ("sent",)
+# Полезная нагрузка NOTIFY ограничена 8000 байтами
+MAX_TEXT_LENGTH = 2000
+# Сколько событий `publish_sync` хранится до запуска цикла событий брокера
+PENDING_LIMIT = 1000
+# Время ожидания NOTIFY из `publish_sync`, с
+NOTIFY_TIMEOUT = 5.0
+
+
+class MemoryBroker:
+    """Pub/sub в памяти процесса с историей последних событий каждого звонка."""
+
+    def __init__(self, history: int = EVENTS_HISTORY, ttl: float = EVENTS_TTL):
+        self.history_size = history
+        self.ttl = ttl
+        self._history: Dict[str, deque] = {}
+        self._touched: Dict[str, float] = {}
+        self._seq: Dict[str, int] = defaultdict(int)
+        self._subscribers: Dict[str, set] = defaultdict(set)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: deque = deque()
+        self._pending_lock = threading.Lock()
+        self._pruned = time.monotonic()
+
+    def dispatch(self, call: str, event: Dict):
+        """Сохраняет событие в истории звонка и передает его подписчикам. Вызывается в цикле событий."""
+        self._seq[call] += 1
+        event = {**event, "id": self._seq[call]}
+        self._history.setdefault(call, deque(maxlen=self.history_size)).append(event)
+        self._touched[call] = time.monotonic()
+        for queue in self._subscribers.get(call, ()):
+            queue.put_nowait(event)
+        self._prune()
+
+    def _prune(self):
+        now = time.monotonic()
+        if now - self._pruned < 60:
+            return
+        self._pruned = now
+        for call in [c for c, t in self._touched.items() if now - t > self.ttl and not self._subscribers.get(c)]:
+            self._history.pop(call, None)
+            self._touched.pop(call, None)
+            self._seq.pop(call, None)
+            self._subscribers.pop(call, None)
+
+    def _bind(self):
+        """Запоминает цикл событий брокера и раздает события, опубликованные до его запуска."""
+        with self._pending_lock:
+            self._loop = asyncio.get_running_loop()
+            pending, self._pending = self._pending, deque()
+        for call, event in pending:
+            self.dispatch(call, event)
+
+    async def publish(self, call: str, event: Dict):
+        self._bind()
+        self.dispatch(call, event)
+
+    def publish_sync(self, call: str, event: Dict):
+        """
+        Публикация из потока без цикла событий (обработчики watchdog, executor). Пока цикл
+        брокера не запущен, события копятся (не больше `PENDING_LIMIT`) и раздаются при запуске.
+        """
+        with self._pending_lock:
+            if self._loop is None or not self._loop.is_running():
+                if len(self._pending) >= PENDING_LIMIT:
+                    dropped, _ = self._pending.popleft()
+                    logging.warning(f"Event broker is not started, dropping an event for {dropped}")
+                self._pending.append((call, event))
+                return
+            self._loop.call_soon_threadsafe(self.dispatch, call, event)
+
+    async def start(self):
+        self._bind()
+
+    async def subscribe(self, call: str, last_event_id: int = 0) -> asyncio.Queue:
+        """Возвращает очередь событий звонка: в ней уже лежат сохраненные события после `last_event_id`."""
+        await self.start()
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in self._history.get(call, ()):
+            if event["id"] > last_event_id:
+                queue.put_nowait(event)
+        self._subscribers[call].add(queue)
+        EVENT_SUBSCRIBERS.inc()
+        return queue
+
+    def unsubscribe(self, call: str, queue: asyncio.Queue):
+        self._subscribers[call].discard(queue)
+        EVENT_SUBSCRIBERS.dec()
+
+
+class PostgresBroker(MemoryBroker):
+    """
+    Публикация через NOTIFY, прием через LISTEN на отдельном соединении asyncpg.
+
+    `publish_sync` отправляет NOTIFY через одно постоянное соединение asyncpg, которое
+    живет в собственном цикле событий отдельного потока, поэтому ее можно вызывать
+    из любого потока, в том числе из потока с уже запущенным циклом.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._listener = None
+        self._start_lock: Optional[asyncio.Lock] = None
+        self._notifier = None
+        self._notifier_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._notifier_lock = threading.Lock()
+        self._notify_lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def _dsn() -> str:
+        return make_url(DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+
+    @staticmethod
+    def _payload(call: str, event: Dict) -> str:
+        return json.dumps({"call": call, "event": event}, ensure_ascii=False)
+
+    async def publish(self, call: str, event: Dict):
+        async with engine.connect() as conn:
+            await conn.execute(select(func.pg_notify(EVENT_CHANNEL, self._payload(call, event))))
+            await conn.commit()
+
+    async def _notify(self, payload: str):
+        """NOTIFY через постоянное соединение (переподключается, если оно закрыто). В цикле notifier."""
+        import asyncpg
+
+        if self._notify_lock is None:
+            self._notify_lock = asyncio.Lock()
+        # Соединение asyncpg не выполняет запросы параллельно
+        async with self._notify_lock:
+            if self._notifier is None or self._notifier.is_closed():
+                self._notifier = await asyncpg.connect(self._dsn())
+            await self._notifier.execute("SELECT pg_notify($1, $2)", EVENT_CHANNEL, payload)
+
+    def _notifier_thread_loop(self) -> asyncio.AbstractEventLoop:
+        with self._notifier_lock:
+            if self._notifier_loop is None:
+                self._notifier_loop = asyncio.new_event_loop()
+                threading.Thread(target=self._notifier_loop.run_forever, name="events-notify", daemon=True).start()
+            return self._notifier_loop
+
+    def publish_sync(self, call: str, event: Dict):
+        future = asyncio.run_coroutine_threadsafe(self._notify(self._payload(call, event)),
+                                                  self._notifier_thread_loop())
+        future.result(NOTIFY_TIMEOUT)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        message = json.loads(payload)
+        self.dispatch(message["call"], message["event"])
+
+    async def start(self):
+        await super().start()
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._listener is None or self._listener.is_closed():
+                import asyncpg
+
+                self._listener = await asyncpg.connect(self._dsn())
+                await self._listener.add_listener(EVENT_CHANNEL, self._on_notify)
+                logging.info(f"Listening for call events on channel {EVENT_CHANNEL}")
+
+
+def create_broker() -> MemoryBroker:
+    kind = EVENTS_BROKER
+    if kind == "auto":
+        kind = "postgres" if engine.dialect.name == "postgresql" else "memory"
+    return PostgresBroker() if kind == "postgres" else MemoryBroker()
+
+
+broker = create_broker()
+
+
+def make_event(stage: str, **data) -> Dict:
+    if isinstance(data.get("text"), str):
+        data["text"] = data["text"][:MAX_TEXT_LENGTH]
+    return {"stage": stage, "ts": time.time(), **data}
+
+
+async def publish_event(call: Optional[str], stage: str, **data):
+    """Публикует событие звонка. Ошибки публикации не прерывают обработку."""
+    if not call:
+        return
+    try:
+        await broker.publish(call, make_event(stage, **data))
+    except Exception as e:
+        logging.warning(f"Failed to publish {stage} event for {call}: {e}")
+
+
+def publish_event_sync(call: Optional[str], stage: str, **data):
+    """Синхронный вариант `publish_event` для потоков без цикла событий."""
+    if not call:
+        return
+    try:
+        broker.publish_sync(call, make_event(stage, **data))
+    except Exception as e:
+        logging.warning(f"Failed to publish {stage} event for {call}: {e}")
+
+
+def format_sse(event: Dict) -> str:
+    return f"id: {event['id']}\nevent: {event['stage']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+async def event_stream(call: str, last_event_id: int = 0, keepalive: float = 15.0) -> AsyncIterator[str]:
+    """
+    Поток SSE для звонка. Пока событий нет, раз в `keepalive` секунд отправляется
+    комментарий, чтобы прокси не закрывали соединение. Поток завершается после
+    отправки результата (`sent`); после `failed` отправка повторяется, поток остается открытым.
+    """
+    queue = await broker.subscribe(call, last_event_id)
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_sse(event)
+            if event["stage"] in TERMINAL_STAGES:
+                return
+    finally:
+        broker.unsubscribe(call, queue)
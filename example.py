@@ -5,19 +5,41 @@ import asyncio
 from collections import defaultdict
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-import aiofiles
 
-from utils import send_result_to_api
+from config import MERGER_METRICS_PORT, RESULT_OUTBOX_IN_MERGER
+from events import publish_event
+from kpi import write_call_flags
+from metrics import MERGE_SECONDS, start_metrics_server
+from outbox import OutboxDispatcher
+from transcripts import TRANSCRIPT_SUFFIX, merged_transcript_path, transcript_call, write_merged_transcript
+from utils import send_result_to_api, update_call_texts
+
+
+def source_audio_exists(incoming_audio_folder, text_file):
+    """
+    Проверяет, что аудиосегмент, из которого получена транскрипция, присутствует.
+
+    Транскрипции стерео сегмента сохраняются как `<имя>_MIC.jsonl` и `<имя>_SPEAKER.jsonl`,
+    а исходный файл называется `<имя>_STEREO.wav`.
+    """
+    if (incoming_audio_folder / (text_file.stem + ".wav")).exists():
+        return True
+    for role_tag in ("_MIC", "_SPEAKER"):
+        if text_file.stem.endswith(role_tag):
+            stereo_stem = text_file.stem[:-len(role_tag)] + "_STEREO"
+            return (incoming_audio_folder / (stereo_stem + ".wav")).exists()
+    return False
 
 
 async def merge_transcription_files():
     """
-    Объединяет транскрипционные файлы для каждой группы аудиофайлов в один.
+    Объединяет транскрипционные файлы каждого звонка в один диалог.
 
-    Эта функция сканирует папку с транскрипциями и группирует файлы по их имени (основываясь на 
-    первой части имени файла). Если для каждой группы аудиофайлов (определяется по имени 
-    файла) присутствуют все необходимые аудиофайлы в папке `incoming_audio`, то транскрипции 
-    этих файлов объединяются в один файл в папке `transcriptions/merged`.
+    Эта функция сканирует папку с транскрипциями и группирует файлы по звонку, указанному 
+    в самих транскрипциях (для транскрипций без звонка - по первой части имени файла). 
+    Если для группы присутствуют все необходимые аудиофайлы в папке `incoming_audio`, то 
+    реплики оператора и клиента объединяются по времени в один файл в папке 
+    `transcriptions/merged`, а тексты диалога записываются в уже сохраненный звонок.
 
     Асинхронно обрабатывает все группы, создавая один выходной файл для каждой группы.
     """
@@ -29,45 +51,48 @@ async def merge_transcription_files():
 
     grouped_files = defaultdict(list)
 
-    for text_file in transcriptions_folder.glob("audio_part_*_*.txt"):
-        group_key = "_".join(text_file.stem.split("_")[:3])
+    for text_file in transcriptions_folder.glob(f"audio_part_*_*{TRANSCRIPT_SUFFIX}"):
+        group_key = transcript_call(text_file) or "_".join(text_file.stem.split("_")[:3])
         grouped_files[group_key].append(text_file)
 
     tasks = []
     for group_key, files in grouped_files.items():
         audio_files_exist = all(
-            (incoming_audio_folder / (file.stem + ".wav")).exists() for file in files
+            source_audio_exists(incoming_audio_folder, file) for file in files
         )
         if audio_files_exist:
-            output_file = output_folder / f"{group_key}_merged.txt"
-            tasks.append(write_grouped_files(files, output_file))
+            tasks.append(write_grouped_files(group_key, files, merged_transcript_path(group_key)))
         else:
             print(f"Skipping group {group_key}: Not all audio files are present.")
 
     if tasks:
+        started = time.perf_counter()
         await asyncio.gather(*tasks)
+        MERGE_SECONDS.observe(time.perf_counter() - started)
 
 
-async def write_grouped_files(files, output_file):
+async def write_grouped_files(group_key, files, output_file):
     """
-    Записывает объединенные данные из нескольких файлов в один.
+    Записывает объединенный диалог из нескольких транскрипций в один файл.
 
-    Эта функция сортирует файлы в порядке их имени, затем асинхронно читает содержимое 
-    каждого файла и записывает его в один объединенный файл. Файлы объединяются по 
-    порядку их имен.
+    Реплики всех сегментов (MIC и SPEAKER) сливаются потоково по абсолютному времени 
+    (k-путевое слияние, см. `transcripts.merge_dialog`). За тот же проход собираются 
+    тексты оператора, клиента и диалога, которые вместе с флагами анализа сегментов 
+    записываются в запись звонка в БД.
 
     Аргументы:
+        group_key (str): Звонок (имя папки запроса) или группа файлов по имени.
         files (list): Список файлов для объединения.
         output_file (Path): Путь к выходному файлу, в который будет записано содержимое.
     """
 
-    files = sorted(files, key=lambda f: f.stem)
-    async with aiofiles.open(output_file, "w", encoding="utf-8") as outfile:
-        for file in files:
-            async with aiofiles.open(file, "r", encoding="utf-8") as infile:
-                content = await infile.read()
-                await outfile.write(content + "\n")
+    loop = asyncio.get_running_loop()
+    texts = await loop.run_in_executor(None, write_merged_transcript, files, output_file)
     print(f"Merged: {output_file}")
+    if transcript_call(files[0]):
+        flags = write_call_flags(files, group_key)
+        await publish_event(group_key, "merged", text=texts["dialog_txt"])
+        await update_call_texts(group_key, texts, flags)
 
 
 def all_files_ready():
@@ -87,13 +112,13 @@ def all_files_ready():
     incoming_audio_folder = Path("incoming_audio")
 
     grouped_files = defaultdict(list)
-    for text_file in transcriptions_folder.glob("audio_part_*_*.txt"):
+    for text_file in transcriptions_folder.glob(f"audio_part_*_*{TRANSCRIPT_SUFFIX}"):
         group_key = "_".join(text_file.stem.split("_")[:2])
         grouped_files[group_key].append(text_file)
 
     for group_key, files in grouped_files.items():
         audio_files_exist = all(
-            (incoming_audio_folder / (file.stem + ".wav")).exists() for file in files
+            source_audio_exists(incoming_audio_folder, file) for file in files
         )
         if not audio_files_exist:
             return False
@@ -127,7 +152,7 @@ class TranscriptionFileHandler(FileSystemEventHandler):
         Обрабатывает событие создания нового файла.
     
         Этот метод срабатывает, когда в папке транскрипций появляется новый файл. Он проверяет, 
-        является ли файл транскрипцией (с расширением `.txt` и названием, начинающимся с 
+        является ли файл транскрипцией (с расширением `.jsonl` и названием, начинающимся с 
         `audio_part_`). Если условие выполняется, запускается асинхронная обработка события 
         через `handle_event()`.
     
@@ -143,7 +168,7 @@ class TranscriptionFileHandler(FileSystemEventHandler):
             return
         self.last_call_time = current_time
 
-        if file_path.suffix == ".txt" and file_path.stem.startswith("audio_part_"):
+        if file_path.suffix == TRANSCRIPT_SUFFIX and file_path.stem.startswith("audio_part_"):
             print(f"New transcription file detected: {file_path}")
             asyncio.run_coroutine_threadsafe(self.handle_event(), self.loop)
 
@@ -169,7 +194,8 @@ def watch_folders():
     отслеживая создание новых транскрипционных файлов. Если файл транскрипции создан, 
     запускается его обработка с использованием `TranscriptionFileHandler`.
 
-    Асинхронно запускает событийный цикл и наблюдатель.
+    Асинхронно запускает событийный цикл, наблюдатель и отправитель результатов во внешний API
+    (`outbox.py`, если включен `RESULT_OUTBOX_IN_MERGER`).
     """
 
     transcriptions_folder = Path("transcriptions")
@@ -184,6 +210,10 @@ def watch_folders():
     observer.schedule(event_handler, str(transcriptions_folder), recursive=False)
 
     observer.start()
+    start_metrics_server(MERGER_METRICS_PORT)
+    if RESULT_OUTBOX_IN_MERGER:
+        # Доставка результатов из result_outbox во внешний API в том же цикле событий
+        loop.create_task(OutboxDispatcher().run())
     print(f"Watching folders: {transcriptions_folder} and {incoming_audio_folder}")
 
     try:
@@ -1,41 +1,195 @@
 import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
 from watchdog.events import FileSystemEventHandler
-from stt_model import transcribe_audio, save_transcription
+from analysis_store import record_analysis
+from audio_processor import CHANNEL_TAGS, STEREO_TAG, is_stereo_file
+from config import WATCHER_WORKERS
+from events import publish_event_sync
+from kpi import save_analysis
+from metrics import FILES_PROCESSED, QUEUE_DEPTH
+from scheduler import PriorityScheduler, priority_class
+from stt_model import transcribe_audio, transcribe_stereo, save_transcription
 from text_analysis import analyze_text
+from transcripts import TRANSCRIPT_SUFFIX, read_segment_metadata
 
 
 class AudioFileHandler(FileSystemEventHandler):
     """
     Обработчик событий для наблюдения за директорией.
+
+    Файл берется в работу только когда он полностью записан: по закрытию после записи
+    (inotify close-write) или по переименованию в `.wav` (сегменты пишутся во временный
+    `.wav.part` и переименовываются). Событие о создании файла игнорируется, так как
+    в этот момент файл еще пишется. Файлы обрабатываются в пуле из `workers` потоков,
+    а не в потоке наблюдателя, и файл, уже стоящий в очереди, повторно не ставится.
+    Потоки пула берут файлы из планировщика (`scheduler.py`) по классу приоритета
+    из метаданных сегмента, а не в порядке поступления.
     """
-    def __init__(self, output_directory: str):
+    def __init__(self, output_directory: str, workers: int = WATCHER_WORKERS):
         self.output_directory = output_directory
+        self.scheduler = PriorityScheduler("watcher")
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.threads = []
+        self.workers = max(workers, 1)
+
+    def on_closed(self, event):
+        """
+        Обрабатывает закрытие файла после записи.
+        """
+        if not event.is_directory and event.src_path.endswith(".wav"):
+            self.submit(event.src_path)
+
+    def on_moved(self, event):
+        """
+        Обрабатывает переименование временного файла в `.wav`.
+        """
+        if not event.is_directory and event.dest_path.endswith(".wav"):
+            self.submit(event.dest_path)
+
+    def submit(self, file_path: str) -> bool:
+        """
+        Ставит файл в очередь пула. Возвращает False, если файл уже в очереди или обработан,
+        а также для сегментов, поставленных в очередь задач (их транскрибирует `stt_worker.py`).
+        """
+        file_path = os.path.normpath(file_path)
+        metadata = read_segment_metadata(file_path)
+        if metadata.get("queued"):
+            return False
+        with self.lock:
+            if file_path in self.pending or self.is_transcribed(file_path):
+                return False
+            self.pending.add(file_path)
+            QUEUE_DEPTH.labels("watcher_pool").set(len(self.pending))
+
+        priority = priority_class(priority=metadata.get("priority"))
+        print(f"Обнаружен новый аудиофайл: {file_path} ({priority})")
+        self.start()
+        self.scheduler.put(file_path, priority)
+        return True
+
+    def start(self):
+        """Запускает потоки пула (при первой постановке файла)."""
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f"stt-watcher-{len(self.threads)}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            next_item = self.scheduler.get()
+            if next_item is None:
+                return
+            file_path, _ = next_item
+            try:
+                self.process_audio_file(file_path)
+            finally:
+                with self.lock:
+                    self.pending.discard(file_path)
+                    QUEUE_DEPTH.labels("watcher_pool").set(len(self.pending))
+                    self.idle.notify_all()
+
+    def sweep(self, watch_directory: str, min_age: float = 2.0) -> int:
+        """
+        Ставит в очередь необработанные файлы, появившиеся, пока наблюдатель не работал.
+
+        Файлы моложе `min_age` секунд пропускаются: если их еще пишут, они придут событием
+        о закрытии. Возвращает количество поставленных файлов.
+        """
+        now = time.time()
+        files = sorted(Path(watch_directory).glob("*.wav"), key=lambda path: path.stat().st_mtime)
+        return sum(self.submit(str(path)) for path in files if now - path.stat().st_mtime >= min_age)
 
-    def on_created(self, event):
+    def wait(self):
         """
-        Обрабатывает событие создания нового файла.
+        Ждет, пока пул обработает все поставленные файлы.
         """
-        if event.is_directory or not event.src_path.endswith(".wav"):
-            return
+        with self.lock:
+            self.idle.wait_for(lambda: not self.pending)
 
-        print(f"Обнаружен новый аудиофайл: {event.src_path}")
-        self.process_audio_file(event.src_path)
+    def shutdown(self):
+        """
+        Дожидается обработки поставленных файлов и останавливает потоки пула.
+        """
+        self.scheduler.close()
+        for thread in self.threads:
+            thread.join()
+
+    def transcription_path(self, file_path: str, role: str = None) -> str:
+        """
+        Путь транскрипции аудиофайла (для стерео записи - транскрипции канала `role`).
+        """
+        base_filename = os.path.splitext(os.path.basename(file_path))[0]
+        if role:
+            base_filename = f"{base_filename.replace(f'_{STEREO_TAG}', '')}_{CHANNEL_TAGS[role]}"
+        return os.path.join(self.output_directory, f"{base_filename}{TRANSCRIPT_SUFFIX}")
+
+    def is_transcribed(self, file_path: str) -> bool:
+        """
+        Есть ли уже транскрипция файла (для стерео - транскрипции обоих каналов).
+        """
+        if is_stereo_file(file_path):
+            return all(os.path.exists(self.transcription_path(file_path, role)) for role in CHANNEL_TAGS)
+        return os.path.exists(self.transcription_path(file_path))
 
     def process_audio_file(self, file_path: str):
         """
         Processes the new audio file: transcription and analysis.
         """
         try:
-            result = transcribe_audio(file_path)
+            self.handle_audio_file(file_path)
+            FILES_PROCESSED.labels("stt", "ok").inc()
+        except Exception as e:
+            FILES_PROCESSED.labels("stt", "error").inc()
+            print(f"Error processing file {file_path}: {e}")
 
-            base_filename = os.path.splitext(os.path.basename(file_path))[0]
-            output_path = os.path.join(self.output_directory, f"{base_filename}.txt")
+    def handle_audio_file(self, file_path: str) -> Dict[str, str]:
+        """
+        Transcribes and analyzes the audio file, propagating errors to the caller.
+        Returns the transcribed text keyed by transcription file name.
+        """
+        if is_stereo_file(file_path):
+            return self.handle_stereo_file(file_path)
 
-            save_transcription(result, output_path)
+        result = transcribe_audio(file_path)
+
+        base_filename = os.path.splitext(os.path.basename(file_path))[0]
+        output_path = self.transcription_path(file_path)
+
+        metadata = read_segment_metadata(file_path)
+        save_transcription(result, output_path, metadata=metadata)
+        role = next((role for role, tag in CHANNEL_TAGS.items() if tag in base_filename.upper()), "unknown")
+        publish_event_sync(metadata.get("call"), "transcribed", segment=metadata.get("segment"),
+                           offset=metadata.get("offset"), role=role, text=result['text'])
+
+        analysis = analyze_text(result['text'])
+        save_analysis(analysis, output_path)
+        record_analysis(analysis, os.path.basename(output_path), metadata, role)
+        return {os.path.basename(output_path): result['text']}
+
+    def handle_stereo_file(self, file_path: str) -> Dict[str, str]:
+        """
+        Processes a stereo call segment: both channels are transcribed in one batch
+        and saved as separate MIC/SPEAKER transcriptions.
+        """
+        results = transcribe_stereo(file_path)
+        metadata = read_segment_metadata(file_path)
+
+        texts = {}
+        for role, result in results.items():
+            output_path = self.transcription_path(file_path, role)
+            save_transcription(result, output_path, speaker_role=role, metadata=metadata)
+            publish_event_sync(metadata.get("call"), "transcribed", segment=metadata.get("segment"),
+                               offset=metadata.get("offset"), role=role, text=result['text'])
 
             analysis = analyze_text(result['text'])
-            print("Text analysis:")
-            for key, value in analysis.items():
-                print(f" - {key}: {value}")
-        except Exception as e:
-            print(f"Error processing file {file_path}: {e}")
+            save_analysis(analysis, output_path)
+            record_analysis(analysis, os.path.basename(output_path), metadata, role)
+            texts[os.path.basename(output_path)] = result['text']
+        return texts
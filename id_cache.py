@@ -0,0 +1,66 @@
+"""
+Кэш идентификаторов операторов (имя -> id) и клиентов (телефон -> id) для `save_data_to_db`.
+
+Кэш в памяти процесса: ограниченный по размеру (вытесняется давно не использованный
+ключ) и по времени жизни записи. Заполняется результатами SELECT и `INSERT ... RETURNING`;
+id, вставленные в транзакции, попадают в кэш только после ее фиксации. Если транзакция
+откатилась, ключи, использованные в ней, удаляются из кэша: при конфликте (например,
+строку удалили и id устарел) следующий запрос прочитает id из БД заново.
+
+Попадания и промахи считаются в `dialdeep_cache_requests_total{cache="operator_id"|"client_id"}`.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from config import ID_CACHE_SIZE, ID_CACHE_TTL
+from metrics import CACHE_REQUESTS
+
+
+class TTLCache:
+    """LRU кэш с временем жизни записей. `maxsize=0` отключает кэш."""
+
+    def __init__(self, name: str, maxsize: int = ID_CACHE_SIZE, ttl: float = ID_CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[int]:
+        if not self.maxsize:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] < time.monotonic():
+                del self._data[key]
+                item = None
+            if item is not None:
+                self._data.move_to_end(key)
+        CACHE_REQUESTS.labels(self.name, "miss" if item is None else "hit").inc()
+        return None if item is None else item[0]
+
+    def put(self, key: Hashable, value: int):
+        if not self.maxsize or value is None:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+operator_ids = TTLCache("operator_id")
+client_ids = TTLCache("client_id")
@@ -0,0 +1,280 @@
+"""
+Прием загруженных звонков: декодирование, сегментация и постановка сегментов на STT.
+
+`/upload` только сохраняет файлы и ставит задачу `ingest` в очередь `job_queue`, а
+сегментацию выполняют воркеры приема (`INGEST_WORKERS` задач в процессе API или
+отдельный процесс `python ingest.py`). Состояние задачи хранится в БД, поэтому задачи,
+принятые до перезапуска, будут обработаны после него (истекшая аренда возвращает
+задачу в очередь), а всплески загрузок копятся в очереди, не задерживая ответ.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import socket
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+from pydub import AudioSegment
+
+from archive import record_segments
+from audio_processor import STEREO_TAG
+from config import INCOMING_AUDIO_DIR, JOB_POLL_INTERVAL, JOB_QUEUE_ENABLED
+from database import async_session_maker
+from dedup import release
+from events import publish_event
+from job_queue import INGEST_JOB, claim_job, complete_job, enqueue_segments, fail_job
+from metrics import DECODE_SECONDS, FILES_PROCESSED, SEGMENTATION_SECONDS
+from profiling import stage
+from scheduler import priority_class
+from transcripts import segment_metadata_path, write_segment_metadata
+
+def new_segment_id() -> str:
+    """Идентификатор исходного файла в именах сегментов, уникальный между процессами API."""
+    return uuid.uuid4().hex
+
+
+def segment_name(source_id: str, segment_number: int, tag: str = "") -> str:
+    """Имя сегмента `audio_part_<id>_<номер>[_<метка>].wav`; звонок хранится в метаданных сегмента."""
+    name = f"audio_part_{source_id}_{str(segment_number).zfill(3)}"
+    if tag:
+        name += f"_{tag}"
+    return name + ".wav"
+
+
+def partial_path(segment_path) -> Path:
+    """Временное имя сегмента на время записи: наблюдатель берет только файлы `.wav`."""
+    segment_path = Path(segment_path)
+    return segment_path.with_name(segment_path.name + ".part")
+
+
+def save_audio_segments(audio_file_path, segment_duration=30, save_folder=None, priority=None):
+    """
+    Разделяет аудиофайл на сегменты указанной продолжительности и сохраняет их в указанной папке.
+
+    Эта функция принимает путь к аудиофайлу, разделяет его на сегменты продолжительностью 
+    по умолчанию 30 секунд (или заданное время), и сохраняет каждый сегмент как отдельный 
+    файл в папке `save_folder`. Если папка не указана, сегменты сохраняются в директории 
+    `INCOMING_AUDIO_DIR`. Каждому сегменту присваивается уникальное имя с использованием 
+    UUID исходного файла и информации о типе записи (MIC, SPEAKER или STEREO для записи, где оба 
+    канала звонка находятся в одном файле). Перед каждым сегментом записываются его
+    метаданные (звонок - имя папки запроса, номер сегмента, смещение от начала записи),
+    по которым транскрипции потом объединяются в диалог.
+
+    Аргументы:
+        audio_file_path (str): Путь к исходному аудиофайлу.
+        segment_duration (int, optional): Длительность сегмента в секундах (по умолчанию 30).
+        save_folder (str, optional): Папка для сохранения сегментов (по умолчанию None).
+        priority (str, optional): Класс приоритета STT, записываемый в метаданные сегментов.
+
+    Возвращает:
+        list: Список путей к сохраненным сегментам.
+
+    Ошибки декодирования и записи не перехватываются: задача приема повторяется или
+    помечается ошибочной, а уже записанные сегменты файла удаляются.
+    """
+    segment_paths = []
+    try:
+        with stage("load"):
+            audio = AudioSegment.from_wav(audio_file_path)
+        audio_length = len(audio)
+        segment_number = 0
+
+        mic_or_speaker = channel_tag(Path(audio_file_path).stem, audio.channels)
+        source_id = new_segment_id()
+
+        while segment_number * segment_duration * 1000 < audio_length:
+            segment_start = segment_number * segment_duration * 1000
+            segment_end = min((segment_number + 1) * segment_duration * 1000, audio_length)
+
+            segment = audio[segment_start:segment_end]
+
+            segment_filename = segment_name(source_id, segment_number, mic_or_speaker)
+
+            if save_folder:
+                segment_path = Path(save_folder) / segment_filename
+
+            segment_path = INCOMING_AUDIO_DIR / segment_filename
+
+            call = Path(save_folder).name if save_folder else None
+            write_segment_metadata(segment_path, call, segment_number, segment_start / 1000, priority,
+                                   queued=JOB_QUEUE_ENABLED)
+            segment_paths.append(segment_path)
+            with stage("export"):
+                segment.export(partial_path(segment_path), format="wav")
+                os.replace(partial_path(segment_path), segment_path)
+            logging.debug(f"Saved segment {segment_filename} to {segment_path}")
+
+            segment_number += 1
+    except Exception:
+        discard_segments(segment_paths)
+        raise
+
+    if not segment_paths:
+        raise ValueError(f"No audio in {audio_file_path}")
+    return segment_paths
+
+
+def discard_segments(segment_paths):
+    """Удаляет сегменты (и их метаданные) загрузки, обработка которой не завершилась."""
+    for path in segment_paths:
+        for leftover in (Path(path), partial_path(path), segment_metadata_path(path)):
+            leftover.unlink(missing_ok=True)
+
+
+def channel_tag(file_name, channels):
+    """
+    Определяет метку записи для имени сегмента.
+
+    Отдельные каналы определяются по подстрокам MIC/SPEAKER в имени файла.
+    Двухканальная запись без такой метки считается стерео записью звонка,
+    которую STT обрабатывает целиком, разделяя каналы оператора и клиента.
+    """
+    if "MIC" in file_name.upper():
+        return "MIC"
+    if "SPEAKER" in file_name.upper():
+        return "SPEAKER"
+    if channels == 2:
+        return STEREO_TAG
+    return ""
+
+
+def segment_upload(save_folder: Path, filenames: List[str], priority: str = None) -> List[Path]:
+    """
+    Готовит аудио загрузки к транскрипции и возвращает пути сегментов.
+
+    Записи короче 30 секунд копируются в `INCOMING_AUDIO_DIR` без сегментации (под
+    именем сегмента, чтобы одинаковые имена файлов разных звонков не совпадали),
+    длинные делятся на сегменты по 30 секунд. В метаданные сегментов записывается
+    класс приоритета STT `priority`.
+    """
+    segment_paths = []
+    try:
+        for filename in filenames:
+            audio_file_path = save_folder / filename
+            logging.info(f"Checking audio length for: {filename}")
+            with DECODE_SECONDS.time(), stage("decode"):
+                audio = AudioSegment.from_file(audio_file_path)
+
+            audio_length = len(audio) / 1000
+            logging.info(f"Audio length: {audio_length} seconds.")
+            if audio_length < 30:
+                segment_filename = segment_name(new_segment_id(), 0, channel_tag(Path(filename).stem, audio.channels))
+                segment_path = INCOMING_AUDIO_DIR / segment_filename
+                write_segment_metadata(segment_path, save_folder.name, 0, 0.0, priority, queued=JOB_QUEUE_ENABLED)
+                segment_paths.append(segment_path)
+                with stage("write"):
+                    shutil.copyfile(audio_file_path, partial_path(segment_path))
+                    os.replace(partial_path(segment_path), segment_path)
+                continue
+
+            logging.info(f"Segmenting audio file: {audio_file_path}")
+            with SEGMENTATION_SECONDS.time(), stage("segment"):
+                paths = save_audio_segments(audio_file_path, save_folder=save_folder, priority=priority)
+            logging.info(f"Saved {len(paths)} audio segments.")
+            segment_paths.extend(paths)
+    except Exception:
+        # Повтор задачи сегментирует загрузку заново: сегменты прошлой попытки не нужны
+        discard_segments(segment_paths)
+        raise
+
+    with stage("write"):
+        record_segments(save_folder, segment_paths)
+    return segment_paths
+
+
+async def process_upload(session, save_folder: Path, filenames: List[str], in_executor: bool = False,
+                         source: str = None) -> Dict:
+    """
+    Сегментирует аудио загрузки, ставит сегменты в очередь STT (если включена) и
+    публикует событие `segmented`. Возвращает результат для задачи приема.
+    Класс приоритета STT определяется источником загрузки `source` (`scheduler.py`).
+    """
+    priority = priority_class(source)
+    if in_executor:
+        loop = asyncio.get_running_loop()
+        segment_paths = await loop.run_in_executor(None, segment_upload, save_folder, filenames, priority)
+    else:
+        segment_paths = segment_upload(save_folder, filenames, priority)
+
+    job_ids = []
+    if JOB_QUEUE_ENABLED:
+        with stage("enqueue"):
+            job_ids = await enqueue_segments(session, segment_paths)
+    await publish_event(save_folder.name, "segmented", segments=len(segment_paths))
+    return {"call": save_folder.name, "segments": [Path(path).name for path in segment_paths],
+            "transcription_jobs": job_ids, "priority": priority}
+
+
+async def process_next(worker_id: str) -> bool:
+    """Захватывает и выполняет одну задачу `ingest`. Возвращает False, если очередь пуста."""
+    from stt_worker import keep_lease
+
+    async with async_session_maker() as session:
+        job = await claim_job(session, worker_id, kind=INGEST_JOB)
+    if job is None:
+        return False
+
+    lease_task = asyncio.create_task(keep_lease(job.id, worker_id))
+    try:
+        async with async_session_maker() as session:
+            result = await process_upload(session, Path(job.audio_path), job.payload["files"], in_executor=True,
+                                          source=job.payload.get("source"))
+    except Exception as e:
+        lease_task.cancel()
+        async with async_session_maker() as session:
+            status = await fail_job(session, job.id, worker_id, str(e))
+        FILES_PROCESSED.labels("ingest", "error").inc()
+        logging.error(f"Ingest job {job.id} failed: {e} -> {status}")
+        if status == "failed":
+            # Повтор загрузки после окончательной ошибки должен обработать звонок заново
+            async with async_session_maker() as session:
+                await release(session, Path(job.audio_path).name)
+            await publish_event(Path(job.audio_path).name, "failed", error=str(e))
+    else:
+        lease_task.cancel()
+        async with async_session_maker() as session:
+            await complete_job(session, job.id, worker_id, result=result)
+        FILES_PROCESSED.labels("ingest", "ok").inc()
+        logging.info(f"Ingest job {job.id} completed")
+    return True
+
+
+async def ingest_loop(worker_id: str):
+    """Цикл воркера приема: захватывает задачи `ingest` и сегментирует загрузки."""
+    logging.info(f"Ingest worker {worker_id} started")
+    while True:
+        try:
+            if not await process_next(worker_id):
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Ошибка БД не должна останавливать воркер в процессе API
+            logging.error(f"Ingest worker {worker_id}: {e}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+def start_ingest_workers(count: int) -> List[asyncio.Task]:
+    """Запускает воркеры приема в текущем цикле событий (процесс API)."""
+    return [asyncio.create_task(ingest_loop(new_worker_id())) for _ in range(count)]
+
+
+async def run_workers(count: int):
+    await asyncio.gather(*start_ingest_workers(count))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Ingest worker: segments uploaded calls from the job queue")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    INCOMING_AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+    asyncio.run(run_workers(args.workers))
@@ -0,0 +1,253 @@
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+from sqlalchemy import and_, insert, or_, select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import (JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, JOB_QUEUE_INLINE_AUDIO,
+                    JOB_RETRY_DELAY_SECONDS)
+from database import db_time_after
+from models.models import job_queue_table
+from scheduler import DEFAULT_CLASS, priority_class
+from transcripts import read_segment_metadata
+
+TRANSCRIBE_JOB = "transcribe"
+INGEST_JOB = "ingest"
+
+
+async def enqueue_job(session: AsyncSession, kind: str, audio_path=None, audio_data=None,
+                      payload=None, max_attempts: int = JOB_MAX_ATTEMPTS, priority: str = DEFAULT_CLASS) -> int:
+    """
+    Добавляет задачу в очередь и возвращает ее идентификатор.
+
+    Коммит выполняет вызывающая сторона, поэтому задачу можно поставить в очередь
+    в одной транзакции с другими изменениями.
+
+    Аргументы:
+        session (AsyncSession): Асинхронная сессия БД.
+        kind (str): Тип задачи (например, `transcribe`).
+        audio_path (str, optional): Путь к аудио на общем хранилище.
+        audio_data (bytes, optional): Аудио, сохраняемое прямо в БД.
+        payload (dict, optional): Дополнительные параметры задачи.
+        max_attempts (int): Максимальное количество попыток выполнения.
+        priority (str): Класс приоритета (`scheduler.py`).
+
+    Возвращает:
+        int: Идентификатор задачи.
+    """
+    stmt = insert(job_queue_table).values(
+        kind=kind,
+        audio_path=str(audio_path) if audio_path else None,
+        audio_name=Path(audio_path).name if audio_path else None,
+        audio_data=audio_data,
+        payload=payload,
+        max_attempts=max_attempts,
+        priority=priority,
+    ).returning(job_queue_table.c.id)
+    res = await session.execute(stmt)
+    return res.scalar()
+
+
+async def enqueue_segments(session: AsyncSession, segment_paths, inline: bool = JOB_QUEUE_INLINE_AUDIO) -> List[int]:
+    """
+    Ставит аудиосегменты в очередь на транскрипцию и фиксирует транзакцию.
+
+    Если `inline` включен, содержимое сегментов сохраняется в БД, и воркерам не нужен
+    доступ к общему хранилищу. Иначе в задаче хранится только путь к файлу.
+    Метаданные сегмента (звонок, номер, смещение) передаются в `payload` задачи,
+    класс приоритета из метаданных - в колонку `priority`.
+
+    Аргументы:
+        session (AsyncSession): Асинхронная сессия БД.
+        segment_paths (list): Пути к аудиосегментам.
+        inline (bool): Сохранять ли аудио в самой задаче.
+
+    Возвращает:
+        List[int]: Идентификаторы созданных задач.
+    """
+    job_ids = []
+    for segment_path in segment_paths:
+        audio_data = Path(segment_path).read_bytes() if inline else None
+        metadata = read_segment_metadata(segment_path)
+        job_ids.append(await enqueue_job(session, TRANSCRIBE_JOB, audio_path=segment_path, audio_data=audio_data,
+                                         payload=metadata, priority=priority_class(priority=metadata.get("priority"))))
+    await session.commit()
+    logging.info(f"Enqueued {len(job_ids)} transcription jobs.")
+    return job_ids
+
+
+async def enqueue_ingest(session: AsyncSession, upload_dir, filenames: List[str], source: str = None) -> int:
+    """
+    Ставит загрузку в очередь на сегментацию (задача `ingest`) и фиксирует транзакцию.
+
+    В `audio_path` задачи хранится папка запроса, в `payload` - звонок, имена аудиофайлов
+    и источник загрузки (по нему сегментам назначается класс приоритета STT).
+    """
+    job_id = await enqueue_job(session, INGEST_JOB, audio_path=upload_dir,
+                               payload={"call": Path(upload_dir).name, "files": filenames, "source": source},
+                               priority=priority_class(source))
+    await session.commit()
+    return job_id
+
+
+async def get_job(session: AsyncSession, job_id: int):
+    """Возвращает состояние задачи без аудио, сохраненного в БД."""
+    columns = [column for column in job_queue_table.c if column.name != 'audio_data']
+    return (await session.execute(select(*columns).where(job_queue_table.c.id == job_id))).fetchone()
+
+
+async def find_ingest_job(session: AsyncSession, upload_dir) -> Optional[int]:
+    """Идентификатор задачи приема загрузки по папке запроса."""
+    jobs = job_queue_table.c
+    return await session.scalar(
+        select(jobs.id).where(jobs.kind == INGEST_JOB, jobs.audio_path == str(upload_dir)).order_by(jobs.id.desc())
+    )
+
+
+async def claim_job(session: AsyncSession, worker_id: str, kind: str = TRANSCRIBE_JOB,
+                    lease_seconds: int = JOB_LEASE_SECONDS, priorities: Optional[List[str]] = None):
+    """
+    Захватывает следующую доступную задачу с арендой (lease) для воркера.
+
+    Используется `SELECT ... FOR UPDATE SKIP LOCKED`, поэтому любое количество воркеров
+    на любом количестве узлов может забирать задачи без блокировки друг друга.
+    Задачи, аренда которых истекла (воркер упал или завис), снова становятся доступными,
+    пока не исчерпан лимит попыток.
+
+    Если задан `priorities`, классы приоритета просматриваются в этом порядке и
+    захватывается самая старая задача первого класса, в котором она есть
+    (порядок дает `PriorityScheduler.order`). Иначе - самая старая задача любого класса.
+
+    Аргументы:
+        session (AsyncSession): Асинхронная сессия БД.
+        worker_id (str): Идентификатор воркера.
+        kind (str): Тип задачи.
+        lease_seconds (int): Длительность аренды в секундах.
+        priorities (list, optional): Классы приоритета в порядке обслуживания.
+
+    Возвращает:
+        Row | None: Захваченная задача или None, если очередь пуста.
+    """
+    jobs = job_queue_table.c
+    # Задачи с истекшей арендой и исчерпанными попытками больше не повторяются
+    await session.execute(
+        update(job_queue_table)
+        .where(jobs.kind == kind, jobs.status == 'running', jobs.lease_expires_at < func.now(),
+               jobs.attempts >= jobs.max_attempts)
+        .values(status='failed', error='lease expired', finished_at=func.now())
+    )
+
+    claim_stmt = (
+        select(jobs.id)
+        .where(jobs.kind == kind, jobs.attempts < jobs.max_attempts)
+        .where(or_(
+            and_(jobs.status == 'pending', jobs.available_at <= func.now()),
+            and_(jobs.status == 'running', jobs.lease_expires_at < func.now()),
+        ))
+        .order_by(jobs.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    job_id = None
+    for priority in priorities or [None]:
+        stmt = claim_stmt if priority is None else claim_stmt.where(jobs.priority == priority)
+        job_id = await session.scalar(stmt)
+        if job_id is not None:
+            break
+    if job_id is None:
+        await session.commit()
+        return None
+
+    res = await session.execute(
+        update(job_queue_table)
+        .where(jobs.id == job_id)
+        .values(status='running', worker_id=worker_id, attempts=jobs.attempts + 1,
+                heartbeat_at=func.now(), lease_expires_at=db_time_after(session, lease_seconds))
+        .returning(*job_queue_table.c)
+    )
+    job = res.fetchone()
+    await session.commit()
+    return job
+
+
+def waited_seconds(job) -> float:
+    """Сколько задача ждала в очереди с момента, когда стала доступна."""
+    available_at = job.available_at
+    if available_at.tzinfo is None:
+        # SQLite возвращает время UTC без часового пояса
+        available_at = available_at.replace(tzinfo=timezone.utc)
+    return max((datetime.now(timezone.utc) - available_at).total_seconds(), 0.0)
+
+
+async def heartbeat(session: AsyncSession, job_id: int, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+    """
+    Продлевает аренду задачи.
+
+    Возвращает:
+        bool: False, если аренда потеряна (задачу забрал другой воркер).
+    """
+    jobs = job_queue_table.c
+    res = await session.execute(
+        update(job_queue_table)
+        .where(jobs.id == job_id, jobs.worker_id == worker_id, jobs.status == 'running')
+        .values(heartbeat_at=func.now(), lease_expires_at=db_time_after(session, lease_seconds))
+    )
+    await session.commit()
+    return res.rowcount == 1
+
+
+async def complete_job(session: AsyncSession, job_id: int, worker_id: str, result=None) -> bool:
+    """Отмечает задачу выполненной и сохраняет результат. Аудио, сохраненное в БД, удаляется."""
+    jobs = job_queue_table.c
+    res = await session.execute(
+        update(job_queue_table)
+        .where(jobs.id == job_id, jobs.worker_id == worker_id, jobs.status == 'running')
+        .values(status='done', result=result, audio_data=None, lease_expires_at=None, finished_at=func.now())
+    )
+    await session.commit()
+    return res.rowcount == 1
+
+
+async def fail_job(session: AsyncSession, job_id: int, worker_id: str, error: str) -> Optional[str]:
+    """
+    Обрабатывает ошибку выполнения задачи.
+
+    Если лимит попыток не исчерпан, задача возвращается в очередь с экспоненциальной
+    задержкой, иначе помечается как `failed`.
+
+    Возвращает:
+        str | None: Новый статус задачи или None, если аренда была потеряна.
+    """
+    jobs = job_queue_table.c
+    job = (await session.execute(
+        select(jobs.attempts, jobs.max_attempts)
+        .where(jobs.id == job_id, jobs.worker_id == worker_id, jobs.status == 'running')
+        .with_for_update()
+    )).fetchone()
+    if job is None:
+        await session.commit()
+        return None
+
+    if job.attempts < job.max_attempts:
+        delay = JOB_RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1)
+        values = dict(status='pending', available_at=db_time_after(session, delay))
+    else:
+        values = dict(status='failed', finished_at=func.now())
+
+    await session.execute(
+        update(job_queue_table)
+        .where(jobs.id == job_id)
+        .values(error=error[:2000], worker_id=None, lease_expires_at=None, **values)
+    )
+    await session.commit()
+    return values['status']
+
+
+async def queue_depth(session: AsyncSession, kind: str = TRANSCRIBE_JOB) -> int:
+    """Возвращает количество задач, ожидающих выполнения."""
+    jobs = job_queue_table.c
+    return await session.scalar(
+        select(func.count()).select_from(job_queue_table).where(jobs.kind == kind, jobs.status == 'pending')
+    )
@@ -0,0 +1,218 @@
+"""
+Флаги анализа звонков и инкрементальные KPI операторов по дням.
+
+STT сохраняет результат `analyze_text` каждого сегмента рядом с транскрипцией
+(`<транскрипция>.analysis.json`), при слиянии флаги сегментов сводятся в флаги звонка
+(`merged/<звонок>_flags.json`). При сохранении звонка флаги записываются в `call_flags`,
+а `operator_daily_kpi` обновляется на разницу между новыми и прежними флагами в той же
+транзакции, поэтому статистика читается без сканирования звонков.
+"""
+import json
+import re
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.models import call_flags_table, operator_daily_kpi_table, operator_table
+from transcripts import MERGED_DIR
+
+# Ключи результата sentiment.analyze_conversation -> колонки call_flags
+FLAG_COLUMNS = {
+    "Salomlashish": "greeting",
+    "Ism_so'rash": "name_asked",
+    "Sotuvchi_haqida": "seller_info",
+    "Kompaniya": "company",
+    "Dori_haqida": "medicine_info",
+    "Kasalligini_so'rash": "illness_asked",
+    "Dorining_nomi": "medicine_name",
+    "Buyurtma": "order_predicted",
+}
+COUNTER_COLUMNS = list(FLAG_COLUMNS.values()) + ["sale_confirmed"]
+SALE_CONFIRMED = "Buyurtma tasdiqlandi"
+
+_POSITIVE = re.compile(r"Positive:\s*([\d.]+)%")
+_NEGATIVE = re.compile(r"Negative:\s*([\d.]+)%")
+
+
+def analysis_path(transcript_path) -> Path:
+    return Path(transcript_path).with_suffix(".analysis.json")
+
+
+def save_analysis(analysis: Dict, transcript_path):
+    """Сохраняет результат анализа сегмента рядом с его транскрипцией."""
+    analysis_path(transcript_path).write_text(json.dumps(analysis, ensure_ascii=False), encoding="utf-8")
+
+
+def positive_percentage(sentiment: Optional[str]) -> Optional[float]:
+    match = _POSITIVE.search(sentiment or "")
+    return float(match.group(1)) if match else None
+
+
+def negative_percentage(sentiment: Optional[str]) -> Optional[float]:
+    match = _NEGATIVE.search(sentiment or "")
+    return float(match.group(1)) if match else None
+
+
+def summarize_analyses(analyses: List[Dict]) -> Optional[Dict]:
+    """
+    Сводит анализы сегментов в флаги звонка: флаг выставлен, если он найден хотя бы
+    в одном сегменте; доля позитива усредняется по сегментам.
+    """
+    if not analyses:
+        return None
+    flags = {
+        column: int(any(a.get("analysis_result", {}).get(key) for a in analyses))
+        for key, column in FLAG_COLUMNS.items()
+    }
+    flags["sale_confirmed"] = int(any(a.get("sale_result") == SALE_CONFIRMED for a in analyses))
+    positives = [p for p in (positive_percentage(a.get("analysis_result", {}).get("sentiment")) for a in analyses)
+                 if p is not None]
+    flags["positive_pct"] = round(sum(positives) / len(positives), 2) if positives else None
+    return flags
+
+
+def merged_flags_path(call: str) -> Path:
+    return MERGED_DIR / f"{call}_flags.json"
+
+
+def write_call_flags(transcript_paths: Iterable, call: str) -> Optional[Dict]:
+    """Сводит анализы сегментов звонка и сохраняет флаги рядом с объединенной транскрипцией."""
+    analyses = []
+    for path in transcript_paths:
+        sidecar = analysis_path(path)
+        if sidecar.exists():
+            analyses.append(json.loads(sidecar.read_text(encoding="utf-8")))
+    flags = summarize_analyses(analyses)
+    if flags:
+        merged_flags_path(call).write_text(json.dumps(flags), encoding="utf-8")
+    return flags
+
+
+def load_call_flags(call: str) -> Optional[Dict]:
+    path = merged_flags_path(call)
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def call_day(call_datetime: Optional[str]) -> date:
+    """День звонка из поля `datetime` (`YYYY-MM-DD HH:MM:SS`), иначе текущий день."""
+    try:
+        return date.fromisoformat(call_datetime[:10])
+    except (TypeError, ValueError):
+        return date.today()
+
+
+def call_timestamp(call_datetime: Optional[str]) -> datetime:
+    """
+    Время звонка для `call_info.call_ts` (ключ секционирования) из поля `datetime`
+    (`YYYY-MM-DD HH:MM:SS`, местное время), иначе текущее время.
+    """
+    try:
+        return datetime.fromisoformat(call_datetime).astimezone()
+    except (TypeError, ValueError):
+        return datetime.now().astimezone()
+
+
+def day_start(day) -> datetime:
+    """Начало дня (`date` или `YYYY-MM-DD`) в местном времени для фильтров по `call_ts`."""
+    return datetime.combine(date.fromisoformat(str(day)), datetime.min.time()).astimezone()
+
+
+def _insert(session: AsyncSession):
+    return sqlite_insert if session.bind.dialect.name == "sqlite" else pg_insert
+
+
+async def _add_to_kpi(session: AsyncSession, operator_id: int, day: date, deltas: Dict):
+    """Прибавляет значения к строке KPI оператора за день (INSERT ... ON CONFLICT DO UPDATE)."""
+    table = operator_daily_kpi_table
+    stmt = _insert(session)(table).values(operator_id=operator_id, day=day, **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.operator_id, table.c.day],
+        set_={name: table.c[name] + stmt.excluded[name] for name in deltas},
+    )
+    await session.execute(stmt)
+
+
+async def count_call(session: AsyncSession, operator_id: int, day: date):
+    """Учитывает новый звонок в KPI оператора. Не фиксирует транзакцию."""
+    await _add_to_kpi(session, operator_id, day, {"calls": 1})
+
+
+async def record_call_flags(session: AsyncSession, call_info_id: int, operator_id: int, day: date, flags: Dict):
+    """
+    Сохраняет флаги звонка и обновляет KPI оператора на разницу с прежними флагами,
+    поэтому повторное слияние транскрипций не искажает агрегаты. Не фиксирует транзакцию.
+
+    Прежние флаги читаются с блокировкой строки (`SELECT ... FOR UPDATE`), а первая строка
+    звонка вставляется через `ON CONFLICT DO NOTHING`: при одновременной записи флагов
+    одного звонка второй писатель ждет первого и считает разницу с его значениями.
+    """
+    table = call_flags_table
+    values = {name: flags.get(name, 0) for name in COUNTER_COLUMNS}
+    values["positive_pct"] = flags.get("positive_pct")
+
+    stmt = _insert(session)(table).values(call_info_id=call_info_id, **values)
+    inserted = await session.execute(
+        stmt.on_conflict_do_nothing(index_elements=[table.c.call_info_id]).returning(table.c.call_info_id)
+    )
+    previous = None
+    if inserted.fetchone() is None:
+        result = await session.execute(
+            select(table).where(table.c.call_info_id == call_info_id).with_for_update()
+        )
+        previous = dict(result.fetchone()._mapping)
+        if all(previous[name] == value for name, value in values.items()):
+            return
+        await session.execute(update(table).where(table.c.call_info_id == call_info_id).values(**values))
+
+    deltas = {name: values[name] - (previous[name] if previous else 0) for name in COUNTER_COLUMNS}
+    deltas["analyzed_calls"] = 0 if previous else 1
+    old_positive = previous["positive_pct"] if previous else None
+    deltas["positive_pct_sum"] = (values["positive_pct"] or 0) - (old_positive or 0)
+    deltas["positive_pct_count"] = (values["positive_pct"] is not None) - (old_positive is not None)
+    await _add_to_kpi(session, operator_id, day, deltas)
+
+
+async def operator_stats(session: AsyncSession, date_from: date, date_to: date,
+                         operator_id: Optional[int] = None, daily: bool = False) -> List[Dict]:
+    """
+    Читает KPI операторов за период из `operator_daily_kpi`.
+
+    Возвращает по строке на оператора (или на оператора и день при `daily`) с количеством
+    звонков, количеством звонков с каждым флагом, их долей среди проанализированных
+    звонков и средней долей позитива.
+    """
+    table = operator_daily_kpi_table
+    group = [table.c.operator_id, operator_table.c.name] + ([table.c.day] if daily else [])
+    stmt = (
+        select(
+            *group,
+            func.sum(table.c.calls).label("calls"),
+            func.sum(table.c.analyzed_calls).label("analyzed_calls"),
+            *[func.sum(table.c[name]).label(name) for name in COUNTER_COLUMNS],
+            func.sum(table.c.positive_pct_sum).label("positive_pct_sum"),
+            func.sum(table.c.positive_pct_count).label("positive_pct_count"),
+        )
+        .select_from(table.join(operator_table, operator_table.c.id == table.c.operator_id))
+        .where(table.c.day >= date_from, table.c.day <= date_to)
+        .group_by(*group)
+        .order_by(*group)
+    )
+    if operator_id is not None:
+        stmt = stmt.where(table.c.operator_id == operator_id)
+
+    rows = []
+    for row in (await session.execute(stmt)).fetchall():
+        data = dict(row._mapping)
+        analyzed = data["analyzed_calls"] or 0
+        data["rates"] = {name: round(data[name] / analyzed, 4) if analyzed else None for name in COUNTER_COLUMNS}
+        pct_sum, pct_count = data.pop("positive_pct_sum"), data.pop("positive_pct_count")
+        data["positive_pct"] = round(pct_sum / pct_count, 2) if pct_count else None
+        rows.append(data)
+    return rows
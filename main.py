@@ -1,95 +1,93 @@
 import logging
+import shutil
+import uuid
+from contextlib import asynccontextmanager
 
 import aiofiles
 import uvicorn
-from datetime import datetime
-from pathlib import Path
+from datetime import date, datetime, timedelta
 
-from fastapi import FastAPI, UploadFile, File, Request, Depends
-from typing import Dict, List
+from fastapi import FastAPI, UploadFile, File, Form, Request, Depends, Response, Query, Header, WebSocket
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel
-from pydub import AudioSegment
 from pydub.utils import mediainfo
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from config import UPLOAD_FOLDER, INCOMING_AUDIO_DIR
+from config import (UPLOAD_FOLDER, INCOMING_AUDIO_DIR, INGEST_WORKERS, JOB_QUEUE_ENABLED, PROFILING_ENABLED,
+                    PROFILING_HEADER_ENABLED, UPLOAD_ASYNC, UPLOAD_DEDUP_ENABLED)
 from database import get_async_session
-from utils import send_result_to_api
-
-app = FastAPI()
-audio_counter = 0
-
-def create_unique_folder():
-    """Создает уникальную папку для каждого запроса на основе времени"""
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-    folder_path = UPLOAD_FOLDER / timestamp
-    folder_path.mkdir(parents=True, exist_ok=True)
-    return folder_path
-
-
-
-def save_audio_segments(audio_file_path, segment_duration=30, save_folder=None):
+from dedup import claim_content, claim_key, duplicate_response, new_hasher, release, write_hashed
+from events import broker, event_stream
+from ingest import process_upload, start_ingest_workers
+from job_queue import INGEST_JOB, enqueue_ingest, get_job, queue_depth
+from kpi import operator_stats
+from metrics import QUEUE_DEPTH, UPLOAD_SECONDS, mark_process_dead, render_metrics
+from profiling import RequestProfiler, request_timer, stage
+from search import InvalidCursor, search_calls
+from streaming import handle_stream
+from utils import call_record, send_result_to_api
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Слушатель событий запускается до первой загрузки, чтобы история звонков была полной
+    await broker.start()
+    workers = start_ingest_workers(INGEST_WORKERS) if UPLOAD_ASYNC else []
+    yield
+    for worker in workers:
+        worker.cancel()
+    mark_process_dead()
+
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def upload_timing_middleware(request: Request, call_next):
     """
-    Разделяет аудиофайл на сегменты указанной продолжительности и сохраняет их в указанной папке.
+    Измеряет время обработки запросов /upload и возвращает разбивку по этапам
+    в заголовке `Server-Timing`.
 
-    Эта функция принимает путь к аудиофайлу, разделяет его на сегменты продолжительностью 
-    по умолчанию 30 секунд (или заданное время), и сохраняет каждый сегмент как отдельный 
-    файл в папке `save_folder`. Если папка не указана, сегменты сохраняются в директории 
-    `INCOMING_AUDIO_DIR`. Каждому сегменту присваивается уникальное имя с использованием 
-    счетчика и информации о типе записи (MIC или SPEAKER).
-
-    Аргументы:
-        audio_file_path (str): Путь к исходному аудиофайлу.
-        segment_duration (int, optional): Длительность сегмента в секундах (по умолчанию 30).
-        save_folder (str, optional): Папка для сохранения сегментов (по умолчанию None).
-
-    Возвращает:
-        list: Список путей к сохраненным сегментам.
+    При `PROFILING_ENABLED` или заголовке `X-Profile: 1` (если разрешен
+    `PROFILING_HEADER_ENABLED`) дополнительно сохраняет профиль запроса в
+    `PROFILES_DIR`, идентификатор профиля возвращается в заголовке `X-Profile-Id`.
     """
-    global audio_counter
-    try:
-        audio = AudioSegment.from_wav(audio_file_path)
-        audio_length = len(audio)
-        segment_number = 0
-        segment_paths = []
-
-        file_name = Path(audio_file_path).stem
-        mic_or_speaker = ""
-        if "MIC" in file_name.upper():
-            mic_or_speaker = "MIC"
-        elif "SPEAKER" in file_name.upper():
-            mic_or_speaker = "SPEAKER"
+    if request.url.path != "/upload":
+        return await call_next(request)
 
-        while segment_number * segment_duration * 1000 < audio_length:
-            segment_start = segment_number * segment_duration * 1000
-            segment_end = min((segment_number + 1) * segment_duration * 1000, audio_length)
+    profiler = None
+    if PROFILING_ENABLED or (PROFILING_HEADER_ENABLED and request.headers.get("X-Profile") == "1"):
+        profiler = RequestProfiler("upload")
+        if not profiler.start():
+            profiler = None
 
-            segment = audio[segment_start:segment_end]
+    profile_id = None
+    with UPLOAD_SECONDS.time(), request_timer() as timer:
+        try:
+            response = await call_next(request)
+        finally:
+            if profiler:
+                profile_id = profiler.stop()
 
-            segment_filename = f"audio_part_{str(audio_counter).zfill(3)}_{str(segment_number).zfill(3)}"
-            if mic_or_speaker:
-                segment_filename += f"_{mic_or_speaker}"
-            segment_filename += ".wav"
+    response.headers["Server-Timing"] = timer.server_timing()
+    if profile_id:
+        response.headers["X-Profile-Id"] = profile_id
+    return response
 
-            if save_folder:
-                segment_path = Path(save_folder) / segment_filename
 
-            segment_path = INCOMING_AUDIO_DIR / segment_filename
-
-            segment.export(segment_path, format="wav")
-            print(f"Saved segment {segment_filename} to {segment_path}")
-
-            segment_paths.append(segment_path)
-            segment_number += 1
+def create_unique_folder():
+    """
+    Создает уникальную папку для каждого запроса. Имя папки - идентификатор звонка:
+    метка времени (для сортировки и возраста папки) и UUID, поэтому имена не совпадают
+    и при одновременных запросах в нескольких процессах API.
+    """
+    call = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:12]}"
+    folder_path = UPLOAD_FOLDER / call
+    folder_path.mkdir(parents=True)
+    return folder_path
 
-        audio_counter += 1
 
-        return segment_paths
-
-    except Exception as e:
-        logging.error(f"Error while processing audio file: {str(e)}")
-        return []
 
 class DataModel(BaseModel):
     operator: dict
@@ -102,6 +100,119 @@ class DataModel(BaseModel):
     datetime: str
     audio_path: str
 
+@app.get("/metrics")
+async def metrics_endpoint(session: AsyncSession = Depends(get_async_session)):
+    """Отдает метрики API в формате Prometheus."""
+    QUEUE_DEPTH.labels("incoming_audio").set(sum(1 for _ in INCOMING_AUDIO_DIR.glob("*.wav")))
+    if JOB_QUEUE_ENABLED:
+        QUEUE_DEPTH.labels("job_queue").set(await queue_depth(session))
+    if UPLOAD_ASYNC:
+        QUEUE_DEPTH.labels("ingest").set(await queue_depth(session, INGEST_JOB))
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/search")
+async def search_endpoint(
+        q: str = Query(..., min_length=2),
+        limit: int = Query(20, ge=1),
+        cursor: Optional[str] = None,
+        mode: str = Query("auto", pattern="^(auto|fts|fuzzy)$"),
+        operator_id: Optional[int] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        session: AsyncSession = Depends(get_async_session),
+):
+    """
+    Полнотекстовый поиск звонков по тексту диалога.
+
+    Результаты отсортированы по релевантности. Для следующей страницы нужно передать
+    `next_cursor` из предыдущего ответа. Режим `auto` переключается на нечеткий поиск
+    по триграммам, если полнотекстовый поиск ничего не нашел. `date_from`/`date_to`
+    ограничивают поиск днями звонков, запрос затрагивает только секции этих месяцев.
+    """
+    try:
+        return await search_calls(session, q, limit=limit, cursor=cursor, mode=mode, operator_id=operator_id,
+                                  date_from=date_from, date_to=date_to)
+    except InvalidCursor as e:
+        return {"error": str(e)}
+
+
+@app.get("/stats/operators")
+async def operator_stats_endpoint(
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        operator_id: Optional[int] = None,
+        daily: bool = False,
+        session: AsyncSession = Depends(get_async_session),
+):
+    """
+    KPI операторов за период (по умолчанию - последние 30 дней).
+
+    Данные читаются из агрегатов `operator_daily_kpi`, поэтому время ответа зависит
+    от количества операторов и дней, а не от количества звонков. При `daily=true`
+    возвращается разбивка по дням.
+    """
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=29)
+    rows = await operator_stats(session, date_from, date_to, operator_id=operator_id, daily=daily)
+    return {"date_from": date_from, "date_to": date_to, "operators": rows}
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: int, session: AsyncSession = Depends(get_async_session)):
+    """
+    Состояние задачи (`pending`, `running`, `done`, `failed`), ее результат и, если звонок
+    уже сохранен в БД, его запись.
+    """
+    job = await get_job(session, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    response = {key: job._mapping[key] for key in ("id", "kind", "status", "attempts", "error", "result",
+                                                   "created_at", "finished_at")}
+    call = (job.payload or {}).get("call")
+    if call:
+        response["call"] = call
+        response["call_info"] = await call_record(session, call)
+    return response
+
+
+@app.get("/calls/{call}/events")
+async def call_events(call: str, last_event_id: int = Header(0)):
+    """
+    Поток событий обработки звонка (Server-Sent Events).
+
+    `call` - идентификатор звонка из ответа /upload. Сначала отдаются уже прошедшие
+    этапы, затем новые: сегментация, частичные транскрипции сегментов, слияние,
+    сохранение в БД, архивирование и отправка результата. Поток закрывается после
+    события `sent`; при переподключении заголовок `Last-Event-ID` пропускает уже
+    полученные события.
+    """
+    return StreamingResponse(
+        event_stream(call, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/ws/transcribe")
+async def transcribe_stream(
+        websocket: WebSocket,
+        role: str = Query("operator", pattern="^(operator|client)$"),
+        channels: int = 1,
+        sample_rate: int = 16000,
+        call: Optional[str] = None,
+):
+    """
+    Потоковая транскрипция идущего звонка (см. `streaming.py`).
+
+    Принимает бинарные кадры PCM 16 бит, отвечает событиями `partial` и `final`
+    (с флагами ключевых слов) и `end` после сообщения `{"type": "stop"}`.
+    Для стерео (`channels=2`) роль определяется каналом.
+    """
+    await handle_stream(websocket, role=role, channels=channels, sample_rate=sample_rate, call=call)
+
+
 @app.post("/test-api")
 async def receive_data(data: DataModel):
     print(f"Received data: {data.dict()}")
@@ -113,6 +224,9 @@ async def receive_data(data: DataModel):
 @app.post("/upload")
 async def upload_file(
         files: List[UploadFile] = File(None),
+        call_id: Optional[str] = Form(None),
+        source: Optional[str] = Form(None),
+        idempotency_key: Optional[str] = Header(None),
         request: Request = None,
         session: AsyncSession = Depends(get_async_session),
 ):
@@ -124,84 +238,115 @@ async def upload_file(
     в папку с уникальным именем, созданным с использованием текущего времени. Затем она 
     проверяет длину аудиофайла и, если он слишком короткий, сохраняет его без сегментации. 
     Для длинных файлов выполняется сегментация на части заданной продолжительности (по умолчанию 30 секунд). 
-    Все файлы обрабатываются асинхронно.
+    Все файлы обрабатываются асинхронно. Если включена очередь задач (`JOB_QUEUE_ENABLED`), 
+    сегменты ставятся в очередь в БД и транскрибируются воркерами `stt_worker.py`.
+
+    При `UPLOAD_ASYNC` файлы только сохраняются, а декодирование и сегментация выполняются
+    воркерами приема (`ingest.py`): ответ `202` с `job_id` возвращается сразу, состояние
+    задачи доступно по `/jobs/{job_id}`, время ответа не зависит от длины записи.
+
+    Повторная загрузка (тот же ключ идемпотентности или то же аудио, см. `dedup.py`)
+    определяется до декодирования и STT: новая папка удаляется, а в ответе возвращается
+    звонок первой загрузки.
 
     Аргументы:
         files (List[UploadFile]): Список файлов для обработки (может содержать как JSON, так и аудио).
+        call_id (str, optional): Ключ идемпотентности (поле формы), альтернатива - заголовок `Idempotency-Key`.
+        source (str, optional): Источник загрузки (например, `live_qa`, `import`), по нему
+            сегментам назначается класс приоритета STT (`SCHEDULER_SOURCES`).
         request (Request): Объект запроса FastAPI.
         session (AsyncSession): Асинхронная сессия для работы с базой данных.
 
     Возвращает:
-        dict: Статус обработки файлов (сообщение об успехе или ошибке).
+        dict: Статус обработки файлов (сообщение об успехе или ошибке), звонок и задача приема.
     """
     
+    save_folder = None
+    claimed = False
     try:
         save_folder = create_unique_folder()
         logging.info(f'Created folder: {save_folder}')
+        key = call_id or idempotency_key
 
         form_data = {}
-        audio_file = None
         json_file = None
-        audio_counter = 0
-        print("before", audio_counter)
         if len(files) == 1 and files[0].filename.endswith(".json"):
             json_file = files[0]
             json_data_path = save_folder / json_file.filename
-            async with aiofiles.open(json_data_path, "wb") as json_file_path:
-                await json_file_path.write(await json_file.read())
+            with stage("write"):
+                async with aiofiles.open(json_data_path, "wb") as json_file_path:
+                    await json_file_path.write(await json_file.read())
             logging.info(f'Saved JSON data: {json_data_path}')
 
             return {"message": "JSON file processed and saved successfully."}
 
-        segment_paths = []
+        if UPLOAD_DEDUP_ENABLED and key:
+            with stage("dedup"):
+                previous = await claim_key(session, key, save_folder.name)
+            if previous:
+                shutil.rmtree(save_folder, ignore_errors=True)
+                logging.info(f"Duplicate upload for key {key}: call {previous.call}")
+                return await duplicate_response(session, previous)
+            claimed = True
+
+        audio_files = []
+        hasher = new_hasher()
 
         for file in files:
             logging.info(f'Processing file: {file.filename}')
 
             if file.filename.endswith(".json"):
                 form_data_path = save_folder / file.filename
-                async with aiofiles.open(form_data_path, "wb") as f:
-                    await f.write(await file.read())
+                with stage("write"):
+                    async with aiofiles.open(form_data_path, "wb") as f:
+                        await f.write(await file.read())
                 logging.info(f'Saved form data: {form_data_path}')
 
             elif file.filename.endswith(".wav"):
-                logging.info(f'Processing audio file: {file.filename}')
-                audio_file = file
                 audio_file_path_1 = save_folder / file.filename
-
-                async with aiofiles.open(audio_file_path_1, "wb") as f_audio_1:
-                    await f_audio_1.write(await file.read())
+                # Хеш считается во время записи, без повторного чтения файла
+                with stage("write"):
+                    await write_hashed(file, audio_file_path_1, hasher)
+                audio_files.append(file)
                 logging.info(f'Saved audio file in main folder: {audio_file_path_1}')
 
-                logging.info(f"Checking audio length for: {audio_file.filename}")
-                audio = AudioSegment.from_file(audio_file_path_1)
-
-                audio_length = len(audio) / 1000
-                print(audio_length)
-                logging.info(f"Audio length: {audio_length} seconds.")
-                if audio_length < 30:
-                    segment_filename = audio_file.filename
-                    segment_path = INCOMING_AUDIO_DIR / segment_filename
-                    async with aiofiles.open(segment_path, "wb") as f_audio:
-                        await f_audio.write(await audio_file.read())
-                    logging.info("Returning response for short audio file.")
-                    return {"message": "Audio file saved successfully in incoming audio folder."}
-
-                logging.info(f"Segmenting audio file: {audio_file_path_1}")
-                segment_paths = save_audio_segments(audio_file_path_1,
-                                                    save_folder=save_folder)
-                logging.info(f"Saved {len(segment_paths)} audio segments.")
-                audio_counter += 1
-                print("after>", audio_counter)
+        if UPLOAD_DEDUP_ENABLED and audio_files:
+            with stage("dedup"):
+                previous = await claim_content(session, hasher.hexdigest(), save_folder.name, key if claimed else None)
+            if previous:
+                await release(session, save_folder.name)
+                shutil.rmtree(save_folder, ignore_errors=True)
+                logging.info(f"Duplicate audio content: call {previous.call}")
+                return await duplicate_response(session, previous)
+            claimed = True
+
+        filenames = [file.filename for file in audio_files]
+        if filenames and UPLOAD_ASYNC:
+            with stage("enqueue"):
+                job_id = await enqueue_ingest(session, save_folder, filenames, source)
+            logging.info(f"Enqueued ingest job {job_id} for {save_folder.name}")
+            return JSONResponse(status_code=202, content={
+                "message": "Files saved, processing in background.", "job_id": job_id,
+                "call": save_folder.name, "status_url": f"/jobs/{job_id}",
+                "events_url": f"/calls/{save_folder.name}/events",
+            })
+        if filenames:
+            result = await process_upload(session, save_folder, filenames, source=source)
+            logging.info("Completed processing all files.")
+            return {"message": "All files processed successfully.", **result}
         logging.info("Completed processing all files.")
-        return {"message": "All files processed successfully."}
+        return {"message": "All files processed successfully.", "call": save_folder.name}
 
     except Exception as e:
         logging.error(f"Error while uploading: {str(e)}")
+        if claimed:
+            # Повтор после ошибки должен обработать загрузку заново
+            await release(session, save_folder.name)
         return {"error": str(e)}
 
 
 
 if __name__ == "__main__":
+    # Режим разработки (один процесс с перезагрузкой); в production - `python serve.py`
     logging.basicConfig(level=logging.INFO)
     uvicorn.run("main:app", host="0.0.0.0", port=8082, reload=True)
@@ -0,0 +1,74 @@
+import logging
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+                               multiprocess, start_http_server)
+
+# Бакеты для этапов, которые длятся от миллисекунд до нескольких минут
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+UPLOAD_SECONDS = Histogram('dialdeep_upload_seconds', 'Time spent handling /upload requests', buckets=STAGE_BUCKETS)
+DECODE_SECONDS = Histogram('dialdeep_decode_seconds', 'Time spent decoding uploaded audio', buckets=STAGE_BUCKETS)
+SEGMENTATION_SECONDS = Histogram('dialdeep_segmentation_seconds', 'Time spent splitting audio into segments',
+                                 buckets=STAGE_BUCKETS)
+STT_SECONDS = Histogram('dialdeep_stt_seconds', 'Speech-to-text inference time per file', ['mode'],
+                        buckets=STAGE_BUCKETS)
+STT_REAL_TIME_FACTOR = Histogram('dialdeep_stt_real_time_factor', 'STT processing time divided by audio duration',
+                                 ['mode'], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8))
+STT_AUDIO_SECONDS = Counter('dialdeep_stt_audio_seconds_total', 'Seconds of audio transcribed', ['mode'])
+SENTIMENT_SECONDS = Histogram('dialdeep_sentiment_seconds', 'Sentiment model inference time', buckets=STAGE_BUCKETS)
+ANALYSIS_SECONDS = Histogram('dialdeep_analysis_seconds', 'Full text analysis time per transcription',
+                             buckets=STAGE_BUCKETS)
+MERGE_SECONDS = Histogram('dialdeep_merge_seconds', 'Time spent merging transcription files', buckets=STAGE_BUCKETS)
+DB_SAVE_SECONDS = Histogram('dialdeep_db_save_seconds', 'Time spent saving call records to the database',
+                            buckets=STAGE_BUCKETS)
+ARCHIVE_SECONDS = Histogram('dialdeep_archive_seconds', 'Time spent transcoding call audio to the archive',
+                            buckets=STAGE_BUCKETS)
+ARCHIVE_BYTES = Counter('dialdeep_archive_bytes_total', 'Bytes handled by the audio archive', ['direction'])
+QUEUE_WAIT_SECONDS = Histogram('dialdeep_queue_wait_seconds', 'Time an item waited in a queue before processing',
+                               ['queue', 'priority'],
+                               buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200, 14400))
+API_POST_SECONDS = Histogram('dialdeep_api_post_seconds', 'Outbound result API POST latency', ['outcome'],
+                             buckets=STAGE_BUCKETS)
+
+FILES_PROCESSED = Counter('dialdeep_files_processed_total', 'Files processed by pipeline stage', ['stage', 'outcome'])
+QUEUE_DEPTH = Gauge('dialdeep_queue_depth', 'Items waiting to be processed', ['queue'], multiprocess_mode='livemax')
+CACHE_REQUESTS = Counter('dialdeep_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+DB_POOL_CHECKED_OUT = Gauge('dialdeep_db_pool_checked_out', 'Database connections currently checked out')
+DB_POOL_SIZE = Gauge('dialdeep_db_pool_size', 'Database connection pool size')
+MODEL_LOAD_SECONDS = Gauge('dialdeep_model_load_seconds', 'Time spent loading a model at startup', ['model'])
+EVENT_SUBSCRIBERS = Gauge('dialdeep_event_subscribers', 'Open call event streams', multiprocess_mode='livesum')
+STREAMS_ACTIVE = Gauge('dialdeep_streams_active', 'Open streaming transcription WebSocket connections',
+                       multiprocess_mode='livesum')
+
+
+def render_metrics():
+    """
+    Возвращает метрики в текстовом формате Prometheus и соответствующий Content-Type.
+
+    При нескольких процессах API (serve.py задает `PROMETHEUS_MULTIPROC_DIR`) метрики
+    собираются из файлов всех процессов, а не только из процесса, принявшего запрос.
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Удаляет значения `live*` метрик завершающегося процесса API (режим нескольких процессов)."""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def start_metrics_server(port: int):
+    """
+    Запускает HTTP экспортер метрик для фоновых процессов (наблюдатели, воркеры).
+
+    Порт 0 отключает экспортер.
+    """
+    if not port:
+        return
+    start_http_server(port)
+    logging.info(f"Metrics exporter listening on :{port}")
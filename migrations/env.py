@@ -7,6 +7,7 @@ from alembic import context
 
 from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
 from models.models import metadata
+from partitions import PARENT, is_partition
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -30,6 +31,20 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = metadata
 
+
+def include_object(obj, name, type_, reflected, compare_to):
+    """
+    Исключает из autogenerate объекты call_info, которых нет в модели: секции
+    (partitions.py) и созданные SQL в миграциях колонку `dialog_tsv` и GIN индексы.
+    Первичный ключ (id, call_ts) autogenerate не сравнивает.
+    """
+    if type_ == "table" and reflected and compare_to is None and is_partition(name):
+        return False
+    if type_ in ("column", "index") and reflected and compare_to is None and obj.table.name == PARENT:
+        return False
+    return True
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -52,6 +67,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -75,7 +91,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
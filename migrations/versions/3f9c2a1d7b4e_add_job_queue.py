@@ -0,0 +1,50 @@
+"""add job_queue
+
+Revision ID: 3f9c2a1d7b4e
+Revises:
+Create Date: 2026-10-19 09:12:40.118302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2a1d7b4e'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'job_queue',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), server_default='pending', nullable=False),
+        sa.Column('audio_path', sa.String(), nullable=True),
+        sa.Column('audio_name', sa.String(), nullable=True),
+        sa.Column('audio_data', sa.LargeBinary(), nullable=True),
+        sa.Column('payload', sa.JSON(), nullable=True),
+        sa.Column('result', sa.JSON(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('max_attempts', sa.Integer(), server_default='3', nullable=False),
+        sa.Column('worker_id', sa.String(), nullable=True),
+        sa.Column('available_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('lease_expires_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('heartbeat_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('finished_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_job_queue_id'), 'job_queue', ['id'], unique=False)
+    op.create_index('ix_job_queue_claim', 'job_queue', ['kind', 'status', 'available_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_job_queue_claim', table_name='job_queue')
+    op.drop_index(op.f('ix_job_queue_id'), table_name='job_queue')
+    op.drop_table('job_queue')
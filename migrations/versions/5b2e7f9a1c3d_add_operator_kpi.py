@@ -0,0 +1,49 @@
+"""add call_flags and operator_daily_kpi
+
+Revision ID: 5b2e7f9a1c3d
+Revises: 8d41c0e6a9f2
+Create Date: 2026-10-19 13:40:02.771940
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e7f9a1c3d'
+down_revision: Union[str, None] = '8d41c0e6a9f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FLAG_COLUMNS = ('greeting', 'name_asked', 'seller_info', 'company', 'medicine_info', 'illness_asked',
+                'medicine_name', 'order_predicted', 'sale_confirmed')
+
+
+def upgrade() -> None:
+    op.create_table(
+        'call_flags',
+        sa.Column('call_info_id', sa.Integer(), nullable=False),
+        *[sa.Column(name, sa.Integer(), server_default='0', nullable=False) for name in FLAG_COLUMNS],
+        sa.Column('positive_pct', sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(['call_info_id'], ['call_info.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('call_info_id')
+    )
+    op.create_table(
+        'operator_daily_kpi',
+        sa.Column('operator_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('calls', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('analyzed_calls', sa.Integer(), server_default='0', nullable=False),
+        *[sa.Column(name, sa.Integer(), server_default='0', nullable=False) for name in FLAG_COLUMNS],
+        sa.Column('positive_pct_sum', sa.Float(), server_default='0', nullable=False),
+        sa.Column('positive_pct_count', sa.Integer(), server_default='0', nullable=False),
+        sa.ForeignKeyConstraint(['operator_id'], ['operator.id']),
+        sa.PrimaryKeyConstraint('operator_id', 'day')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('operator_daily_kpi')
+    op.drop_table('call_flags')
@@ -0,0 +1,43 @@
+"""call_info id and full-text search indexes
+
+Revision ID: 8d41c0e6a9f2
+Revises: 3f9c2a1d7b4e
+Create Date: 2026-10-19 11:02:15.604211
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41c0e6a9f2'
+down_revision: Union[str, None] = '3f9c2a1d7b4e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Должно совпадать с search.NORMALIZED_DIALOG
+APOSTROPHE_VARIANTS = "ʻʼ’‘`"
+NORMALIZED_DIALOG = "translate({column}, '" + APOSTROPHE_VARIANTS + "', '" + "''" * len(APOSTROPHE_VARIANTS) + "')"
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE call_info ADD COLUMN id SERIAL PRIMARY KEY")
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    tsv_source = NORMALIZED_DIALOG.format(column="coalesce(dialog_txt, '')")
+    op.execute(
+        "ALTER TABLE call_info ADD COLUMN dialog_tsv tsvector GENERATED ALWAYS AS "
+        f"(to_tsvector('simple', {tsv_source})) STORED"
+    )
+    op.create_index('ix_call_info_dialog_tsv', 'call_info', ['dialog_tsv'], postgresql_using='gin')
+    op.execute(
+        "CREATE INDEX ix_call_info_dialog_trgm ON call_info "
+        f"USING gin (({NORMALIZED_DIALOG.format(column='dialog_txt')}) gin_trgm_ops)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_call_info_dialog_trgm', table_name='call_info')
+    op.drop_index('ix_call_info_dialog_tsv', table_name='call_info')
+    op.drop_column('call_info', 'dialog_tsv')
+    op.drop_column('call_info', 'id')
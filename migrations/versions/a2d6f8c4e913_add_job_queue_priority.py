@@ -0,0 +1,30 @@
+"""add job_queue priority
+
+Revision ID: a2d6f8c4e913
+Revises: f1a9c3e7b245
+Create Date: 2026-10-19 19:05:12.441082
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a2d6f8c4e913'
+down_revision: Union[str, None] = 'f1a9c3e7b245'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('job_queue', sa.Column('priority', sa.String(), server_default='normal', nullable=False))
+    op.drop_index('ix_job_queue_claim', table_name='job_queue')
+    op.create_index('ix_job_queue_claim', 'job_queue', ['kind', 'status', 'priority', 'available_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_job_queue_claim', table_name='job_queue')
+    op.create_index('ix_job_queue_claim', 'job_queue', ['kind', 'status', 'available_at'], unique=False)
+    op.drop_column('job_queue', 'priority')
@@ -0,0 +1,44 @@
+"""add result_outbox
+
+Revision ID: b8e3c1f5d702
+Revises: a2d6f8c4e913
+Create Date: 2026-10-19 20:41:36.902517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e3c1f5d702'
+down_revision: Union[str, None] = 'a2d6f8c4e913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'result_outbox',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('call', sa.String(), nullable=True),
+        sa.Column('order_id', sa.String(), nullable=True),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('status', sa.String(), server_default='pending', nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('available_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('lease_expires_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('sent_at', sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_result_outbox_order_id', 'result_outbox', ['order_id'], unique=False)
+    op.create_index('ix_result_outbox_claim', 'result_outbox', ['status', 'available_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_result_outbox_claim', table_name='result_outbox')
+    op.drop_index('ix_result_outbox_order_id', table_name='result_outbox')
+    op.drop_table('result_outbox')
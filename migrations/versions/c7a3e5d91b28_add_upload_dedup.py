@@ -0,0 +1,36 @@
+"""add upload_dedup
+
+Revision ID: c7a3e5d91b28
+Revises: 5b2e7f9a1c3d
+Create Date: 2026-10-19 15:12:47.308215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7a3e5d91b28'
+down_revision: Union[str, None] = '5b2e7f9a1c3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'upload_dedup',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('idempotency_key', sa.String(), nullable=True),
+        sa.Column('content_hash', sa.String(), nullable=True),
+        sa.Column('call', sa.String(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('idempotency_key'),
+        sa.UniqueConstraint('content_hash')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('upload_dedup')
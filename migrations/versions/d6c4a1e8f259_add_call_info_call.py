@@ -0,0 +1,33 @@
+"""add call_info.call
+
+Revision ID: d6c4a1e8f259
+Revises: b8e3c1f5d702
+Create Date: 2026-10-19 22:14:08.517306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd6c4a1e8f259'
+down_revision: Union[str, None] = 'b8e3c1f5d702'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Колонка и индекс на секционированной таблице создаются во всех секциях
+    op.add_column('call_info', sa.Column('call', sa.String(), nullable=True))
+    # Уже сохраненные звонки с аудио в папке запроса (`uploads/<call>/...`); у заархивированных
+    # звонков имя папки из пути не восстановить, они остаются без `call`
+    op.execute("UPDATE call_info SET call = substring(audio_path from '^uploads/([^/]+)/') "
+               "WHERE audio_path LIKE 'uploads/%'")
+    op.create_index('ix_call_info_call', 'call_info', ['call'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_call_info_call', table_name='call_info')
+    op.drop_column('call_info', 'call')
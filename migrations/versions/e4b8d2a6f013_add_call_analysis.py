@@ -0,0 +1,53 @@
+"""add call_analysis
+
+Revision ID: e4b8d2a6f013
+Revises: c7a3e5d91b28
+Create Date: 2026-10-19 17:40:12.518034
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b8d2a6f013'
+down_revision: Union[str, None] = 'c7a3e5d91b28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'call_analysis',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('transcript', sa.String(), nullable=False),
+        sa.Column('call', sa.String(), nullable=True),
+        sa.Column('segment', sa.Integer(), nullable=True),
+        sa.Column('role', sa.String(), nullable=True),
+        sa.Column('word_count', sa.Integer(), nullable=False),
+        sa.Column('unique_words', sa.Integer(), nullable=False),
+        sa.Column('avg_word_length', sa.Float(), nullable=False),
+        sa.Column('greeting', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('name_asked', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('seller_info', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('company', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('medicine_info', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('illness_asked', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('medicine_name', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('order_predicted', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('positive_pct', sa.Float(), nullable=True),
+        sa.Column('negative_pct', sa.Float(), nullable=True),
+        sa.Column('sale_result', sa.String(), nullable=True),
+        sa.Column('sale_confirmed', sa.Integer(), nullable=True),
+        sa.Column('analyzed_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('transcript')
+    )
+    op.create_index(op.f('ix_call_analysis_call'), 'call_analysis', ['call'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_call_analysis_call'), table_name='call_analysis')
+    op.drop_table('call_analysis')
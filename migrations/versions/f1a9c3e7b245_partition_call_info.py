@@ -0,0 +1,139 @@
+"""partition call_info by month on call_ts
+
+Revision ID: f1a9c3e7b245
+Revises: e4b8d2a6f013
+Create Date: 2026-10-19 19:05:33.104877
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1a9c3e7b245'
+down_revision: Union[str, None] = 'e4b8d2a6f013'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Должно совпадать с search.NORMALIZED_DIALOG (см. 8d41c0e6a9f2)
+APOSTROPHE_VARIANTS = "ʻʼ’‘`"
+NORMALIZED_DIALOG = "translate({column}, '" + APOSTROPHE_VARIANTS + "', '" + "''" * len(APOSTROPHE_VARIANTS) + "')"
+
+DATA_COLUMNS = ("operator_id, client_id, operator_txt, client_txt, dialog_txt, status_ai, status_1c, datetime, "
+                "order_id, call_id, call_info, audio_path")
+# Секции создаются на столько месяцев вперед, дальше - partitions.py
+AHEAD_MONTHS = 3
+# Строк call_info на один INSERT при заполнении call_ts
+BACKFILL_BATCH = 5000
+
+
+def call_timestamp(call_datetime):
+    """
+    Должно совпадать с kpi.call_timestamp: `datetime` звонка в формате ISO, без часового
+    пояса - местное время процесса; некорректное значение - текущее время.
+    """
+    try:
+        return datetime.fromisoformat(call_datetime).astimezone()
+    except (TypeError, ValueError):
+        return datetime.now().astimezone()
+
+
+def _create_search_indexes(table: str) -> None:
+    op.execute(f"CREATE INDEX ix_{table}_dialog_tsv ON {table} USING gin (dialog_tsv)")
+    op.execute(
+        f"CREATE INDEX ix_{table}_dialog_trgm ON {table} "
+        f"USING gin (({NORMALIZED_DIALOG.format(column='dialog_txt')}) gin_trgm_ops)"
+    )
+
+
+def _columns_ddl(table: str) -> str:
+    tsv_source = NORMALIZED_DIALOG.format(column="coalesce(dialog_txt, '')")
+    return (
+        f"CREATE TABLE {table} ("
+        "id integer NOT NULL DEFAULT nextval('call_info_id_seq'), "
+        "operator_id integer NOT NULL REFERENCES operator (id), "
+        "client_id integer NOT NULL REFERENCES client (id), "
+        "operator_txt varchar, client_txt varchar, dialog_txt varchar, status_ai varchar, status_1c varchar, "
+        "datetime varchar, order_id varchar, call_id varchar, call_info varchar, audio_path varchar, "
+        "call_ts timestamptz NOT NULL DEFAULT now(), "
+        f"dialog_tsv tsvector GENERATED ALWAYS AS (to_tsvector('simple', {tsv_source})) STORED, "
+    )
+
+
+def upgrade() -> None:
+    if context.is_offline_mode():
+        # call_ts уже сохраненных звонков вычисляется в Python теми же правилами, что и при сохранении
+        raise RuntimeError("Partitioning call_info requires an online migration (without --sql)")
+
+    # Ключ секционирования должен входить в уникальные ограничения, поэтому ссылка
+    # call_flags -> call_info(id) невозможна; флаги удаляет partitions.py вместе с секцией
+    op.drop_constraint('call_flags_call_info_id_fkey', 'call_flags', type_='foreignkey')
+
+    op.execute("ALTER TABLE call_info RENAME TO call_info_unpartitioned")
+    op.execute("DROP INDEX ix_call_info_dialog_trgm")
+    op.execute("DROP INDEX ix_call_info_dialog_tsv")
+    op.execute("ALTER TABLE call_info_unpartitioned RENAME CONSTRAINT call_info_pkey TO call_info_unpartitioned_pkey")
+
+    op.execute(_columns_ddl("call_info") + "PRIMARY KEY (id, call_ts)) PARTITION BY RANGE (call_ts)")
+    _create_search_indexes("call_info")
+    op.execute("CREATE INDEX ix_call_info_call_ts ON call_info (call_ts)")
+    op.execute("CREATE TABLE call_info_default PARTITION OF call_info DEFAULT")
+
+    # Месячные секции с первого месяца уже сохраненных звонков. call_ts вычисляется так же,
+    # как kpi.call_timestamp при сохранении (миграцию запускать с часовым поясом приложения),
+    # некорректные значения `datetime` (например, 13-й месяц) получают время миграции
+    op.execute("CREATE TEMPORARY TABLE call_info_ts (id integer PRIMARY KEY, call_ts timestamptz NOT NULL) "
+               "ON COMMIT DROP")
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.text("SELECT id, datetime FROM call_info_unpartitioned").execution_options(stream_results=True)
+    )
+    insert_ts = sa.text("INSERT INTO call_info_ts (id, call_ts) VALUES (:id, :call_ts)")
+    while batch := rows.fetchmany(BACKFILL_BATCH):
+        bind.execute(insert_ts, [{"id": row.id, "call_ts": call_timestamp(row.datetime)} for row in batch])
+    op.execute(f"""
+        DO $$
+        DECLARE
+            part_month date := date_trunc('month', coalesce((SELECT min(call_ts) FROM call_info_ts), now()))::date;
+            last_month date := (date_trunc('month', now()) + interval '{AHEAD_MONTHS} months')::date;
+        BEGIN
+            WHILE part_month <= last_month LOOP
+                EXECUTE format('CREATE TABLE %I PARTITION OF call_info FOR VALUES FROM (%L) TO (%L)',
+                               'call_info_p' || to_char(part_month, 'YYYYMM'), part_month, part_month + interval '1 month');
+                part_month := part_month + interval '1 month';
+            END LOOP;
+        END $$
+    """)
+
+    op.execute(
+        f"INSERT INTO call_info (id, {DATA_COLUMNS}, call_ts) "
+        f"SELECT c.id, {', '.join('c.' + name.strip() for name in DATA_COLUMNS.split(','))}, t.call_ts "
+        "FROM call_info_unpartitioned c JOIN call_info_ts t ON t.id = c.id"
+    )
+    op.execute("ALTER SEQUENCE call_info_id_seq OWNED BY call_info.id")
+    op.execute("DROP TABLE call_info_unpartitioned")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE call_info RENAME TO call_info_partitioned")
+    op.execute("ALTER TABLE call_info_partitioned RENAME CONSTRAINT call_info_pkey TO call_info_partitioned_pkey")
+    op.execute("DROP INDEX ix_call_info_dialog_trgm")
+    op.execute("DROP INDEX ix_call_info_dialog_tsv")
+    op.execute("DROP INDEX ix_call_info_call_ts")
+
+    op.execute(_columns_ddl("call_info") + "PRIMARY KEY (id))")
+    op.execute(
+        f"INSERT INTO call_info (id, {DATA_COLUMNS}, call_ts) "
+        f"SELECT id, {DATA_COLUMNS}, call_ts FROM call_info_partitioned"
+    )
+    op.execute("ALTER TABLE call_info DROP COLUMN call_ts")
+    _create_search_indexes("call_info")
+    op.execute("ALTER SEQUENCE call_info_id_seq OWNED BY call_info.id")
+    op.execute("DROP TABLE call_info_partitioned CASCADE")
+
+    op.execute("DELETE FROM call_flags WHERE call_info_id NOT IN (SELECT id FROM call_info)")
+    op.create_foreign_key('call_flags_call_info_id_fkey', 'call_flags', 'call_info', ['call_info_id'], ['id'],
+                          ondelete='CASCADE')
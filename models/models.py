@@ -1,11 +1,21 @@
-from sqlalchemy import Table, Column, Integer, String, Float, Boolean, MetaData, DateTime, ForeignKey, TIMESTAMP
+from sqlalchemy import Table, Column, Integer, String, Float, Boolean, MetaData, DateTime, ForeignKey, TIMESTAMP, JSON, \
+    LargeBinary, Index, func, Date
 
 metadata = MetaData()
 
 
+# В PostgreSQL миграция дополнительно создает генерируемую колонку `dialog_tsv` (tsvector)
+# и GIN индексы для полнотекстового и триграммного поиска (см. search.py).
+# В PostgreSQL таблица секционирована по месяцам по `call_ts` (partitions.py), первичный
+# ключ там (id, call_ts): ключ секционирования обязан входить в уникальные ограничения.
+# В модели ключ остается по `id`: для metadata.create_all (SQLite) автоинкремент `id`
+# возможен только при единственной колонке ключа. Схему PostgreSQL задают миграции
+# (f1a9c3e7b245), а секции и колонки/индексы, созданные ими SQL, исключены из
+# autogenerate (include_object в migrations/env.py)
 call_info_table = Table(
     'call_info',
     metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
     Column('operator_id', Integer, ForeignKey('operator.id'), nullable=False),  # Operator ID
     Column('client_id', Integer, ForeignKey('client.id'), nullable=False),  # Client ID
     Column('operator_txt', String, nullable=True),
@@ -18,6 +28,10 @@ call_info_table = Table(
     Column('call_id', String, nullable=True),
     Column('call_info', String, nullable=True),
     Column('audio_path', String, nullable=True),
+    Column('call', String, nullable=True),  # Имя папки запроса (uploads/<call>)
+    Column('call_ts', TIMESTAMP(timezone=True), nullable=False, server_default=func.now()),  # Время звонка
+    Index('ix_call_info_call_ts', 'call_ts'),
+    Index('ix_call_info_call', 'call'),
 )
 
 operator_table = Table(
@@ -34,4 +48,128 @@ client_table = Table(
     Column('id', Integer, primary_key=True, index=True, autoincrement=True),
     Column('name', String, nullable=False),
     Column('phone', String, nullable=False),
-)
\ No newline at end of file
+)
+
+
+job_queue_table = Table(
+    'job_queue',
+    metadata,
+    Column('id', Integer, primary_key=True, index=True, autoincrement=True),
+    Column('kind', String, nullable=False),  # transcribe, ...
+    Column('status', String, nullable=False, server_default='pending'),  # pending, running, done, failed
+    Column('audio_path', String, nullable=True),  # Path on shared storage
+    Column('audio_name', String, nullable=True),
+    Column('audio_data', LargeBinary, nullable=True),  # Inline audio when no shared storage
+    Column('payload', JSON, nullable=True),
+    Column('result', JSON, nullable=True),
+    Column('error', String, nullable=True),
+    Column('attempts', Integer, nullable=False, server_default='0'),
+    Column('max_attempts', Integer, nullable=False, server_default='3'),
+    Column('worker_id', String, nullable=True),
+    Column('available_at', TIMESTAMP(timezone=True), nullable=False, server_default=func.now()),
+    Column('lease_expires_at', TIMESTAMP(timezone=True), nullable=True),
+    Column('heartbeat_at', TIMESTAMP(timezone=True), nullable=True),
+    Column('created_at', TIMESTAMP(timezone=True), nullable=False, server_default=func.now()),
+    Column('finished_at', TIMESTAMP(timezone=True), nullable=True),
+    Column('priority', String, nullable=False, server_default='normal'),  # realtime, normal, bulk (scheduler.py)
+    Index('ix_job_queue_claim', 'kind', 'status', 'priority', 'available_at'),
+)
+
+
+# Флаги анализа звонка (sentiment.analyze_conversation), агрегированные по сегментам.
+# Без внешнего ключа: на секционированную call_info нельзя сослаться только по id,
+# строки удаляются partitions.py вместе с секцией звонков
+call_flags_table = Table(
+    'call_flags',
+    metadata,
+    Column('call_info_id', Integer, primary_key=True),
+    Column('greeting', Integer, nullable=False, server_default='0'),  # Salomlashish
+    Column('name_asked', Integer, nullable=False, server_default='0'),  # Ism_so'rash
+    Column('seller_info', Integer, nullable=False, server_default='0'),  # Sotuvchi_haqida
+    Column('company', Integer, nullable=False, server_default='0'),  # Kompaniya
+    Column('medicine_info', Integer, nullable=False, server_default='0'),  # Dori_haqida
+    Column('illness_asked', Integer, nullable=False, server_default='0'),  # Kasalligini_so'rash
+    Column('medicine_name', Integer, nullable=False, server_default='0'),  # Dorining_nomi
+    Column('order_predicted', Integer, nullable=False, server_default='0'),  # Buyurtma
+    Column('sale_confirmed', Integer, nullable=False, server_default='0'),  # xaridni_aniqlash
+    Column('positive_pct', Float, nullable=True),
+)
+
+# Результат analyze_text по каждой транскрипции (сегмент и канал), пишется пачками (analysis_store.py)
+call_analysis_table = Table(
+    'call_analysis',
+    metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('transcript', String, nullable=False, unique=True),  # Имя файла транскрипции
+    Column('call', String, nullable=True, index=True),  # Имя папки запроса
+    Column('segment', Integer, nullable=True),
+    Column('role', String, nullable=True),  # operator, client
+    Column('word_count', Integer, nullable=False),
+    Column('unique_words', Integer, nullable=False),
+    Column('avg_word_length', Float, nullable=False),
+    Column('greeting', Integer, nullable=False, server_default='0'),
+    Column('name_asked', Integer, nullable=False, server_default='0'),
+    Column('seller_info', Integer, nullable=False, server_default='0'),
+    Column('company', Integer, nullable=False, server_default='0'),
+    Column('medicine_info', Integer, nullable=False, server_default='0'),
+    Column('illness_asked', Integer, nullable=False, server_default='0'),
+    Column('medicine_name', Integer, nullable=False, server_default='0'),
+    Column('order_predicted', Integer, nullable=False, server_default='0'),
+    Column('positive_pct', Float, nullable=True),
+    Column('negative_pct', Float, nullable=True),
+    Column('sale_result', String, nullable=True),  # Ответ xaridni_aniqlash
+    Column('sale_confirmed', Integer, nullable=True),  # NULL, если GPT не ответил
+    Column('analyzed_at', TIMESTAMP(timezone=True), nullable=False, server_default=func.now()),
+)
+
+# Инкрементальные агрегаты по оператору и дню, обновляются в одной транзакции со звонком
+operator_daily_kpi_table = Table(
+    'operator_daily_kpi',
+    metadata,
+    Column('operator_id', Integer, ForeignKey('operator.id'), primary_key=True),
+    Column('day', Date, primary_key=True),
+    Column('calls', Integer, nullable=False, server_default='0'),
+    Column('analyzed_calls', Integer, nullable=False, server_default='0'),
+    Column('greeting', Integer, nullable=False, server_default='0'),
+    Column('name_asked', Integer, nullable=False, server_default='0'),
+    Column('seller_info', Integer, nullable=False, server_default='0'),
+    Column('company', Integer, nullable=False, server_default='0'),
+    Column('medicine_info', Integer, nullable=False, server_default='0'),
+    Column('illness_asked', Integer, nullable=False, server_default='0'),
+    Column('medicine_name', Integer, nullable=False, server_default='0'),
+    Column('order_predicted', Integer, nullable=False, server_default='0'),
+    Column('sale_confirmed', Integer, nullable=False, server_default='0'),
+    Column('positive_pct_sum', Float, nullable=False, server_default='0'),
+    Column('positive_pct_count', Integer, nullable=False, server_default='0'),
+)
+
+# Загрузки /upload по ключу идемпотентности (call_id) и хешу содержимого аудио;
+# повторная загрузка того же звонка возвращает уже созданный звонок без обработки
+upload_dedup_table = Table(
+    'upload_dedup',
+    metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('idempotency_key', String, nullable=True, unique=True),
+    Column('content_hash', String, nullable=True, unique=True),  # sha256 аудиофайлов загрузки
+    Column('call', String, nullable=False),  # Имя папки запроса
+    Column('created_at', TIMESTAMP(timezone=True), nullable=False, server_default=func.now()),
+)
+
+# Результаты звонков для внешнего API (transactional outbox): строка пишется в одной
+# транзакции с call_info и доставляется outbox.py с повторами; pending, sending, sent, dead
+result_outbox_table = Table(
+    'result_outbox',
+    metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('call', String, nullable=True),  # Имя папки запроса
+    Column('order_id', String, nullable=True, index=True),
+    Column('payload', JSON, nullable=False),
+    Column('status', String, nullable=False, server_default='pending'),
+    Column('attempts', Integer, nullable=False, server_default='0'),
+    Column('available_at', TIMESTAMP(timezone=True), nullable=False, server_default=func.now()),
+    Column('lease_expires_at', TIMESTAMP(timezone=True), nullable=True),
+    Column('last_error', String, nullable=True),
+    Column('created_at', TIMESTAMP(timezone=True), nullable=False, server_default=func.now()),
+    Column('sent_at', TIMESTAMP(timezone=True), nullable=True),
+    Index('ix_result_outbox_claim', 'status', 'available_at'),
+)
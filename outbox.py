@@ -0,0 +1,338 @@
+"""
+Доставка результатов звонков во внешний API (`RESULT_API_URL`) через таблицу `result_outbox`.
+
+Запись для API сохраняется в `result_outbox` в одной транзакции с `call_info`
+(`save_data_to_db`), поэтому сохраненный звонок не может остаться неотправленным, а
+отправка не зависит от того, попадет ли папка запроса снова в окно обработки
+`send_result_to_api`. Отправитель (`OutboxDispatcher`) забирает строки с арендой
+(`SELECT ... FOR UPDATE SKIP LOCKED`, можно запускать несколько отправителей) и
+отправляет их параллельно через один HTTP клиент с пулом соединений:
+
+- не больше `RESULT_OUTBOX_MAX_IN_FLIGHT` запросов одновременно;
+- `RESULT_OUTBOX_BATCH_SIZE` > 1 - несколько записей в одном запросе (JSON массив);
+- ошибка сети или ответ 5xx/408/429 - повтор через `RESULT_OUTBOX_RETRY_SECONDS`,
+  удваивающийся с каждой попыткой (не больше `RESULT_OUTBOX_RETRY_MAX_SECONDS`);
+- другой ответ 4xx или исчерпан лимит попыток - строка получает статус `dead`
+  (dead-letter) и остается в таблице с последней ошибкой.
+
+Доставка "хотя бы один раз": строка отмечается `sent` только после ответа 2xx; если
+отправитель упал после запроса, строка будет отправлена повторно после истечения
+аренды. Получатель различает повторы по `order_id`.
+
+Пока аудио звонка архивируется, строка не отправляется (`hold_seconds`): после
+архивации в запись подставляется путь к архиву (`release_result`). Если архивирование
+отложено (сегменты еще не объединены) или не удалось, строка ждет дальше (`hold_result`),
+и ее отпускает компактор `archive.py`, когда заархивирует звонок. Если процесс упал до
+этого, строка уйдет с исходным путем по истечении `RESULT_OUTBOX_HOLD_SECONDS`
+(`ARCHIVE_HOLD_SECONDS` при отложенном архивировании).
+
+Отправитель работает в процессе `example.py` (`RESULT_OUTBOX_IN_MERGER`) или отдельно:
+    python outbox.py                      # отправлять постоянно
+    python outbox.py --once               # отправить доступное и выйти
+    python outbox.py --requeue-dead       # вернуть dead-letter строки в очередь
+    python outbox.py --purge-sent-days 30 # удалить отправленные строки старше 30 дней
+"""
+import argparse
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import aiohttp
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import (ARCHIVE_COMPACT_INTERVAL, ARCHIVE_FORCE_AFTER_HOURS, RESULT_API_TIMEOUT, RESULT_API_URL,
+                    RESULT_OUTBOX_BATCH_SIZE, RESULT_OUTBOX_HOLD_SECONDS, RESULT_OUTBOX_LEASE_SECONDS,
+                    RESULT_OUTBOX_MAX_ATTEMPTS, RESULT_OUTBOX_MAX_IN_FLIGHT, RESULT_OUTBOX_POLL_INTERVAL,
+                    RESULT_OUTBOX_RETRY_MAX_SECONDS, RESULT_OUTBOX_RETRY_SECONDS)
+from database import async_session_maker, db_time_after
+from events import publish_event
+from metrics import API_POST_SECONDS, FILES_PROCESSED, QUEUE_DEPTH
+from models.models import result_outbox_table
+
+outbox = result_outbox_table.c
+# Отложенное архивирование компактор выполняет принудительно через ARCHIVE_FORCE_AFTER_HOURS,
+# до этого (с запасом) запись звонка ждет пути к архиву
+ARCHIVE_HOLD_SECONDS = ARCHIVE_FORCE_AFTER_HOURS * 3600 + ARCHIVE_COMPACT_INTERVAL + RESULT_OUTBOX_HOLD_SECONDS
+
+
+async def enqueue_results(session: AsyncSession, records: List[Dict], calls: List[str] = None,
+                          hold_seconds: float = 0):
+    """
+    Добавляет записи для API в outbox одним запросом. Коммит выполняет вызывающая
+    сторона (та же транзакция, что и запись звонков). `calls` - имена папок запросов
+    записей, `hold_seconds` - отложить отправку (архивация).
+    """
+    if not records:
+        return
+    rows = [dict(call=calls[index] if calls else None, order_id=record.get("order_id"), payload=record)
+            for index, record in enumerate(records)]
+    if hold_seconds:
+        available_at = db_time_after(session, hold_seconds)
+        for row in rows:
+            row["available_at"] = available_at
+    await session.execute(insert(result_outbox_table).values(rows))
+
+
+def _held(order_id: str):
+    """Условие отложенной строки звонка: ждет архивации и еще ни разу не отправлялась."""
+    return and_(outbox.order_id == order_id, outbox.status == 'pending', outbox.attempts == 0)
+
+
+async def release_result(order_id: str, audio_path: str):
+    """
+    Разрешает отправку отложенной записи звонка `order_id`, подставляя путь к архиву аудио.
+    Вызывается после архивации (`archive.archive_call`).
+    """
+    async with async_session_maker() as session:
+        rows = (await session.execute(select(outbox.id, outbox.payload).where(_held(order_id)))).fetchall()
+        for row in rows:
+            await session.execute(update(result_outbox_table).where(outbox.id == row.id)
+                                  .values(payload={**row.payload, "audio_path": audio_path}, available_at=func.now()))
+        await session.commit()
+
+
+async def hold_result(order_id: str, seconds: float = ARCHIVE_HOLD_SECONDS):
+    """
+    Продлевает ожидание отложенной записи звонка `order_id`, архивирование которого
+    отложено (сегменты еще не объединены) или не удалось: ее отпустит компактор после архивации.
+    """
+    async with async_session_maker() as session:
+        await session.execute(update(result_outbox_table).where(_held(order_id))
+                              .values(available_at=db_time_after(session, seconds)))
+        await session.commit()
+
+
+async def claim_results(session: AsyncSession, limit: int, lease_seconds: int = RESULT_OUTBOX_LEASE_SECONDS):
+    """
+    Захватывает до `limit` готовых к отправке строк (и строк с истекшей арендой) и
+    фиксирует транзакцию. Номер попытки увеличивается при захвате.
+    """
+    claim_stmt = (
+        select(outbox.id)
+        .where(or_(
+            and_(outbox.status == 'pending', outbox.available_at <= func.now()),
+            and_(outbox.status == 'sending', outbox.lease_expires_at < func.now()),
+        ))
+        .order_by(outbox.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    ids = (await session.scalars(claim_stmt)).all()
+    if not ids:
+        await session.commit()
+        return []
+    res = await session.execute(
+        update(result_outbox_table)
+        .where(outbox.id.in_(ids))
+        .values(status='sending', attempts=outbox.attempts + 1,
+                lease_expires_at=db_time_after(session, lease_seconds))
+        .returning(outbox.id, outbox.call, outbox.order_id, outbox.payload, outbox.attempts)
+    )
+    rows = sorted(res.fetchall(), key=lambda row: row.id)
+    await session.commit()
+    return rows
+
+
+async def mark_sent(session: AsyncSession, ids: List[int]):
+    await session.execute(
+        update(result_outbox_table)
+        .where(outbox.id.in_(ids), outbox.status == 'sending')
+        .values(status='sent', sent_at=func.now(), lease_expires_at=None, last_error=None)
+    )
+    await session.commit()
+
+
+def retry_delay(attempts: int) -> float:
+    """Задержка перед следующей попыткой: удваивается с каждой попыткой."""
+    return min(RESULT_OUTBOX_RETRY_SECONDS * 2 ** max(attempts - 1, 0), RESULT_OUTBOX_RETRY_MAX_SECONDS)
+
+
+async def mark_failed(session: AsyncSession, rows, error: str, permanent: bool = False,
+                      max_attempts: int = RESULT_OUTBOX_MAX_ATTEMPTS) -> Dict[int, str]:
+    """
+    Возвращает строки в очередь с экспоненциальной задержкой или переводит в `dead`.
+
+    Возвращает:
+        dict: Новый статус каждой строки.
+    """
+    statuses, retries = {}, defaultdict(list)
+    for row in rows:
+        if permanent or row.attempts >= max_attempts:
+            statuses[row.id] = 'dead'
+        else:
+            statuses[row.id] = 'pending'
+            retries[retry_delay(row.attempts)].append(row.id)
+
+    dead = [row_id for row_id, status in statuses.items() if status == 'dead']
+    if dead:
+        await session.execute(
+            update(result_outbox_table).where(outbox.id.in_(dead), outbox.status == 'sending')
+            .values(status='dead', last_error=error[:2000], lease_expires_at=None)
+        )
+    for delay, ids in retries.items():
+        await session.execute(
+            update(result_outbox_table).where(outbox.id.in_(ids), outbox.status == 'sending')
+            .values(status='pending', last_error=error[:2000], lease_expires_at=None,
+                    available_at=db_time_after(session, delay))
+        )
+    await session.commit()
+    return statuses
+
+
+async def pending_count(session: AsyncSession) -> int:
+    return await session.scalar(
+        select(func.count()).select_from(result_outbox_table).where(outbox.status.in_(('pending', 'sending')))
+    )
+
+
+async def requeue_dead(session: AsyncSession) -> int:
+    """Возвращает dead-letter строки в очередь с обнуленным счетчиком попыток."""
+    res = await session.execute(
+        update(result_outbox_table).where(outbox.status == 'dead')
+        .values(status='pending', attempts=0, available_at=func.now())
+    )
+    await session.commit()
+    return res.rowcount
+
+
+async def purge_sent(session: AsyncSession, days: int) -> int:
+    """Удаляет отправленные строки старше `days` дней."""
+    res = await session.execute(
+        delete(result_outbox_table)
+        .where(outbox.status == 'sent', outbox.sent_at < db_time_after(session, -days * 86400))
+    )
+    await session.commit()
+    return res.rowcount
+
+
+def is_permanent(status: int) -> bool:
+    """Ответ, повтор которого ничего не изменит (ошибка в самой записи)."""
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+class OutboxDispatcher:
+    """Отправляет строки `result_outbox` во внешний API параллельно, с повторами."""
+
+    def __init__(self, url: str = RESULT_API_URL, max_in_flight: int = RESULT_OUTBOX_MAX_IN_FLIGHT,
+                 batch_size: int = RESULT_OUTBOX_BATCH_SIZE, max_attempts: int = RESULT_OUTBOX_MAX_ATTEMPTS,
+                 poll_interval: float = RESULT_OUTBOX_POLL_INTERVAL, timeout: float = RESULT_API_TIMEOUT):
+        self.url = url
+        self.max_in_flight = max(max_in_flight, 1)
+        self.batch_size = max(batch_size, 1)
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def body(self, rows):
+        """Тело запроса: одна запись или JSON массив записей при пакетной отправке."""
+        if self.batch_size > 1:
+            return [row.payload for row in rows]
+        return rows[0].payload
+
+    async def deliver(self, http: aiohttp.ClientSession, rows):
+        """Отправляет пачку строк одним запросом и записывает результат в outbox."""
+        error, permanent = None, False
+        started = time.perf_counter()
+        try:
+            async with http.post(self.url, json=self.body(rows)) as response:
+                await response.read()
+                API_POST_SECONDS.labels(str(response.status)).observe(time.perf_counter() - started)
+                if not 200 <= response.status < 300:
+                    error, permanent = f"HTTP {response.status}", is_permanent(response.status)
+        except Exception as e:
+            API_POST_SECONDS.labels("error").observe(time.perf_counter() - started)
+            error = str(e) or type(e).__name__
+
+        try:
+            async with async_session_maker() as session:
+                if error is None:
+                    await mark_sent(session, [row.id for row in rows])
+                    statuses = {row.id: 'sent' for row in rows}
+                else:
+                    statuses = await mark_failed(session, rows, error, permanent, self.max_attempts)
+        except Exception as e:
+            # Строки останутся в `sending` и будут отправлены снова после истечения аренды
+            logging.error(f"Failed to record delivery of outbox rows {[row.id for row in rows]}: {e}")
+            return
+
+        for row in rows:
+            status = statuses[row.id]
+            FILES_PROCESSED.labels("result_outbox", "retry" if status == 'pending' else status).inc()
+            if status == 'sent':
+                await publish_event(row.call, "sent", order_id=row.order_id, audio_path=row.payload.get("audio_path"))
+            elif status == 'dead':
+                logging.error(f"Outbox row {row.id} (order {row.order_id}) dead-lettered: {error}")
+                await publish_event(row.call, "failed", error=error)
+        if error:
+            logging.warning(f"Result API delivery failed for {len(rows)} rows: {error}")
+
+    async def run(self, until_idle: bool = False):
+        """
+        Забирает строки, пока есть свободные слоты, и ждет завершения отправок.
+        `until_idle` - выйти, когда нет ни готовых строк, ни отправок в процессе.
+        """
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+        in_flight = set()
+        async with aiohttp.ClientSession(connector=connector,
+                                         timeout=aiohttp.ClientTimeout(total=self.timeout)) as http:
+            try:
+                while True:
+                    free = self.max_in_flight - len(in_flight)
+                    rows = []
+                    if free:
+                        try:
+                            async with async_session_maker() as session:
+                                rows = await claim_results(session, free * self.batch_size)
+                        except Exception as e:
+                            logging.error(f"Outbox claim failed: {e}")
+                    for start in range(0, len(rows), self.batch_size):
+                        in_flight.add(asyncio.create_task(self.deliver(http, rows[start:start + self.batch_size])))
+
+                    if in_flight:
+                        done, in_flight = await asyncio.wait(in_flight, timeout=self.poll_interval,
+                                                             return_when=asyncio.FIRST_COMPLETED)
+                        continue
+                    if until_idle:
+                        return
+                    await self.report_depth()
+                    await asyncio.sleep(self.poll_interval)
+            finally:
+                if in_flight:
+                    await asyncio.wait(in_flight)
+
+    async def report_depth(self):
+        try:
+            async with async_session_maker() as session:
+                QUEUE_DEPTH.labels("result_outbox").set(await pending_count(session))
+        except Exception as e:
+            logging.error(f"Outbox depth query failed: {e}")
+
+
+async def main(args):
+    async with async_session_maker() as session:
+        if args.requeue_dead:
+            logging.info(f"Requeued {await requeue_dead(session)} dead-lettered results")
+            return
+        if args.purge_sent_days:
+            logging.info(f"Purged {await purge_sent(session, args.purge_sent_days)} sent results")
+            return
+    dispatcher = OutboxDispatcher(args.url, args.max_in_flight, args.batch_size)
+    await dispatcher.run(until_idle=args.once)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Deliver call results from result_outbox to the result API")
+    parser.add_argument("--url", default=RESULT_API_URL)
+    parser.add_argument("--max-in-flight", type=int, default=RESULT_OUTBOX_MAX_IN_FLIGHT)
+    parser.add_argument("--batch-size", type=int, default=RESULT_OUTBOX_BATCH_SIZE,
+                        help="Results per request; above 1 the body is a JSON array")
+    parser.add_argument("--once", action="store_true", help="Deliver what is ready and exit")
+    parser.add_argument("--requeue-dead", action="store_true", help="Return dead-lettered results to the queue")
+    parser.add_argument("--purge-sent-days", type=int, default=0, help="Delete results sent more than N days ago")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,175 @@
+"""
+Обслуживание секций `call_info` (PostgreSQL).
+
+`call_info` секционирована по диапазону `call_ts` помесячно: секция `call_info_pYYYYMM`
+хранит звонки месяца, `call_info_default` - звонки вне созданных секций, поэтому вставка
+не зависит от того, запускалось ли обслуживание. Запросы с фильтром по `call_ts`
+(`/search?date_from=...`, `backfill.py --date-from`) читают только секции нужных месяцев.
+
+Запуск раз в день (cron или systemd timer):
+    python partitions.py                         # секции на CALL_INFO_PARTITION_AHEAD_MONTHS вперед
+    python partitions.py --retention-months 24   # и отсоединить секции старше 24 месяцев
+    python partitions.py --retention-months 24 --drop
+
+Истекшая секция отсоединяется (`DETACH PARTITION`) или удаляется целиком вместо
+DELETE по строкам; флаги ее звонков (`call_flags`) удаляются перед этим. Агрегаты
+`operator_daily_kpi` не меняются, статистика за прошлые периоды сохраняется.
+Отсоединенная таблица остается в БД для выгрузки (`pg_dump -t call_info_p202301`) и
+удаляется вручную.
+"""
+import argparse
+import asyncio
+import logging
+import re
+from datetime import date
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+
+from config import CALL_INFO_PARTITION_AHEAD_MONTHS, CALL_INFO_RETENTION_MODE, CALL_INFO_RETENTION_MONTHS
+from models.models import call_info_table
+
+PARENT = "call_info"
+DEFAULT_PARTITION = "call_info_default"
+_PARTITION_NAME = re.compile(r"^call_info_p(\d{4})(\d{2})$")
+
+# Колонки для переноса строк между секциями (генерируемую dialog_tsv PostgreSQL вычисляет сам)
+COLUMNS = ", ".join(column.name for column in call_info_table.columns)
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"call_info_p{month:%Y%m}"
+
+
+def is_partition(name: str) -> bool:
+    """Таблица - секция call_info (месячная, в том числе отсоединенная, или секция по умолчанию)."""
+    return name == DEFAULT_PARTITION or bool(_PARTITION_NAME.match(name))
+
+
+def partition_bounds(month: date) -> Tuple[str, str]:
+    """
+    Границы секции месяца `[начало, начало следующего)`. Даты подставляются в SQL
+    литералами и, как и границы секций, понимаются в часовом поясе сессии БД.
+    """
+    return month.isoformat(), add_months(month, 1).isoformat()
+
+
+async def list_partitions(conn) -> Dict[str, date]:
+    """Месячные секции call_info: имя -> первый день месяца."""
+    result = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = :parent"
+    ), {"parent": PARENT})
+    partitions = {}
+    for (name,) in result:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions[name] = date(int(match.group(1)), int(match.group(2)), 1)
+    return partitions
+
+
+async def create_partition(conn, month: date) -> bool:
+    """
+    Создает секцию месяца. Звонки этого месяца, уже попавшие в секцию по умолчанию,
+    переносятся в новую секцию (иначе PostgreSQL не даст ее создать).
+    """
+    name = partition_name(month)
+    start, end = partition_bounds(month)
+    in_range = f"call_ts >= '{start}' AND call_ts < '{end}'"
+    in_default = (await conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range})"
+    ))).scalar()
+
+    bounds = f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    if not in_default:
+        await conn.execute(text(f"CREATE TABLE {name} PARTITION OF {PARENT} {bounds}"))
+        return True
+
+    await conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {DEFAULT_PARTITION}"))
+    await conn.execute(text(f"CREATE TABLE {name} PARTITION OF {PARENT} {bounds}"))
+    moved = await conn.execute(text(
+        f"INSERT INTO {PARENT} ({COLUMNS}) SELECT {COLUMNS} FROM {DEFAULT_PARTITION} WHERE {in_range}"
+    ))
+    await conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE {in_range}"))
+    await conn.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    logging.info(f"Moved {moved.rowcount} calls from {DEFAULT_PARTITION} to {name}")
+    return True
+
+
+async def ensure_partitions(conn, ahead: int = CALL_INFO_PARTITION_AHEAD_MONTHS, today: date = None) -> List[str]:
+    """Создает недостающие секции с текущего месяца на `ahead` месяцев вперед."""
+    current = month_start(today or date.today())
+    existing = set((await list_partitions(conn)).values())
+    created = []
+    for offset in range(ahead + 1):
+        month = add_months(current, offset)
+        if month not in existing and await create_partition(conn, month):
+            created.append(partition_name(month))
+    return created
+
+
+async def expire_partitions(conn, retention_months: int = CALL_INFO_RETENTION_MONTHS,
+                            drop: bool = CALL_INFO_RETENTION_MODE == "drop", today: date = None) -> List[str]:
+    """
+    Отсоединяет (или удаляет) секции, целиком старше `retention_months` месяцев,
+    и удаляет такие же старые звонки из секции по умолчанию.
+    """
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(month_start(today or date.today()), -retention_months)
+    expired = []
+    for name, month in sorted((await list_partitions(conn)).items(), key=lambda item: item[1]):
+        if add_months(month, 1) > cutoff:
+            continue
+        await conn.execute(text(f"DELETE FROM call_flags WHERE call_info_id IN (SELECT id FROM {name})"))
+        await conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+        if drop:
+            await conn.execute(text(f"DROP TABLE {name}"))
+        expired.append(name)
+
+    old = f"call_ts < '{cutoff.isoformat()}'"
+    await conn.execute(text(f"DELETE FROM call_flags WHERE call_info_id IN (SELECT id FROM {DEFAULT_PARTITION} "
+                            f"WHERE {old})"))
+    await conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE {old}"))
+    return expired
+
+
+async def maintain(ahead: int = CALL_INFO_PARTITION_AHEAD_MONTHS, retention_months: int = CALL_INFO_RETENTION_MONTHS,
+                   drop: bool = CALL_INFO_RETENTION_MODE == "drop") -> Dict:
+    """Один проход обслуживания: создание и истечение секций в отдельных транзакциях."""
+    from database import engine
+
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("call_info partitions require PostgreSQL")
+    async with engine.begin() as conn:
+        created = await ensure_partitions(conn, ahead)
+    async with engine.begin() as conn:
+        expired = await expire_partitions(conn, retention_months, drop)
+    await engine.dispose()
+    summary = {"created": created, "dropped" if drop else "detached": expired}
+    logging.info(f"call_info partitions: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Create upcoming call_info partitions and expire old ones")
+    parser.add_argument("--ahead", type=int, default=CALL_INFO_PARTITION_AHEAD_MONTHS,
+                        help="Months of partitions to create ahead of the current one")
+    parser.add_argument("--retention-months", type=int, default=CALL_INFO_RETENTION_MONTHS,
+                        help="Expire partitions older than this many months (0 - keep forever)")
+    parser.add_argument("--drop", action="store_true", default=CALL_INFO_RETENTION_MODE == "drop",
+                        help="Drop expired partitions instead of detaching them")
+    args = parser.parse_args()
+
+    asyncio.run(maintain(args.ahead, args.retention_months, args.drop))
@@ -0,0 +1,217 @@
+"""
+Запуск нескольких STT воркеров очереди задач с одной копией весов моделей на узел.
+
+    python prefork.py --workers 4
+
+Родительский процесс один раз загружает Whisper (`stt_model`) и модель тональности
+(`sentiment`), замораживает сборщик мусора (`gc.freeze`) и порождает воркеры через
+fork. Веса лежат в памяти родителя и доступны воркерам по copy-on-write: тензоры
+весов только читаются, а замороженные объекты Python не переписываются сборщиком
+мусора, поэтому страницы остаются общими. Каждый воркер держит только свои буферы
+инференса.
+
+До fork torch работает в одном потоке (пул OpenMP, созданный до fork, в дочернем
+процессе не работает), воркеры задают свое число потоков и прогревают модели уже
+после fork. По той же причине сессия ONNX Runtime (`SENTIMENT_BACKEND=onnx`)
+создается в каждом воркере заново, а движок CTranslate2 не поддерживается: он
+разделяет веса между своими потоками в одном процессе (`STT_CT2_WORKERS`).
+
+Родитель перезапускает упавшие воркеры с растущей задержкой (воркер, падающий при
+старте - недоступна БД, занят порт метрик, - не перезапускается в цикле) и завершается
+с ошибкой, если слот падает слишком часто. Родитель также периодически пишет в лог память каждого
+воркера: RSS, PSS и USS (уникальная память процесса, из /proc/<pid>/smaps_rollup).
+"""
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from collections import deque
+from multiprocessing.connection import wait
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import (PREFORK_MAX_RESTARTS, PREFORK_REPORT_INTERVAL, PREFORK_RESTART_BACKOFF,
+                    PREFORK_RESTART_BACKOFF_MAX, PREFORK_RESTART_WINDOW, PREFORK_THREADS, PREFORK_WORKERS,
+                    SENTIMENT_BACKEND, STT_ENGINE, STT_WORKER_METRICS_PORT)
+
+SAMPLING_RATE = 16000
+
+
+def memory_usage(pid: int) -> Dict[str, float]:
+    """RSS, PSS и USS процесса в мегабайтах (Linux)."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    uss = values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+    return {"rss_mb": round(values.get("Rss", 0) / 1024, 1), "pss_mb": round(values.get("Pss", 0) / 1024, 1),
+            "uss_mb": round(uss / 1024, 1)}
+
+
+def preload():
+    """Загружает модели в родительском процессе (без инференса) и замораживает объекты для fork."""
+    if STT_ENGINE != "transformers":
+        raise SystemExit(f"prefork.py shares PyTorch weights only; STT_ENGINE={STT_ENGINE} cannot be forked "
+                         f"after loading, run one stt_worker.py with STT_CT2_WORKERS instead")
+    import torch
+
+    torch.set_num_threads(1)
+    started = time.perf_counter()
+    # file_watcher импортирует stt_model и text_analysis -> sentiment
+    import file_watcher  # noqa: F401
+    import stt_worker  # noqa: F401
+
+    logging.info(f"Models loaded in {time.perf_counter() - started:.1f}s, parent memory: {memory_usage(os.getpid())}")
+    gc.collect()
+    gc.freeze()
+
+
+def worker_main(index: int, threads: int, output_directory: str, metrics_port: int):
+    """Точка входа воркера после fork: потоки, прогрев моделей и цикл очереди задач."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    import torch
+
+    import sentiment
+    import stt_model
+    from stt_worker import run_worker
+
+    torch.set_num_threads(threads)
+    if SENTIMENT_BACKEND == "onnx":
+        from sentiment_onnx import OnnxSequenceClassifier
+
+        sentiment.model_X = OnnxSequenceClassifier()
+    silence = np.zeros(SAMPLING_RATE, dtype=np.float32)
+    stt_model.pipe({"raw": silence, "sampling_rate": SAMPLING_RATE}, return_timestamps=True)
+    sentiment.predict_sentiment("salom")
+
+    run_worker(None, output_directory, metrics_port + index if metrics_port else 0)
+
+
+class Supervisor:
+    """
+    Порождает воркеры из подготовленного родителя и перезапускает упавшие с экспоненциальной
+    задержкой. Если слот падает `max_restarts` раз за `restart_window` секунд, останавливает
+    все воркеры, и `run` возвращает код 1.
+    """
+
+    def __init__(self, workers: int, threads: int, output_directory: str, metrics_port: int,
+                 backoff: float = PREFORK_RESTART_BACKOFF, backoff_max: float = PREFORK_RESTART_BACKOFF_MAX,
+                 max_restarts: int = PREFORK_MAX_RESTARTS, restart_window: float = PREFORK_RESTART_WINDOW):
+        self.context = multiprocessing.get_context("fork")
+        self.workers = workers
+        self.threads = threads or max(1, (os.cpu_count() or 1) // workers)
+        self.output_directory = output_directory
+        self.metrics_port = metrics_port
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.processes: List = [None] * workers
+        # Времена падений каждого слота за окно и время запланированного перезапуска
+        self.exits: List[deque] = [deque() for _ in range(workers)]
+        self.restart_at: List[Optional[float]] = [None] * workers
+        self.stopping = False
+        self.failed = False
+
+    def spawn(self, index: int):
+        process = self.context.Process(target=worker_main, name=f"stt-worker-{index}",
+                                       args=(index, self.threads, self.output_directory, self.metrics_port))
+        process.start()
+        self.processes[index] = process
+        logging.info(f"Started worker {index} (pid {process.pid}, {self.threads} threads)")
+
+    def report(self) -> Dict:
+        """Память родителя и воркеров; USS воркера - то, что не разделяется с другими процессами."""
+        report = {"parent": memory_usage(os.getpid()), "workers": {}}
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                try:
+                    report["workers"][process.pid] = memory_usage(process.pid)
+                except OSError:
+                    continue
+        workers = report["workers"].values()
+        report["total_uss_mb"] = round(report["parent"]["uss_mb"] + sum(w["uss_mb"] for w in workers), 1)
+        report["total_rss_mb"] = round(report["parent"]["rss_mb"] + sum(w["rss_mb"] for w in workers), 1)
+        logging.info(f"Memory: {json.dumps(report)}")
+        return report
+
+    def stop(self, *args):
+        self.stopping = True
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+
+    def schedule_restart(self, index: int):
+        """Планирует перезапуск упавшего воркера; слишком частые падения останавливают супервизор."""
+        now = time.monotonic()
+        exitcode = self.processes[index].exitcode
+        self.processes[index] = None
+        exits = self.exits[index]
+        exits.append(now)
+        while exits and now - exits[0] > self.restart_window:
+            exits.popleft()
+        if len(exits) >= self.max_restarts:
+            logging.error(f"Worker {index} exited {len(exits)} times within {self.restart_window:.0f}s "
+                          f"(last exit code {exitcode}), stopping")
+            self.failed = True
+            self.stop()
+            return
+        delay = min(self.backoff * 2 ** (len(exits) - 1), self.backoff_max)
+        self.restart_at[index] = now + delay
+        logging.warning(f"Worker {index} exited with {exitcode}, restarting in {delay:.1f}s")
+
+    def run(self, report_interval: int = PREFORK_REPORT_INTERVAL) -> int:
+        """Запускает воркеры и следит за ними до остановки. Возвращает код выхода процесса."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index)
+
+        next_report = time.monotonic() + min(report_interval, 60)
+        while not self.stopping:
+            sentinels = {p.sentinel: i for i, p in enumerate(self.processes) if p is not None}
+            deadlines = [at for at in self.restart_at if at is not None]
+            if report_interval:
+                deadlines.append(next_report)
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            for sentinel in wait(list(sentinels), timeout=timeout):
+                index = sentinels[sentinel]
+                self.processes[index].join()
+                if not self.stopping:
+                    self.schedule_restart(index)
+            for index, at in enumerate(self.restart_at):
+                if at is not None and time.monotonic() >= at and not self.stopping:
+                    self.restart_at[index] = None
+                    self.spawn(index)
+            if report_interval and time.monotonic() >= next_report:
+                self.report()
+                next_report = time.monotonic() + report_interval
+
+        for process in self.processes:
+            if process is not None:
+                process.join()
+        return 1 if self.failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Preload models once and fork STT queue workers")
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS)
+    parser.add_argument("--threads", type=int, default=PREFORK_THREADS, help="torch threads per worker")
+    parser.add_argument("--output-dir", default="./transcriptions")
+    parser.add_argument("--metrics-port", type=int, default=STT_WORKER_METRICS_PORT,
+                        help="Worker i exposes metrics on port + i (0 - disabled)")
+    parser.add_argument("--report-interval", type=int, default=PREFORK_REPORT_INTERVAL)
+    args = parser.parse_args()
+
+    preload()
+    sys.exit(Supervisor(args.workers, args.threads, args.output_dir, args.metrics_port).run(args.report_interval))
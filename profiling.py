@@ -0,0 +1,128 @@
+import cProfile
+import logging
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import PROFILES_DIR, PROFILING_TRACEMALLOC_TOP
+
+_current_timer: ContextVar[Optional["RequestTimer"]] = ContextVar("request_timer", default=None)
+
+# cProfile допускает только один активный профайлер на поток
+_profile_lock = threading.Lock()
+
+
+class RequestTimer:
+    """
+    Собирает длительности этапов обработки одного запроса.
+
+    Повторяющиеся этапы (например, экспорт каждого сегмента) суммируются,
+    а количество вызовов передается в описании метрики Server-Timing.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, list] = {}
+
+    def add(self, name: str, duration: float):
+        total = self.stages.setdefault(name, [0.0, 0])
+        total[0] += duration
+        total[1] += 1
+
+    def server_timing(self) -> str:
+        """Формирует значение заголовка `Server-Timing` (длительности в миллисекундах)."""
+        parts = []
+        for name, (duration, count) in self.stages.items():
+            part = f"{name};dur={duration * 1000:.1f}"
+            if count > 1:
+                part += f';desc="{count} calls"'
+            parts.append(part)
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Измеряет этап обработки текущего запроса.
+
+    Вне запроса с включенным таймером ничего не делает, поэтому может
+    использоваться в функциях, которые вызываются и из фоновых процессов.
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+@contextmanager
+def request_timer():
+    """Включает сбор длительностей этапов для текущего запроса."""
+    timer = RequestTimer()
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+
+class RequestProfiler:
+    """
+    Снимает профиль cProfile и топ аллокаций tracemalloc для одного запроса
+    и сохраняет их в папку `PROFILES_DIR`.
+
+    Профиль cProfile охватывает весь код, выполнявшийся в потоке event loop во время
+    запроса, включая параллельные запросы. Если уже снимается другой профиль,
+    запрос обрабатывается без профилирования.
+    """
+
+    def __init__(self, label: str):
+        self.profile_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{label}_{uuid.uuid4().hex[:8]}"
+        self.profiler = cProfile.Profile()
+        self.active = False
+        self.started_tracemalloc = False
+        self.snapshot_before = None
+
+    def start(self) -> bool:
+        if not _profile_lock.acquire(blocking=False):
+            logging.info("Profiler busy, skipping request profile.")
+            return False
+        self.active = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        self.snapshot_before = tracemalloc.take_snapshot()
+        self.profiler.enable()
+        return True
+
+    def stop(self) -> Optional[str]:
+        if not self.active:
+            return None
+        try:
+            self.profiler.disable()
+            snapshot_after = tracemalloc.take_snapshot()
+            if self.started_tracemalloc:
+                tracemalloc.stop()
+
+            PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+            self.profiler.dump_stats(PROFILES_DIR / f"{self.profile_id}.prof")
+
+            top_stats = snapshot_after.compare_to(self.snapshot_before, "lineno")[:PROFILING_TRACEMALLOC_TOP]
+            with open(PROFILES_DIR / f"{self.profile_id}.tracemalloc.txt", "w", encoding="utf-8") as f:
+                for stat in top_stats:
+                    f.write(f"{stat}\n")
+            logging.info(f"Saved request profile {self.profile_id} to {PROFILES_DIR}")
+            return self.profile_id
+        finally:
+            self.active = False
+            _profile_lock.release()
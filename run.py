@@ -1,7 +1,9 @@
 import os
 import time
 from watchdog.observers import Observer
+from config import WATCHER_METRICS_PORT
 from file_watcher import AudioFileHandler
+from metrics import QUEUE_DEPTH, start_metrics_server
 
 def start_server(watch_directory: str, output_directory: str):
     """
@@ -13,6 +15,10 @@ def start_server(watch_directory: str, output_directory: str):
 
     print(f"Сервер запущен. Наблюдение за директорией: {watch_directory}")
     observer.start()
+    # Наблюдатель уже запущен, поэтому файлы, пришедшие во время обхода, не потеряются
+    print(f"Необработанных файлов при запуске: {event_handler.sweep(watch_directory)}")
+    QUEUE_DEPTH.labels("watcher_events").set_function(observer.event_queue.qsize)
+    start_metrics_server(WATCHER_METRICS_PORT)
 
     try:
         while True:
@@ -20,6 +26,7 @@ def start_server(watch_directory: str, output_directory: str):
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    event_handler.shutdown()
 
 
 if __name__ == "__main__":
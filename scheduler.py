@@ -0,0 +1,160 @@
+"""
+Планировщик очереди STT с классами приоритета.
+
+Сегменты живых звонков, запросы контроля качества и повторная обработка архива
+попадают в одну папку `incoming_audio`. Чтобы большой импорт не задерживал звонки
+текущего дня, каждый сегмент относится к классу приоритета:
+
+    realtime - ждут оператор или супервизор (live QA);
+    normal   - обычные загрузки звонков;
+    bulk     - импорт и повторная обработка архива.
+
+Класс задается источником загрузки (поле формы `source` в `/upload`, сопоставление
+`SCHEDULER_SOURCES`) и записывается в метаданные сегмента (`priority`).
+
+Классы делят пропускную способность STT пропорционально весам (`SCHEDULER_WEIGHTS`,
+stride scheduling): у каждого класса есть виртуальное время, выбирается класс с
+наименьшим, и после выдачи элемента его время растет на 1/вес. Класс, очередь которого
+была пуста, не копит кредит: его время подтягивается к текущему, поэтому первый
+элемент такого класса выдается следующим, даже если другой класс стоит в очереди
+тысячами. Чем дольше ждет первый элемент класса, тем больше его эффективный вес
+(старение, `SCHEDULER_AGING_SECONDS`): за каждый такой интервал вес растет на исходный,
+но не выше наибольшего веса, поэтому при долгой перегрузке низкий класс получает
+все большую долю, а старый импорт не вытесняет realtime целиком.
+
+Время ожидания в очереди по классам пишется в `dialdeep_queue_wait_seconds{queue, priority}`,
+длина очереди - в `dialdeep_queue_depth{queue="<queue>_<класс>"}`.
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import SCHEDULER_AGING_SECONDS, SCHEDULER_DEFAULT_CLASS, SCHEDULER_SOURCES, SCHEDULER_WEIGHTS
+from metrics import QUEUE_DEPTH, QUEUE_WAIT_SECONDS
+
+PRIORITY_CLASSES = ("realtime", "normal", "bulk")
+
+
+def parse_mapping(value: str) -> Dict[str, str]:
+    """Разбирает настройку вида `ключ=значение,ключ=значение`."""
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            key, val = item.split("=", 1)
+            mapping[key.strip()] = val.strip()
+    return mapping
+
+
+def class_weights(value: str = SCHEDULER_WEIGHTS) -> Dict[str, float]:
+    """Веса классов; класс без веса получает 1, вес не может быть меньше 0.01."""
+    weights = {cls: 1.0 for cls in PRIORITY_CLASSES}
+    for cls, weight in parse_mapping(value).items():
+        if cls in weights:
+            weights[cls] = max(float(weight), 0.01)
+    return weights
+
+
+SOURCE_CLASSES = {source: cls for source, cls in parse_mapping(SCHEDULER_SOURCES).items() if cls in PRIORITY_CLASSES}
+DEFAULT_CLASS = SCHEDULER_DEFAULT_CLASS if SCHEDULER_DEFAULT_CLASS in PRIORITY_CLASSES else "normal"
+
+
+def priority_class(source: Optional[str] = None, priority: Optional[str] = None) -> str:
+    """
+    Класс приоритета загрузки: явно указанный класс, иначе класс источника
+    по `SCHEDULER_SOURCES`, иначе `SCHEDULER_DEFAULT_CLASS`.
+    """
+    if priority in PRIORITY_CLASSES:
+        return priority
+    return SOURCE_CLASSES.get(source, DEFAULT_CLASS)
+
+
+class PriorityScheduler:
+    """
+    Потокобезопасная очередь с классами приоритета: взвешенное справедливое
+    разделение между классами и старение, внутри класса - порядок поступления.
+    """
+
+    def __init__(self, name: str, weights: Dict[str, float] = None, aging_seconds: float = SCHEDULER_AGING_SECONDS):
+        self.name = name
+        self.weights = weights or class_weights()
+        self.aging_seconds = aging_seconds
+        self.max_weight = max(self.weights.values())
+        self.queues: Dict[str, deque] = {cls: deque() for cls in self.weights}
+        self.passes: Dict[str, float] = {cls: 0.0 for cls in self.weights}
+        self.virtual_time = 0.0
+        self.condition = threading.Condition()
+        self.closed = False
+
+    def put(self, item: Any, priority: str = DEFAULT_CLASS):
+        with self.condition:
+            if priority not in self.queues:
+                priority = DEFAULT_CLASS
+            queue = self.queues[priority]
+            if not queue:
+                self.passes[priority] = max(self.passes[priority], self.virtual_time)
+            queue.append((time.monotonic(), item))
+            QUEUE_DEPTH.labels(f"{self.name}_{priority}").set(len(queue))
+            self.condition.notify()
+
+    def effective_weight(self, priority: str, waited: float) -> float:
+        """Вес класса с учетом старения первого элемента его очереди."""
+        weight = self.weights[priority]
+        if self.aging_seconds > 0:
+            weight *= 1 + waited / self.aging_seconds
+        return min(weight, self.max_weight)
+
+    def _pick(self) -> Tuple[Any, str]:
+        now = time.monotonic()
+        # При равном виртуальном времени выигрывает класс с большим весом
+        priority = min((cls for cls, queue in self.queues.items() if queue),
+                       key=lambda cls: (self.passes[cls], -self.weights[cls]))
+        queue = self.queues[priority]
+        enqueued_at, item = queue.popleft()
+        waited = now - enqueued_at
+        self.virtual_time = self.passes[priority]
+        self.passes[priority] += 1 / self.effective_weight(priority, waited)
+        QUEUE_DEPTH.labels(f"{self.name}_{priority}").set(len(queue))
+        QUEUE_WAIT_SECONDS.labels(self.name, priority).observe(waited)
+        return item, priority
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Tuple[Any, str]]:
+        """
+        Следующий элемент и его класс. None - истек `timeout` или планировщик закрыт
+        и очередь пуста.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.closed or len(self), timeout):
+                return None
+            if not len(self):
+                return None
+            return self._pick()
+
+    def order(self) -> List[str]:
+        """
+        Классы в порядке, в котором их следует обслуживать (для очереди в БД, где
+        содержимое очередей неизвестно). Выбранный класс отмечается `charge`.
+        """
+        with self.condition:
+            return sorted(self.weights, key=lambda cls: (self.passes[cls], -self.weights[cls]))
+
+    def charge(self, priority: str, waited: float = 0.0):
+        """Учитывает выданный вне `get` элемент класса `priority` (задачу из БД)."""
+        with self.condition:
+            if priority not in self.weights:
+                priority = DEFAULT_CLASS
+            # Классы, в которых не нашлось задач, не копят кредит
+            for cls in self.passes:
+                self.passes[cls] = max(self.passes[cls], self.passes[priority])
+            self.virtual_time = self.passes[priority]
+            self.passes[priority] += 1 / self.effective_weight(priority, waited)
+        QUEUE_WAIT_SECONDS.labels(self.name, priority).observe(waited)
+
+    def close(self):
+        """Будит ожидающие потоки: после выдачи оставшихся элементов `get` возвращает None."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
@@ -0,0 +1,151 @@
+"""
+Полнотекстовый поиск по транскрипциям звонков.
+
+Используются колонки и индексы, которые создаются миграцией (только PostgreSQL):
+- `call_info.dialog_tsv` - генерируемый tsvector по `dialog_txt` с GIN индексом;
+- GIN индекс pg_trgm по нормализованному `dialog_txt` для нечеткого поиска
+  (варианты написания узбекских o'/g' и опечатки транслитерации).
+
+Результаты ранжируются и отдаются страницами с keyset пагинацией по (rank, id).
+"""
+import base64
+import json
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import Double, and_, cast, func, literal, literal_column, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import SEARCH_MAX_LIMIT
+from kpi import day_start
+from models.models import call_info_table, operator_table
+
+# Варианты апострофа в узбекской латинице (oʻ, gʻ и т.п.) приводятся к обычному '
+APOSTROPHE_VARIANTS = "ʻʼ’‘`"
+
+# Выражения должны совпадать с выражениями индексов из миграции, поэтому константы
+# подставляются в SQL литералами, а не параметрами
+_APOSTROPHES_SQL = "'" + APOSTROPHE_VARIANTS + "', '" + "''" * len(APOSTROPHE_VARIANTS) + "'"
+NORMALIZED_DIALOG = literal_column(f"translate(call_info.dialog_txt, {_APOSTROPHES_SQL})")
+DIALOG_TSV = literal_column("call_info.dialog_tsv")
+
+SEARCH_MODES = ("auto", "fts", "fuzzy")
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def normalize_query(query: str) -> str:
+    """Нормализует поисковый запрос так же, как индексируемый текст."""
+    for variant in APOSTROPHE_VARIANTS:
+        query = query.replace(variant, "'")
+    return " ".join(query.split())
+
+
+def encode_cursor(mode: str, rank: float, call_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([mode, rank, call_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        mode, rank, call_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return mode, float(rank), int(call_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor("Invalid search cursor") from e
+
+
+def _search_statement(mode: str, query: str, limit: int, after=None, operator_id: Optional[int] = None,
+                      date_from: Optional[date] = None, date_to: Optional[date] = None):
+    """Строит запрос поиска в режиме `fts` (tsvector) или `fuzzy` (триграммы)."""
+    if mode == "fts":
+        tsquery = func.websearch_to_tsquery("simple", query)
+        rank = cast(func.ts_rank_cd(DIALOG_TSV, tsquery), Double)
+        condition = DIALOG_TSV.op("@@")(tsquery)
+        snippet = func.ts_headline("simple", call_info_table.c.dialog_txt, tsquery,
+                                   "MaxFragments=2, MaxWords=20, MinWords=5")
+    else:
+        rank = cast(func.word_similarity(query, NORMALIZED_DIALOG), Double)
+        condition = literal(query).op("<%")(NORMALIZED_DIALOG)
+        snippet = func.left(call_info_table.c.dialog_txt, 200)
+
+    stmt = (
+        select(
+            call_info_table.c.id,
+            call_info_table.c.order_id,
+            call_info_table.c.call_id,
+            call_info_table.c.datetime,
+            call_info_table.c.call_ts,
+            call_info_table.c.status_ai,
+            call_info_table.c.audio_path,
+            operator_table.c.name.label("operator"),
+            rank.label("rank"),
+            snippet.label("snippet"),
+        )
+        .select_from(call_info_table.join(operator_table, operator_table.c.id == call_info_table.c.operator_id))
+        .where(condition)
+        .order_by(rank.desc(), call_info_table.c.id.desc())
+        .limit(limit)
+    )
+    if operator_id is not None:
+        stmt = stmt.where(call_info_table.c.operator_id == operator_id)
+    # Фильтр по call_ts отсекает секции call_info за другие месяцы
+    if date_from is not None:
+        stmt = stmt.where(call_info_table.c.call_ts >= day_start(date_from))
+    if date_to is not None:
+        stmt = stmt.where(call_info_table.c.call_ts < day_start(date_to) + timedelta(days=1))
+    if after is not None:
+        after_rank, after_id = after
+        stmt = stmt.where(or_(rank < after_rank, and_(rank == after_rank, call_info_table.c.id < after_id)))
+    return stmt
+
+
+async def search_calls(session: AsyncSession, query: str, limit: int = 20, cursor: Optional[str] = None,
+                       mode: str = "auto", operator_id: Optional[int] = None, date_from: Optional[date] = None,
+                       date_to: Optional[date] = None) -> Dict:
+    """
+    Ищет звонки по тексту диалога.
+
+    В режиме `auto` сначала выполняется полнотекстовый поиск; если первая страница
+    пуста, выполняется нечеткий поиск по триграммам. Режим, по которому получена
+    первая страница, сохраняется в курсоре следующих страниц.
+
+    Аргументы:
+        session (AsyncSession): Асинхронная сессия БД.
+        query (str): Поисковый запрос (поддерживается синтаксис websearch: "фраза", -слово, or).
+        limit (int): Размер страницы.
+        cursor (str, optional): Курсор следующей страницы из предыдущего ответа.
+        mode (str): `auto`, `fts` или `fuzzy`.
+        operator_id (int, optional): Ограничить поиск звонками оператора.
+        date_from, date_to (date, optional): Ограничить поиск звонками за эти дни (включительно).
+
+    Возвращает:
+        Dict: Найденные звонки (`results`), режим поиска (`mode`) и курсор следующей страницы (`next_cursor`).
+    """
+    query = normalize_query(query)
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    after = None
+    if cursor:
+        mode, after_rank, after_id = decode_cursor(cursor)
+        after = (after_rank, after_id)
+
+    modes = ["fts", "fuzzy"] if mode == "auto" else [mode]
+    rows: List = []
+    for current_mode in modes:
+        result = await session.execute(_search_statement(current_mode, query, limit, after, operator_id,
+                                                              date_from, date_to))
+        rows = result.fetchall()
+        mode = current_mode
+        if rows:
+            break
+
+    next_cursor = None
+    if len(rows) == limit:
+        last = rows[-1]
+        next_cursor = encode_cursor(mode, last.rank, last.id)
+
+    return {
+        "mode": mode,
+        "results": [dict(row._mapping) for row in rows],
+        "next_cursor": next_cursor,
+    }
@@ -4,10 +4,22 @@ from freeGPTFix import Client
 import torch
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import os
+import time
 
-model_name = "blackhole33/finetuning-sentiment-model-uzb"
+from config import SENTIMENT_BACKEND, SENTIMENT_MODEL
+from metrics import MODEL_LOAD_SECONDS, SENTIMENT_SECONDS
+
+model_name = SENTIMENT_MODEL
+load_started = time.perf_counter()
 tokenizer = AutoTokenizer.from_pretrained(model_name)
-model_X = AutoModelForSequenceClassification.from_pretrained(model_name)
+if SENTIMENT_BACKEND == "onnx":
+    # Экспортированная модель (`python sentiment_onnx.py`) с тем же интерфейсом вызова
+    from sentiment_onnx import OnnxSequenceClassifier
+
+    model_X = OnnxSequenceClassifier()
+else:
+    model_X = AutoModelForSequenceClassification.from_pretrained(model_name)
+MODEL_LOAD_SECONDS.labels("sentiment").set(time.perf_counter() - load_started)
 
 
 def clean_text(text):
@@ -90,42 +102,52 @@ def check_illness_symptoms(text):
     return 0
 
 
-def predict_sentiment(text):
+@SENTIMENT_SECONDS.time()
+def sentiment_logits(text):
+    """Один прогон модели тональности: логиты классов (0 - негатив, 1 - позитив)."""
     inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
-    outputs = model_X(**inputs)
-    probabilities = torch.softmax(outputs.logits, dim=-1)
+    return model_X(**inputs).logits
+
+
+def format_sentiment(logits):
+    probabilities = torch.softmax(logits, dim=-1)
     negative_percentage = probabilities[0][0].item() * 100
     positive_percentage = probabilities[0][1].item() * 100
     return f"Positive: {positive_percentage:.2f}%, Negative: {negative_percentage:.2f}%"
 
 
+def predict_sentiment(text):
+    return format_sentiment(sentiment_logits(text))
+
+
+def keyword_checks(cleaned_text):
+    """Проверки по ключевым словам (без моделей) для очищенного `clean_text` текста."""
+    return {
+        'Salomlashish': check_greeting(cleaned_text),
+        'Ism_so\'rash': check_name_asked(cleaned_text),
+        'Sotuvchi_haqida': check_seller_info(cleaned_text),
+        'Kompaniya': check_company_discussed(cleaned_text),
+        'Dori_haqida': check_medicine_info(cleaned_text),
+        'Kasalligini_so\'rash': check_illness_symptoms(cleaned_text),
+        'Dorining_nomi': check_name_medicine(cleaned_text),
+    }
+
+
 def analyze_conversation(conversation):
     cleaned_text = clean_text(conversation)
 
-    sentiment_result = predict_sentiment(cleaned_text)
-    greeting_check = check_greeting(cleaned_text)
-    name_check = check_name_asked(cleaned_text)
-    company_check = check_company_discussed(cleaned_text)
-    medicine_check = check_medicine_info(cleaned_text)
-    seller_check = check_seller_info(cleaned_text)
-    illness_check = check_illness_symptoms(cleaned_text)
-    name_medicine_check = check_name_medicine(cleaned_text)
+    # Тональность и вердикт продажи берутся из одного прогона модели
+    logits = sentiment_logits(cleaned_text)
+    sentiment_result = format_sentiment(logits)
+    checks = keyword_checks(cleaned_text)
 
-    inputs = tokenizer(cleaned_text, return_tensors="pt", truncation=True, padding=True)
-    outputs = model_X(**inputs)
-    predictions = outputs.logits.argmax(dim=-1).item()
+    predictions = logits.argmax(dim=-1).item()
 
     sale_result = 1 if predictions == 1 else 0
 
     return {
         'sentiment': sentiment_result,
-        'Salomlashish': greeting_check,
-        'Ism_so\'rash': name_check,
-        'Sotuvchi_haqida': seller_check,
-        'Kompaniya': company_check,
-        'Dori_haqida': medicine_check,
-        'Kasalligini_so\'rash': illness_check,
-        'Dorining_nomi': name_medicine_check,
+        **checks,
         'Buyurtma': sale_result
     }
 
@@ -0,0 +1,161 @@
+"""
+ONNX Runtime backend классификатора тональности (`SENTIMENT_BACKEND=onnx`).
+
+Экспорт модели `SENTIMENT_MODEL` (один раз, после каждого обновления весов):
+    python sentiment_onnx.py --output onnx/sentiment --quantize
+
+Сохраняются `model.onnx` (fp32) и при `--quantize` `model.int8.onnx` (динамическое
+квантование весов в int8), затем логиты обеих моделей сравниваются с PyTorch на
+контрольных фразах: при расхождении fp32 больше `PARITY_TOLERANCE` или несовпадении
+классов код выхода 1.
+
+`OnnxSequenceClassifier` вызывается так же, как модель transformers (`model(**inputs).logits`),
+поэтому `sentiment.py` работает с обоими backend без изменений.
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List
+
+import numpy as np
+
+from config import (SENTIMENT_MODEL, SENTIMENT_ONNX_DIR, SENTIMENT_ONNX_INTER_THREADS, SENTIMENT_ONNX_INTRA_THREADS,
+                    SENTIMENT_ONNX_OPTIMIZATION, SENTIMENT_ONNX_QUANTIZED)
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_FILE = "model.int8.onnx"
+INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids")
+PARITY_TOLERANCE = 1e-3
+PARITY_TEXTS = [
+    "assalomu alaykum euphoria kompaniyasidan bosh mutaxasis bo'laman ismingiz nima",
+    "rahmat yaxshi olaman manzilga yetkazib bering",
+    "yo'q kerak emas qimmat ekan",
+    "urion prostatadagi infeksiya va yallig'lanish 3 kundan 5 kun ichida effekt ko'rasiz",
+    "salom",
+]
+
+
+def model_path(directory: Path = SENTIMENT_ONNX_DIR, quantized: bool = SENTIMENT_ONNX_QUANTIZED) -> Path:
+    return Path(directory) / (QUANTIZED_FILE if quantized else MODEL_FILE)
+
+
+def session_options(intra_threads: int = SENTIMENT_ONNX_INTRA_THREADS,
+                    inter_threads: int = SENTIMENT_ONNX_INTER_THREADS,
+                    optimization: str = SENTIMENT_ONNX_OPTIMIZATION):
+    import onnxruntime as ort
+
+    levels = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_threads
+    options.inter_op_num_threads = inter_threads
+    options.graph_optimization_level = levels[optimization]
+    return options
+
+
+class OnnxSequenceClassifier:
+    """Сессия ONNX Runtime с интерфейсом `AutoModelForSequenceClassification`."""
+
+    def __init__(self, path: Path = None, options=None):
+        import onnxruntime as ort
+
+        self.path = Path(path or model_path())
+        if not self.path.exists():
+            raise FileNotFoundError(f"{self.path} not found, export it with `python sentiment_onnx.py`")
+        self.session = ort.InferenceSession(str(self.path), options or session_options(),
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, **inputs):
+        import torch
+
+        feed = {name: _to_numpy(inputs[name]) for name in self.input_names if name in inputs}
+        logits = self.session.run(["logits"], feed)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+    def eval(self):
+        return self
+
+
+def _to_numpy(value) -> np.ndarray:
+    value = value.numpy() if hasattr(value, "numpy") else np.asarray(value)
+    return value.astype(np.int64)
+
+
+def export(model_name: str, output_dir: Path, quantize: bool = False, opset: int = 17) -> List[Path]:
+    """Экспортирует модель тональности в ONNX (и int8 версию). Возвращает пути созданных моделей."""
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+
+    sample = tokenizer(PARITY_TEXTS[:2], return_tensors="pt", truncation=True, padding=True)
+    names = [name for name in INPUT_NAMES if name in sample]
+    axes = {name: {0: "batch", 1: "sequence"} for name in names}
+    axes["logits"] = {0: "batch"}
+
+    path = output_dir / MODEL_FILE
+    with torch.no_grad():
+        torch.onnx.export(model, (), str(path), kwargs={name: sample[name] for name in names},
+                          input_names=names, output_names=["logits"], dynamic_axes=axes, opset_version=opset,
+                          dynamo=False)
+    logging.info(f"Exported {model_name} to {path}")
+    paths = [path]
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantized = output_dir / QUANTIZED_FILE
+        quantize_dynamic(str(path), str(quantized), weight_type=QuantType.QInt8)
+        logging.info(f"Quantized model saved to {quantized}")
+        paths.append(quantized)
+    return paths
+
+
+def parity(model, tokenizer, onnx_model: OnnxSequenceClassifier, texts: List[str] = PARITY_TEXTS) -> Dict:
+    """Сравнивает логиты PyTorch и ONNX Runtime по одной фразе, как в `sentiment.predict_sentiment`."""
+    import torch
+
+    max_diff, agree = 0.0, 0
+    for text in texts:
+        inputs = tokenizer(text, return_tensors="pt", truncation=True, padding=True)
+        with torch.no_grad():
+            expected = model(**inputs).logits
+        actual = onnx_model(**inputs).logits
+        max_diff = max(max_diff, float((expected - actual).abs().max()))
+        agree += int(expected.argmax(dim=-1).item() == actual.argmax(dim=-1).item())
+    return {"texts": len(texts), "max_abs_diff": round(max_diff, 6), "argmax_agreement": agree / len(texts)}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export the sentiment classifier to ONNX")
+    parser.add_argument("--model", default=SENTIMENT_MODEL)
+    parser.add_argument("--output", default=str(SENTIMENT_ONNX_DIR))
+    parser.add_argument("--quantize", action="store_true", help="Also write a dynamic int8 model")
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    exported = export(args.model, Path(args.output), quantize=args.quantize, opset=args.opset)
+    reference = AutoModelForSequenceClassification.from_pretrained(args.model).eval()
+    reference_tokenizer = AutoTokenizer.from_pretrained(args.model)
+    failed = False
+    for onnx_path in exported:
+        result = parity(reference, reference_tokenizer, OnnxSequenceClassifier(onnx_path))
+        logging.info(f"Parity {onnx_path.name}: {result}")
+        # Квантованная модель отличается по логитам, от нее требуется только тот же класс
+        if result["argmax_agreement"] < 1 or (onnx_path.name == MODEL_FILE and
+                                               result["max_abs_diff"] > PARITY_TOLERANCE):
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,56 @@
+"""
+Запуск API в production: несколько процессов uvicorn на одном порту.
+
+    python serve.py --workers 32
+
+Состояние, общее для всех процессов, хранится в БД или на диске: идентификаторы
+звонков и сегментов содержат UUID, очередь приема и дедупликация - в таблицах БД.
+Что остается в памяти процесса:
+    - события звонков при `EVENTS_BROKER=memory` (при нескольких процессах нужен
+      `postgres`, `auto` выбирает его для PostgreSQL);
+    - лимит потоков `/ws/transcribe` (ядра делятся между процессами);
+    - метрики Prometheus: собираются через `PROMETHEUS_MULTIPROC_DIR`, который
+      задается здесь и очищается при запуске.
+Каждый процесс открывает свой пул соединений с БД: `API_WORKERS` x размер пула
+(по умолчанию 5 + 10) должно помещаться в `max_connections` PostgreSQL.
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import uvicorn
+
+from config import API_HOST, API_PORT, API_WORKERS
+
+
+def prepare_metrics_dir(workers: int):
+    """Готовит общий каталог метрик процессов; файлы прошлого запуска удаляются."""
+    if workers < 2:
+        return
+    path = Path(os.getenv('PROMETHEUS_MULTIPROC_DIR') or Path(tempfile.gettempdir()) / "dialdeep_metrics")
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = str(path)
+
+
+def serve(host: str, port: int, workers: int):
+    workers = workers or os.cpu_count() or 1
+    # Процессы uvicorn запускаются заново и читают config из окружения
+    os.environ['API_WORKERS'] = str(workers)
+    prepare_metrics_dir(workers)
+    logging.info(f"Starting API on {host}:{port} with {workers} worker(s)")
+    uvicorn.run("main:app", host=host, port=port, workers=workers, log_level="info")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Production launcher for the API")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="0 - one per CPU core")
+    args = parser.parse_args()
+
+    serve(args.host, args.port, args.workers)
@@ -0,0 +1,260 @@
+"""
+Потоковая транскрипция идущих звонков по WebSocket (`/ws/transcribe`).
+
+Клиент отправляет бинарные кадры PCM 16 бит little-endian (моно или стерео с каналом
+оператора `STEREO_OPERATOR_CHANNEL`) и текстовое сообщение `{"type": "stop"}` в конце.
+Аудио каждой роли копится в кольцевом буфере фиксированного размера. Раз в
+`STREAM_STEP_SECONDS` текущая фраза (от последней финальной границы) транскрибируется
+заново моделью `STT_model` и отправляется как `partial`. Фраза завершается (`final`)
+после паузы `STREAM_SILENCE_SECONDS` или при достижении `STREAM_WINDOW_SECONDS`; по
+финальному тексту выполняются проверки ключевых слов из `sentiment.py`, флаги
+накапливаются за весь звонок.
+
+Память на поток ограничена буфером (2 окна на роль), инференс выполняется в общем пуле
+потоков, одновременно для потока выполняется не больше одного распознавания: если модель
+не успевает, промежуточные шаги пропускаются, а не копятся в очереди.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from audio_processor import split_channels
+from config import (API_WORKERS, STEREO_OPERATOR_CHANNEL, STREAM_MAX_STREAMS, STREAM_SILENCE_RMS,
+                    STREAM_SILENCE_SECONDS, STREAM_STEP_SECONDS, STREAM_STREAMS_PER_CORE, STREAM_WINDOW_SECONDS)
+from events import publish_event
+from metrics import STREAMS_ACTIVE, STT_SECONDS
+
+SAMPLING_RATE = 16000
+# Лимит на процесс API: ядра делятся между процессами uvicorn (serve.py)
+MAX_STREAMS = STREAM_MAX_STREAMS or max(1, int(STREAM_STREAMS_PER_CORE * (os.cpu_count() or 1) / max(API_WORKERS, 1)))
+
+executor = ThreadPoolExecutor(max_workers=MAX_STREAMS, thread_name_prefix="stream-stt")
+active_streams = 0
+
+
+class RingBuffer:
+    """Кольцевой буфер float32: хранит последние `capacity` отсчетов и их абсолютные позиции."""
+
+    def __init__(self, capacity: int):
+        self.data = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.total = 0
+
+    def write(self, samples: np.ndarray):
+        if len(samples) > self.capacity:
+            self.total += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+        index = self.total % self.capacity
+        first = min(len(samples), self.capacity - index)
+        self.data[index:index + first] = samples[:first]
+        self.data[:len(samples) - first] = samples[first:]
+        self.total += len(samples)
+
+    def read(self, start: int) -> np.ndarray:
+        """Копия отсчетов с абсолютной позиции `start` (не раньше начала буфера) до конца."""
+        start = max(start, self.total - self.capacity, 0)
+        index = start % self.capacity
+        count = self.total - start
+        if index + count <= self.capacity:
+            return self.data[index:index + count].copy()
+        return np.concatenate((self.data[index:], self.data[:index + count - self.capacity]))
+
+
+def _transcribe(samples: np.ndarray) -> str:
+    import stt_model
+
+    started = time.perf_counter()
+    result = stt_model.pipe({"raw": samples, "sampling_rate": SAMPLING_RATE})
+    STT_SECONDS.labels("stream").observe(time.perf_counter() - started)
+    return result["text"].strip()
+
+
+def _keyword_checks(text: str) -> Dict[str, int]:
+    from sentiment import clean_text, keyword_checks
+
+    return keyword_checks(clean_text(text))
+
+
+class StreamTranscriber:
+    """Инкрементальная транскрипция одной роли звонка."""
+
+    def __init__(self, role: str):
+        self.role = role
+        self.window = int(STREAM_WINDOW_SECONDS * SAMPLING_RATE)
+        self.step = int(STREAM_STEP_SECONDS * SAMPLING_RATE)
+        self.silence = int(STREAM_SILENCE_SECONDS * SAMPLING_RATE)
+        self.ring = RingBuffer(2 * self.window)
+        self.committed = 0
+        self.decoded_at = 0
+        self.last_voice = 0
+        self.speech = False
+        self.flags: Dict[str, int] = {}
+
+    def write(self, samples: np.ndarray):
+        if not len(samples):
+            return
+        self.ring.write(samples)
+        if np.sqrt(np.mean(samples ** 2)) >= STREAM_SILENCE_RMS:
+            self.last_voice = self.ring.total
+            self.speech = True
+        elif not self.speech:
+            # Тишина до начала фразы не транскрибируется
+            self.committed = self.decoded_at = max(self.committed, self.ring.total - self.silence)
+
+    def _event(self, kind: str, text: str, end: int) -> Dict:
+        return {"type": kind, "role": self.role, "text": text,
+                "start": round(self.committed / SAMPLING_RATE, 2), "end": round(end / SAMPLING_RATE, 2)}
+
+    async def step_events(self, force_final: bool = False) -> List[Dict]:
+        """Выполняет очередной шаг распознавания, если накопилось достаточно нового аудио."""
+        if not self.speech:
+            return []
+        loop = asyncio.get_running_loop()
+        end = self.ring.total
+        pending = end - self.committed
+        if force_final or pending >= self.window or end - self.last_voice >= self.silence:
+            text = await loop.run_in_executor(executor, _transcribe, self.ring.read(self.committed))
+            event = self._event("final", text, end)
+            if text:
+                checks = await loop.run_in_executor(executor, _keyword_checks, text)
+                self.flags = {key: max(value, self.flags.get(key, 0)) for key, value in checks.items()}
+                event["flags"] = self.flags
+            self.committed = self.decoded_at = end
+            self.speech = False
+            return [event]
+        if end - self.decoded_at >= self.step:
+            self.decoded_at = end
+            text = await loop.run_in_executor(executor, _transcribe, self.ring.read(self.committed))
+            return [self._event("partial", text, end)]
+        return []
+
+
+class Resampler:
+    """
+    Линейная передискретизация потока в 16 кГц с состоянием между кадрами.
+
+    Последний отсчет кадра и дробная позиция следующего выходного отсчета переносятся
+    в следующий кадр: фаза не сбрасывается на границах кадров, а число выходных
+    отсчетов не расходится с длительностью аудио.
+    """
+
+    def __init__(self, sample_rate: int):
+        self.ratio = sample_rate / SAMPLING_RATE
+        self.position = 0.0
+        self.tail = np.zeros(0, dtype=np.float32)
+
+    def __call__(self, audio: np.ndarray) -> np.ndarray:
+        if self.ratio == 1:
+            return audio
+        data = np.concatenate((self.tail, audio))
+        # Выходные отсчеты строго левее последнего входного: для него еще нет правого соседа
+        count = max(0, int(np.ceil((len(data) - 1 - self.position) / self.ratio)))
+        target = self.position + np.arange(count) * self.ratio
+        result = np.interp(target, np.arange(len(data)), data).astype(np.float32)
+        if len(data):
+            self.position += count * self.ratio - (len(data) - 1)
+            self.tail = data[-1:]
+        return result
+
+
+def decode_frame(frame: bytes, channels: int, resamplers: List[Resampler]) -> List[np.ndarray]:
+    """PCM16 -> float32 16 кГц по каналам (`resamplers` - по одному на канал)."""
+    samples = np.frombuffer(frame, dtype=np.int16)
+    channel_samples = split_channels(samples, channels) if channels > 1 else [samples]
+    return [resampler(np.multiply(channel, 1 / 32768, dtype=np.float32))
+            for resampler, channel in zip(resamplers, channel_samples)]
+
+
+async def handle_stream(websocket: WebSocket, role: str = "operator", channels: int = 1,
+                        sample_rate: int = SAMPLING_RATE, call: Optional[str] = None):
+    """
+    Обслуживает одно WebSocket соединение потоковой транскрипции.
+
+    Прием кадров и распознавание выполняются отдельными задачами: пока модель
+    распознает предыдущий шаг, новые кадры продолжают записываться в буфер.
+    Если задан `call`, финальные фразы публикуются и в поток событий звонка (SSE).
+    """
+    global active_streams
+    await websocket.accept()
+    if active_streams >= MAX_STREAMS or channels not in (1, 2):
+        error = "Too many concurrent streams" if channels in (1, 2) else "Only mono or stereo audio is supported"
+        await websocket.send_json({"type": "error", "error": error})
+        await websocket.close(code=1013 if channels in (1, 2) else 1003)
+        return
+
+    active_streams += 1
+    STREAMS_ACTIVE.inc()
+    if channels == 2:
+        roles = ["client", "client"]
+        roles[STEREO_OPERATOR_CHANNEL] = "operator"
+    else:
+        roles = [role]
+    transcribers = [StreamTranscriber(r) for r in roles]
+    resamplers = [Resampler(sample_rate) for _ in roles]
+    frame_size = 2 * channels
+    leftover = b""
+    received = asyncio.Event()
+    stopped = False
+
+    async def emit(events):
+        for event in events:
+            await websocket.send_json(event)
+            if call and event["type"] == "final" and event["text"]:
+                await publish_event(call, "live", **{k: v for k, v in event.items() if k != "type"})
+
+    async def decode_loop():
+        while not stopped:
+            await received.wait()
+            received.clear()
+            for transcriber in transcribers:
+                await emit(await transcriber.step_events())
+
+    decoder = asyncio.create_task(decode_loop())
+    try:
+        while True:
+            message = await websocket.receive()
+            if decoder.done():
+                # Распознавание упало: поднимаем его ошибку, а не принимаем кадры впустую
+                decoder.result()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes"):
+                data = leftover + message["bytes"]
+                cut = len(data) - len(data) % frame_size
+                leftover = data[cut:]
+                for transcriber, samples in zip(transcribers, decode_frame(data[:cut], channels, resamplers)):
+                    transcriber.write(samples)
+                received.set()
+            elif message.get("text") and json.loads(message["text"]).get("type") == "stop":
+                stopped = True
+                received.set()
+                await decoder
+                for transcriber in transcribers:
+                    await emit(await transcriber.step_events(force_final=True))
+                await websocket.send_json({"type": "end", "flags": {t.role: t.flags for t in transcribers}})
+                await websocket.close()
+                break
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logging.error(f"Streaming transcription failed: {e}")
+        try:
+            await websocket.send_json({"type": "error", "error": "Transcription failed"})
+            await websocket.close(code=1011)
+        except Exception:
+            # Соединение уже закрыто клиентом
+            pass
+    finally:
+        stopped = True
+        received.set()
+        if not decoder.done():
+            decoder.cancel()
+        active_streams -= 1
+        STREAMS_ACTIVE.dec()
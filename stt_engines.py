@@ -0,0 +1,159 @@
+"""
+Движки распознавания речи для `stt_model`.
+
+Движок загружает модель один раз и распознает пачку входов: путей к аудиофайлам или
+`{"raw": float32 массив, "sampling_rate": 16000}`. Для каждого входа возвращается
+результат в формате пайплайна transformers с `return_timestamps=True`:
+    {"text": "...", "chunks": [{"timestamp": (start, end), "text": "..."}, ...]}
+(без `return_timestamps` - только `{"text": "..."}`), поэтому `save_transcription` и
+остальной код не зависят от движка. Движок вызывается так же, как пайплайн
+(`engine(inputs, batch_size=..., return_timestamps=True)`); другие параметры пайплайна
+не поддерживаются и приводят к `TypeError`.
+
+Движки (`STT_ENGINE`):
+    transformers - `AutomaticSpeechRecognitionPipeline` на PyTorch (модель `STT_MODEL`);
+    ctranslate2  - тот же чекпойнт Whisper, сконвертированный для CTranslate2 и запущенный
+                   через faster-whisper (int8 на CPU). Конвертация:
+                       python stt_engines.py --convert --quantization int8
+"""
+import argparse
+import logging
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Union
+
+from config import (STT_CT2_BEAM_SIZE, STT_CT2_COMPUTE_TYPE, STT_CT2_MODEL, STT_CT2_THREADS, STT_CT2_WORKERS,
+                    STT_ENGINE, STT_LANGUAGE, STT_MODEL)
+
+SAMPLING_RATE = 16000
+
+
+class STTEngine(ABC):
+    """Базовый движок: `transcribe_batch` распознает пачку входов, `__call__` повторяет интерфейс пайплайна."""
+
+    name = "base"
+    sampling_rate = SAMPLING_RATE
+
+    @abstractmethod
+    def transcribe_batch(self, inputs: List, batch_size: int = None, return_timestamps: bool = False) -> List[Dict]:
+        """Распознает пачку входов: по результату `{"text"}` (и `"chunks"` с таймкодами) на каждый вход."""
+
+    def __call__(self, inputs: Union[List, str, Dict], batch_size: int = None, return_timestamps: bool = False):
+        if isinstance(inputs, list):
+            return self.transcribe_batch(inputs, batch_size, return_timestamps)
+        return self.transcribe_batch([inputs], return_timestamps=return_timestamps)[0]
+
+
+class TransformersEngine(STTEngine):
+    """Пайплайн transformers (PyTorch, CUDA при наличии)."""
+
+    name = "transformers"
+
+    def __init__(self, model_name: str = STT_MODEL):
+        import torch
+        from transformers import (AutoModelForSpeechSeq2Seq, AutoTokenizer, AutomaticSpeechRecognitionPipeline,
+                                  WhisperProcessor)
+
+        self.model = AutoModelForSpeechSeq2Seq.from_pretrained(model_name)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        processor = WhisperProcessor.from_pretrained(model_name)
+        self.sampling_rate = processor.feature_extractor.sampling_rate
+
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model.to(self.device)
+        self.pipe = AutomaticSpeechRecognitionPipeline(
+            model=self.model,
+            tokenizer=tokenizer,
+            feature_extractor=processor.feature_extractor,
+            task="transcribe"
+        )
+
+    def transcribe_batch(self, inputs: List, batch_size: int = None, return_timestamps: bool = False) -> List[Dict]:
+        import torch
+
+        with torch.amp.autocast("cuda"):
+            return self.pipe(inputs, batch_size=batch_size or len(inputs), return_timestamps=return_timestamps)
+
+
+class CTranslate2Engine(STTEngine):
+    """
+    Whisper на CTranslate2 (faster-whisper). Пачка распознается параллельно в
+    `workers` потоках: CTranslate2 освобождает GIL и выполняет запросы одновременно.
+    """
+
+    name = "ctranslate2"
+
+    def __init__(self, model_dir: str = STT_CT2_MODEL, compute_type: str = STT_CT2_COMPUTE_TYPE,
+                 cpu_threads: int = STT_CT2_THREADS, workers: int = STT_CT2_WORKERS,
+                 beam_size: int = STT_CT2_BEAM_SIZE, language: str = STT_LANGUAGE):
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(model_dir, device="cpu", compute_type=compute_type, cpu_threads=cpu_threads,
+                                  num_workers=max(workers, 1))
+        self.beam_size = beam_size
+        self.language = language
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="ct2-stt")
+
+    def _audio(self, item):
+        if not isinstance(item, dict):
+            return str(item)
+        import numpy as np
+
+        audio = np.asarray(item["raw"], dtype=np.float32)
+        if item.get("sampling_rate", SAMPLING_RATE) != SAMPLING_RATE:
+            target = np.arange(0, len(audio), item["sampling_rate"] / SAMPLING_RATE)
+            audio = np.interp(target, np.arange(len(audio)), audio).astype(np.float32)
+        return audio
+
+    def transcribe_one(self, item, return_timestamps: bool = False) -> Dict:
+        segments, _ = self.model.transcribe(self._audio(item), language=self.language, task="transcribe",
+                                            beam_size=self.beam_size, condition_on_previous_text=False,
+                                            without_timestamps=not return_timestamps)
+        chunks = [{"timestamp": (round(s.start, 2), round(s.end, 2)), "text": s.text} for s in segments]
+        result = {"text": "".join(chunk["text"] for chunk in chunks).strip()}
+        if return_timestamps:
+            result["chunks"] = chunks
+        return result
+
+    def transcribe_batch(self, inputs: List, batch_size: int = None, return_timestamps: bool = False) -> List[Dict]:
+        if len(inputs) == 1:
+            return [self.transcribe_one(inputs[0], return_timestamps)]
+        return list(self.executor.map(lambda item: self.transcribe_one(item, return_timestamps), inputs))
+
+
+ENGINES = {TransformersEngine.name: TransformersEngine, CTranslate2Engine.name: CTranslate2Engine}
+
+
+def create_engine(name: str = STT_ENGINE) -> STTEngine:
+    if name not in ENGINES:
+        raise ValueError(f"Unknown STT engine {name!r}, expected one of {sorted(ENGINES)}")
+    return ENGINES[name]()
+
+
+def convert(model_name: str = STT_MODEL, output_dir: str = STT_CT2_MODEL, quantization: str = "int8"):
+    """Конвертирует чекпойнт Whisper transformers в формат CTranslate2 (с файлами токенизатора)."""
+    import os
+
+    from ctranslate2.converters import TransformersConverter
+
+    copy_files = [name for name in ("tokenizer.json", "preprocessor_config.json")
+                  if os.path.exists(os.path.join(model_name, name))]
+    converter = TransformersConverter(model_name, copy_files=copy_files or None)
+    path = converter.convert(output_dir, quantization=quantization, force=True)
+    logging.info(f"Converted {model_name} to {path} ({quantization})")
+    return path
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="STT engines: convert the Whisper checkpoint for CTranslate2")
+    parser.add_argument("--convert", action="store_true")
+    parser.add_argument("--model", default=STT_MODEL)
+    parser.add_argument("--output", default=STT_CT2_MODEL)
+    parser.add_argument("--quantization", default="int8")
+    args = parser.parse_args()
+
+    if args.convert:
+        convert(args.model, args.output, args.quantization)
+    else:
+        parser.print_help()
@@ -1,26 +1,26 @@
-import torch
-from transformers import AutoModelForSpeechSeq2Seq, AutoTokenizer, WhisperProcessor, AutomaticSpeechRecognitionPipeline
-from typing import Dict
-
-MODEL_NAME = "STT_model"
-
-# Загрузка модели
-model = AutoModelForSpeechSeq2Seq.from_pretrained(MODEL_NAME)
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-processor = WhisperProcessor.from_pretrained(MODEL_NAME)
-feature_extractor = processor.feature_extractor
-
-# Проверка доступности устройства
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
-
-# Создание пайплайна
-pipe = AutomaticSpeechRecognitionPipeline(
-    model=model,
-    tokenizer=tokenizer,
-    feature_extractor=feature_extractor,
-    task="transcribe"
-)
+import time
+from typing import Dict, Optional
+
+from audio_processor import audio_duration, load_stereo_channels
+from metrics import MODEL_LOAD_SECONDS, STT_AUDIO_SECONDS, STT_REAL_TIME_FACTOR, STT_SECONDS
+from stt_engines import create_engine
+from transcripts import transcript_lines, write_transcript
+
+# Загрузка модели выбранным движком (`STT_ENGINE`); `pipe` вызывается как пайплайн transformers
+load_started = time.perf_counter()
+engine = create_engine()
+pipe = engine
+MODEL_LOAD_SECONDS.labels("stt").set(time.perf_counter() - load_started)
+
+
+def observe_stt(mode: str, started: float, file_path: str) -> None:
+    """Записывает время инференса STT и real-time factor (время обработки / длительность аудио)."""
+    elapsed = time.perf_counter() - started
+    STT_SECONDS.labels(mode).observe(elapsed)
+    duration = audio_duration(file_path)
+    if duration:
+        STT_AUDIO_SECONDS.labels(mode).inc(duration)
+        STT_REAL_TIME_FACTOR.labels(mode).observe(elapsed / duration)
 
 def transcribe_audio(file_path: str) -> Dict[str, str]:
     """
@@ -35,8 +35,9 @@ def transcribe_audio(file_path: str) -> Dict[str, str]:
     # Предобработка аудио
 
     # Транскрипция
-    with torch.amp.autocast("cuda"):
-        result = pipe(file_path, return_timestamps=True)
+    started = time.perf_counter()
+    result = pipe(file_path, return_timestamps=True)
+    observe_stt("mono", started, file_path)
 
     if not result or "text" not in result:
         raise ValueError("Результат транскрипции некорректен.")
@@ -44,30 +45,51 @@ def transcribe_audio(file_path: str) -> Dict[str, str]:
     return result
 
 
-def save_transcription(result: Dict[str, str], output_path: str) -> None:
+def transcribe_stereo(file_path: str) -> Dict[str, Dict[str, str]]:
     """
-    Сохраняет результат транскрипции в файл с проверкой на ключевые слова в названии файла.
-    Убирает информацию о временных метках.
+    Выполняет транскрипцию стерео записи звонка одним батчем.
+
+    Каналы оператора и клиента разделяются без копирования и передаются
+    в пайплайн вместе, поэтому обе стороны разговора обрабатываются одновременно.
+
+    Параметры:
+    file_path (str): Путь к стерео аудиофайлу.
+
+    Возвращает:
+    Dict[str, Dict[str, str]]: Результаты транскрипции по ролям ("operator", "client").
+    """
+    channels = load_stereo_channels(file_path, engine.sampling_rate)
+    roles = list(channels)
+    inputs = [{"raw": channels[role], "sampling_rate": engine.sampling_rate} for role in roles]
+
+    started = time.perf_counter()
+    results = pipe(inputs, batch_size=len(inputs), return_timestamps=True)
+    observe_stt("stereo", started, file_path)
+
+    tagged = {}
+    for role, result in zip(roles, results):
+        if not result or "text" not in result:
+            raise ValueError("Результат транскрипции некорректен.")
+        result["role"] = role
+        tagged[role] = result
+    return tagged
+
+
+def save_transcription(result: Dict[str, str], output_path: str, speaker_role: Optional[str] = None,
+                       metadata: Optional[Dict] = None) -> None:
+    """
+    Сохраняет результат транскрипции в структурированном формате JSONL (см. `transcripts.py`):
+    по строке на фрагмент речи с ролью, смещением сегмента и таймстемпами.
 
     Параметры:
     result (Dict[str, str]): Результат транскрипции.
     output_path (str): Путь к файлу для сохранения.
-    file_name (str): Название обрабатываемого файла.
+    speaker_role (str, optional): Роль говорящего; если не задана, определяется по имени файла.
+    metadata (Dict, optional): Метаданные сегмента (звонок, номер сегмента, смещение).
     """
     print(output_path)
     # Format tekshirish
-    speaker_role = "operator" if "MIC" in output_path.upper() else "client" if "SPEAKER" in output_path.upper() else "unknown"
-
-    with open(output_path, "w", encoding="utf-8") as f:
-        # Asosiy matnni yozish
-        f.write(f"Text: {result['text']}\n")
-
-        # Har bir qismni mos ravishda formatlash
-        for chunk in result.get("chunks", []):
-            text = chunk.get("text", "")
+    if speaker_role is None:
+        speaker_role = "operator" if "MIC" in output_path.upper() else "client" if "SPEAKER" in output_path.upper() else "unknown"
 
-            # Rolni belgilang
-            if speaker_role != "unknown":
-                f.write(f"{speaker_role}: {text}\n")
-            else:
-                f.write(f"{text}\n")
+    write_transcript(transcript_lines(result, speaker_role, metadata or {}), output_path)
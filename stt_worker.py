@@ -0,0 +1,121 @@
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import tempfile
+import uuid
+from pathlib import Path
+
+from config import JOB_HEARTBEAT_SECONDS, JOB_POLL_INTERVAL, STT_WORKER_METRICS_PORT
+from database import async_session_maker
+from job_queue import claim_job, complete_job, fail_job, heartbeat, waited_seconds
+from metrics import FILES_PROCESSED, start_metrics_server
+from scheduler import PriorityScheduler
+from transcripts import segment_metadata_path, write_segment_metadata
+
+
+def materialize_audio(job, work_dir: Path) -> Path:
+    """
+    Возвращает локальный путь к аудио задачи.
+
+    Аудио, сохраненное прямо в задаче, записывается во временную папку воркера под
+    исходным именем (метки MIC/SPEAKER/STEREO в имени нужны для определения роли).
+    Иначе используется путь на общем хранилище. Метаданные сегмента из задачи
+    записываются рядом с локальной копией.
+    """
+    if job.audio_data is not None:
+        local_path = work_dir / (job.audio_name or f"job_{job.id}.wav")
+        if job.payload:
+            write_segment_metadata(local_path, job.payload.get("call"), job.payload.get("segment", 0),
+                                   job.payload.get("offset", 0.0), job.payload.get("priority"))
+        local_path.write_bytes(job.audio_data)
+        return local_path
+    return Path(job.audio_path)
+
+
+async def keep_lease(job_id: int, worker_id: str):
+    """Периодически продлевает аренду задачи, пока она выполняется."""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        async with async_session_maker() as session:
+            if not await heartbeat(session, job_id, worker_id):
+                logging.warning(f"Lease lost for job {job_id}")
+                return
+
+
+async def worker_loop(worker_id: str, output_directory: str):
+    """
+    Основной цикл STT воркера: захватывает задачи из очереди, выполняет транскрипцию
+    и анализ, сохраняет результат или возвращает задачу в очередь при ошибке.
+    Классы приоритета задач обслуживаются по весам планировщика (`scheduler.py`).
+
+    Аргументы:
+        worker_id (str): Уникальный идентификатор воркера.
+        output_directory (str): Папка для транскрипций (на общем хранилище при нескольких узлах).
+    """
+    # Импорт здесь, чтобы модели загружались только в процессе воркера
+    from file_watcher import AudioFileHandler
+
+    handler = AudioFileHandler(output_directory)
+    loop = asyncio.get_running_loop()
+    work_dir = Path(tempfile.mkdtemp(prefix=f"stt_{worker_id}_"))
+    scheduler = PriorityScheduler("job_queue")
+    logging.info(f"STT worker {worker_id} started")
+
+    while True:
+        async with async_session_maker() as session:
+            job = await claim_job(session, worker_id, priorities=scheduler.order())
+        if job is None:
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+
+        scheduler.charge(job.priority, waited_seconds(job))
+        logging.info(f"Worker {worker_id} claimed job {job.id} ({job.priority}, attempt {job.attempts})")
+        lease_task = asyncio.create_task(keep_lease(job.id, worker_id))
+        audio_path = None
+        try:
+            audio_path = materialize_audio(job, work_dir)
+            texts = await loop.run_in_executor(None, handler.handle_audio_file, str(audio_path))
+        except Exception as e:
+            lease_task.cancel()
+            async with async_session_maker() as session:
+                status = await fail_job(session, job.id, worker_id, str(e))
+            FILES_PROCESSED.labels("stt_job", "error").inc()
+            logging.error(f"Job {job.id} failed: {e} -> {status}")
+        else:
+            lease_task.cancel()
+            async with async_session_maker() as session:
+                completed = await complete_job(session, job.id, worker_id, result={"transcriptions": texts})
+            if completed:
+                FILES_PROCESSED.labels("stt_job", "ok").inc()
+                logging.info(f"Job {job.id} completed")
+            else:
+                # Аренду забрал другой воркер: результат засчитает он (транскрипции пишутся
+                # под теми же именами, повторная запись их перезаписывает)
+                FILES_PROCESSED.labels("stt_job", "lease_lost").inc()
+                logging.warning(f"Job {job.id}: lease lost before completion, result dropped")
+        finally:
+            if job.audio_data is not None and audio_path is not None and audio_path.exists():
+                audio_path.unlink()
+                segment_metadata_path(audio_path).unlink(missing_ok=True)
+
+
+def run_worker(worker_id: str = None, output_directory: str = "./transcriptions",
+               metrics_port: int = STT_WORKER_METRICS_PORT):
+    """Запускает STT воркер очереди задач."""
+    start_metrics_server(metrics_port)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    os.makedirs(output_directory, exist_ok=True)
+    asyncio.run(worker_loop(worker_id, output_directory))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="STT worker for the database job queue")
+    parser.add_argument("--worker-id", default=None)
+    parser.add_argument("--output-dir", default="./transcriptions")
+    parser.add_argument("--metrics-port", type=int, default=STT_WORKER_METRICS_PORT)
+    args = parser.parse_args()
+
+    run_worker(args.worker_id, args.output_dir, args.metrics_port)
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Модули репозитория создают engine при импорте: до импорта задаем временную SQLite
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp()) / 'test.db'}")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
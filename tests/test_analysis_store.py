@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from sqlalchemy import create_engine
+
+from analysis_store import AnalysisWriter, analysis_row
+from models.models import call_analysis_table
+
+FLUSH_SECONDS = 0.5
+
+
+def row(transcript: str):
+    analysis = {"word_count": 3, "unique_words": 3, "avg_word_length": 4.0, "analysis_result": {}}
+    return analysis_row(analysis, transcript, {"call": "call", "segment": 0}, "operator")
+
+
+def wait_for_rows(path, expected: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while True:
+        with sqlite3.connect(path) as conn:
+            if conn.execute("SELECT count(*) FROM call_analysis").fetchone()[0] >= expected:
+                return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+
+
+def test_single_row_is_written_within_flush_seconds(tmp_path):
+    path = tmp_path / "analysis.db"
+    engine = create_engine(f"sqlite:///{path}")
+    call_analysis_table.create(engine)
+    engine.dispose()
+
+    writer = AnalysisWriter(batch_size=200, flush_seconds=FLUSH_SECONDS, database_url=f"sqlite+aiosqlite:///{path}")
+    try:
+        # И первая строка, и строка после уже записанной пачки пишутся по времени, без close()
+        writer.add(row("a.json"))
+        assert wait_for_rows(path, 1, FLUSH_SECONDS + 0.5)
+        writer.add(row("b.json"))
+        assert wait_for_rows(path, 2, FLUSH_SECONDS + 0.5)
+    finally:
+        writer.close()
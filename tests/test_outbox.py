@@ -0,0 +1,169 @@
+import asyncio
+import time
+from collections import Counter
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from sqlalchemy import delete, select
+
+import outbox
+from database import async_session_maker, engine
+from models.models import metadata, result_outbox_table
+from outbox import OutboxDispatcher, enqueue_results, hold_result, pending_count, release_result
+
+
+def record(i: int):
+    return {"order_id": f"order-{i}", "audio_path": f"uploads/call_{i}/call_MIC.wav"}
+
+
+def run(coro):
+    async def main():
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(metadata.create_all)
+                await conn.execute(delete(result_outbox_table))
+            return await coro
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(outbox, "RESULT_OUTBOX_RETRY_SECONDS", 0.01)
+    monkeypatch.setattr(outbox, "RESULT_OUTBOX_RETRY_MAX_SECONDS", 0.05)
+
+
+# Записи приняты, но подтверждение потеряно: ответ 503, запись будет отправлена повторно
+LOST_ACK = "lost_ack"
+
+
+async def receiver(respond):
+    """
+    Заглушка внешнего API: `respond(номер запроса, записи)` возвращает HTTP статус
+    или `LOST_ACK`. Возвращает сервер и счетчик принятых записей по `order_id`.
+    """
+    received, requests = Counter(), [0]
+
+    async def handle(request):
+        body = await request.json()
+        records = body if isinstance(body, list) else [body]
+        requests[0] += 1
+        status = respond(requests[0], records)
+        if status == LOST_ACK or status < 300:
+            received.update(item["order_id"] for item in records)
+        return web.json_response({}, status=503 if status == LOST_ACK else status)
+
+    app = web.Application()
+    app.router.add_post("/api", handle)
+    server = TestServer(app)
+    await server.start_server()
+    return server, received
+
+
+async def enqueue(count: int, hold_seconds: float = 0):
+    async with async_session_maker() as session:
+        await enqueue_results(session, [record(i) for i in range(count)], [f"call_{i}" for i in range(count)],
+                              hold_seconds)
+        await session.commit()
+
+
+async def deliver_all(dispatcher: OutboxDispatcher, timeout: float = 10.0):
+    """Отправляет, пока в outbox есть строки к отправке (с учетом повторов)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await dispatcher.run(until_idle=True)
+        async with async_session_maker() as session:
+            if not await pending_count(session):
+                return
+        await asyncio.sleep(0.02)
+
+
+async def rows():
+    async with async_session_maker() as session:
+        result = await session.execute(select(result_outbox_table).order_by(result_outbox_table.c.id))
+        return {row.order_id: row for row in result.fetchall()}
+
+
+def test_failed_delivery_is_retried():
+    async def scenario():
+        # Первые две попытки - 503, третья принимается
+        server, received = await receiver(lambda n, records: 503 if n <= 2 else 200)
+        try:
+            await enqueue(1)
+            await deliver_all(OutboxDispatcher(str(server.make_url("/api")), poll_interval=0.01))
+        finally:
+            await server.close()
+        return received, await rows()
+
+    received, result = run(scenario())
+    assert received == {"order-0": 1}
+    assert result["order-0"].status == "sent"
+    assert result["order-0"].attempts == 3
+
+
+def test_rows_are_dead_lettered():
+    async def scenario():
+        server, _ = await receiver(lambda n, records: 400 if records[0]["order_id"] == "order-0" else 503)
+        try:
+            await enqueue(2)
+            await deliver_all(OutboxDispatcher(str(server.make_url("/api")), max_attempts=3, poll_interval=0.01))
+        finally:
+            await server.close()
+        return await rows()
+
+    result = run(scenario())
+    # 4xx - сразу dead-letter, повторяющаяся 503 - после исчерпания попыток
+    assert (result["order-0"].status, result["order-0"].attempts) == ("dead", 1)
+    assert (result["order-1"].status, result["order-1"].attempts) == ("dead", 3)
+    assert result["order-1"].last_error == "HTTP 503"
+
+
+def test_at_least_once_with_failures_and_lost_acks():
+    count = 60
+
+    def respond(n, records):
+        if n % 5 == 0:
+            return 503  # запись не принята
+        if n % 7 == 0:
+            return LOST_ACK
+        return 200
+
+    async def scenario():
+        server, received = await receiver(respond)
+        try:
+            await enqueue(count)
+            await deliver_all(OutboxDispatcher(str(server.make_url("/api")), max_in_flight=8, batch_size=4,
+                                               poll_interval=0.01))
+        finally:
+            await server.close()
+        return received, await rows()
+
+    received, result = run(scenario())
+    assert set(received) == {f"order-{i}" for i in range(count)}
+    assert {row.status for row in result.values()} == {"sent"}
+
+
+def test_held_row_waits_for_archive_path():
+    async def scenario():
+        server, received = await receiver(lambda n, records: 200)
+        payloads = []
+        try:
+            await enqueue(1, hold_seconds=600)
+            # Архивирование отложено: строка остается отложенной и не отправляется
+            await hold_result("order-0")
+            dispatcher = OutboxDispatcher(str(server.make_url("/api")), poll_interval=0.01)
+            await dispatcher.run(until_idle=True)
+            payloads.append(dict(received))
+            await release_result("order-0", "archive/2024/01/call_0.flac")
+            await deliver_all(dispatcher)
+        finally:
+            await server.close()
+        return payloads[0], received, await rows()
+
+    before, received, result = run(scenario())
+    assert before == {}
+    assert received == {"order-0": 1}
+    assert result["order-0"].payload["audio_path"] == "archive/2024/01/call_0.flac"
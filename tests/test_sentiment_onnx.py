@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("onnxruntime")
+
+import torch  # noqa: E402
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizer  # noqa: E402
+
+from sentiment_onnx import PARITY_TEXTS, PARITY_TOLERANCE, OnnxSequenceClassifier, export, parity  # noqa: E402
+
+
+@pytest.fixture
+def tiny_model(tmp_path):
+    """Маленькая BERT со случайными весами и словарем из контрольных фраз, сохраненная как модель transformers."""
+    words = sorted({word for text in PARITY_TEXTS for word in text.split()})
+    vocab = tmp_path / "vocab.txt"
+    vocab.write_text("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words) + "\n")
+    tokenizer = BertTokenizer(str(vocab))
+
+    torch.manual_seed(0)
+    config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=64, max_position_embeddings=64, num_labels=3)
+    model = BertForSequenceClassification(config).eval()
+
+    directory = tmp_path / "model"
+    model.save_pretrained(directory)
+    tokenizer.save_pretrained(directory)
+    return directory, model, tokenizer
+
+
+def test_exported_model_matches_pytorch(tiny_model, tmp_path):
+    directory, model, tokenizer = tiny_model
+    [path] = export(str(directory), tmp_path / "onnx")
+
+    result = parity(model, tokenizer, OnnxSequenceClassifier(path))
+
+    assert result["texts"] == len(PARITY_TEXTS)
+    assert result["max_abs_diff"] <= PARITY_TOLERANCE
+    assert result["argmax_agreement"] == 1
@@ -1,8 +1,11 @@
 from typing import Dict
+
+from metrics import ANALYSIS_SECONDS
 from sentiment import analyze_conversation, xaridni_aniqlash
 
 
 
+@ANALYSIS_SECONDS.time()
 def analyze_text(text: str) -> Dict[str, int]:
     """
     Выполняет базовый анализ текста:
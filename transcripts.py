@@ -0,0 +1,161 @@
+"""
+Структурированный формат транскрипций и слияние диалога по времени.
+
+Транскрипция сегмента хранится в JSONL: одна строка на фрагмент речи
+    {"call": "...", "segment": 0, "role": "operator", "offset": 30.0, "start": 1.2, "end": 4.8, "text": "..."}
+где `offset` - смещение сегмента от начала звонка, а `start`/`end` - время фрагмента
+внутри сегмента. Метаданные сегмента (звонок, номер, смещение) записываются при
+сегментации в файл `<сегмент>.json` рядом с аудио.
+"""
+import heapq
+import json
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from audio_processor import CHANNEL_TAGS, STEREO_TAG, is_stereo_file
+
+TRANSCRIPT_SUFFIX = ".jsonl"
+TRANSCRIPTIONS_DIR = Path("transcriptions")
+MERGED_DIR = TRANSCRIPTIONS_DIR / "merged"
+SEGMENT_SECONDS = 30
+
+_SEGMENT_INDEX = re.compile(r"audio_part_[0-9a-f]+_(\d+)")
+
+
+def transcription_names(segment_path) -> List[str]:
+    """
+    Возвращает имена файлов транскрипций, которые STT сохраняет для сегмента.
+
+    Для стерео сегмента `<имя>_STEREO.wav` это `<имя>_MIC.jsonl` и `<имя>_SPEAKER.jsonl`.
+    """
+    stem = Path(segment_path).stem
+    if is_stereo_file(segment_path):
+        base = stem.replace(f"_{STEREO_TAG}", "")
+        return [f"{base}_{tag}{TRANSCRIPT_SUFFIX}" for tag in CHANNEL_TAGS.values()]
+    return [f"{stem}{TRANSCRIPT_SUFFIX}"]
+
+
+def segment_metadata_path(segment_path) -> Path:
+    return Path(segment_path).with_suffix(".json")
+
+
+def write_segment_metadata(segment_path, call: Optional[str], segment: int, offset: float,
+                           priority: Optional[str] = None, queued: bool = False):
+    """
+    Сохраняет метаданные сегмента рядом с аудио (до записи самого сегмента).
+    `priority` - класс приоритета STT (`scheduler.py`), `queued` - сегмент транскрибирует
+    воркер очереди задач (`stt_worker.py`), и наблюдатель `run.py` его пропускает.
+    """
+    metadata = {"call": call, "segment": segment, "offset": offset}
+    if priority:
+        metadata["priority"] = priority
+    if queued:
+        metadata["queued"] = True
+    segment_metadata_path(segment_path).write_text(json.dumps(metadata), encoding="utf-8")
+
+
+def read_segment_metadata(segment_path) -> Dict:
+    """
+    Возвращает метаданные сегмента.
+
+    Если файла метаданных нет, номер сегмента берется из имени `audio_part_<n>_<segment>`,
+    а смещение считается по стандартной длительности сегмента.
+    """
+    path = segment_metadata_path(segment_path)
+    if path.exists():
+        return json.loads(path.read_text(encoding="utf-8"))
+    match = _SEGMENT_INDEX.match(Path(segment_path).stem)
+    segment = int(match.group(1)) if match else 0
+    return {"call": None, "segment": segment, "offset": float(segment * SEGMENT_SECONDS)}
+
+
+def transcript_lines(result: Dict, role: str, metadata: Dict) -> List[Dict]:
+    """Преобразует результат STT с таймстемпами в строки структурированной транскрипции."""
+    base = {"call": metadata.get("call"), "segment": metadata.get("segment", 0), "role": role,
+            "offset": metadata.get("offset", 0.0)}
+    lines = []
+    for chunk in result.get("chunks") or []:
+        start, end = chunk.get("timestamp") or (0.0, None)
+        text = chunk.get("text", "").strip()
+        if text:
+            lines.append({**base, "start": start or 0.0, "end": end, "text": text})
+    if not lines:
+        lines.append({**base, "start": 0.0, "end": None, "text": result.get("text", "").strip()})
+    return lines
+
+
+def write_transcript(lines: Iterable[Dict], output_path):
+    with open(output_path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def read_transcript(path) -> Iterator[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def transcript_call(path) -> Optional[str]:
+    """Звонок, к которому относится транскрипция (по первой строке файла)."""
+    return next(read_transcript(path), {}).get("call")
+
+
+def absolute_time(line: Dict) -> float:
+    return line["offset"] + line["start"]
+
+
+def merge_dialog(paths: Iterable) -> Iterator[Dict]:
+    """
+    Потоково объединяет транскрипции сегментов звонка в один диалог по абсолютному времени.
+
+    Строки каждого файла уже упорядочены по времени, поэтому k-путевое слияние
+    через кучу занимает O(n log k) и держит в памяти по одной строке на файл.
+    """
+    return heapq.merge(*(read_transcript(path) for path in paths), key=absolute_time)
+
+
+def dialog_columns(lines: Iterable[Dict]) -> Dict[str, Optional[str]]:
+    """Собирает тексты оператора, клиента и диалога за один проход по строкам."""
+    operator, client, dialog = [], [], []
+    for line in lines:
+        if line["role"] == "operator":
+            operator.append(line["text"])
+        elif line["role"] == "client":
+            client.append(line["text"])
+        dialog.append(f"{line['role']}: {line['text']}")
+    return {
+        "operator_txt": " ".join(operator) or None,
+        "client_txt": " ".join(client) or None,
+        "dialog_txt": "\n".join(dialog) or None,
+    }
+
+
+def write_merged_transcript(paths: Iterable, output_path) -> Dict[str, Optional[str]]:
+    """
+    Записывает объединенный диалог в JSONL и одновременно собирает тексты для БД.
+
+    Возвращает:
+        Dict[str, Optional[str]]: Значения колонок `operator_txt`, `client_txt`, `dialog_txt`.
+    """
+    with open(output_path, "w", encoding="utf-8") as f:
+        def written():
+            for line in merge_dialog(paths):
+                f.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+                yield line
+
+        return dialog_columns(written())
+
+
+def merged_transcript_path(call: str) -> Path:
+    return MERGED_DIR / f"{call}_merged{TRANSCRIPT_SUFFIX}"
+
+
+def call_dialog_columns(call: str) -> Dict[str, Optional[str]]:
+    """Тексты звонка из объединенной транскрипции (пустые, если она еще не готова)."""
+    path = merged_transcript_path(call)
+    if not path.exists():
+        return {"operator_txt": None, "client_txt": None, "dialog_txt": None}
+    return dialog_columns(read_transcript(path))
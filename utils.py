@@ -1,12 +1,12 @@
 import json
 import logging
 import os
+import time
 from pathlib import Path
 from typing import List
 from datetime import datetime
 from collections import defaultdict
 import aiofiles
-import aiohttp
 import requests
 from pydub import AudioSegment
 from sqlalchemy import insert, select, update
@@ -14,15 +14,22 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from config import UPLOAD_FOLDER
+from archive import archive_call, archived_audio_path
+from config import UPLOAD_FOLDER, ARCHIVE_ENABLED, PROCESSED_FILES_PATH, RESULT_OUTBOX_HOLD_SECONDS
 from database import get_async_session
+from events import publish_event
+from id_cache import TTLCache, client_ids, operator_ids
+from kpi import call_day, call_timestamp, count_call, load_call_flags, record_call_flags
+from metrics import DB_SAVE_SECONDS
 from models.models import client_table, call_info_table, operator_table
+from outbox import enqueue_results, hold_result
+from transcripts import call_dialog_columns
 
 def get_files():
     """
     Извлекает файлы form_data и JSON из указанной папки для загрузки.
 
-    Эта функция ищет директории, начинающиеся с '2024', в директории 
+    Эта функция ищет директории запросов (имя начинается с даты `YYYYMMDD`) в директории 
     `UPLOAD_FOLDER`, затем проверяет наличие файлов `form_data.json` и 
     `json_data.json` в этих папках. Функция возвращает пути найденных файлов 
     в словаре с ключами 'form_data_files' и 'json_files'.
@@ -36,7 +43,7 @@ def get_files():
     for folder in os.listdir(UPLOAD_FOLDER):
         folder_path = UPLOAD_FOLDER / folder
 
-        if folder_path.is_dir() and folder.startswith("2024"):
+        if folder_path.is_dir() and folder[:8].isdigit():
             form_data_path = folder_path / "form_data.json"
             json_data_path = folder_path / "json_data.json"
 
@@ -57,9 +64,9 @@ async def send_result_to_api():
     Эта функция фильтрует файлы form_data по их временной метке (обрабатываются 
     только файлы за последние 3 минуты). Затем она пытается сопоставить данные 
     form_data с соответствующими данными JSON по имени пользователя. Если совпадение 
-    найдено, данные форматируются и отправляются на указанный API-эндпоинт, 
-    а также сохраняются в базе данных. Обработанные файлы отслеживаются, чтобы избежать 
-    повторной обработки.
+    найдено, данные форматируются и сохраняются в базе данных вместе с записью для API
+    в `result_outbox`, откуда их с повторами доставляет `outbox.py`. Обработанные файлы
+    отслеживаются, чтобы избежать повторной обработки.
 
     Возвращает:
         list: Пустой список (для будущих расширений).
@@ -72,7 +79,7 @@ async def send_result_to_api():
         print("form_data_files yoki json_files fayllari topilmadi")
         return []
 
-    processed_files_path = 'processed_files.txt'
+    processed_files_path = PROCESSED_FILES_PATH
     processed_files = set()
     if os.path.exists(processed_files_path):
         with open(processed_files_path, 'r', encoding='utf-8') as f:
@@ -103,7 +110,8 @@ async def send_result_to_api():
                 form_data = json.load(f)
                 form_data_dir = os.path.dirname(form_data_path)
 
-                form_data['audio_path'] = None
+                form_data['upload_dir'] = form_data_dir
+                form_data['audio_path'] = archived_audio_path(form_data_dir)
                 for file in os.listdir(form_data_dir):
                     if file.endswith('.wav'):
                         form_data['audio_path'] = os.path.join(form_data_dir, file)
@@ -153,7 +161,7 @@ async def send_result_to_api():
                 formatted_datetime = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
 
                 form_data_dir_name = os.path.basename(os.path.dirname(json_data_path))
-                audio_dir_name = os.path.basename(os.path.dirname(audio_path))
+                audio_dir_name = os.path.basename(matched_form_data["upload_dir"])
 
 
                 if any(line == form_data_dir_name or line == audio_dir_name for line in processed_files):
@@ -174,27 +182,36 @@ async def send_result_to_api():
                     "call_id": call_id,
                     "call_info": call_info,
                     "datetime": formatted_datetime,
-                    "audio_path": audio_path
+                    "audio_path": audio_path,
+                    **call_dialog_columns(audio_dir_name),
+                    "flags": load_call_flags(audio_dir_name)
                 }
 
-                await save_data_to_db([record])
+                # Пока аудио архивируется, запись для API ждет в outbox пути к архиву
+                hold_seconds = RESULT_OUTBOX_HOLD_SECONDS if ARCHIVE_ENABLED and audio_path else 0
+                saved = await save_data_to_db([record], calls=[audio_dir_name], hold_seconds=hold_seconds)
+                if not saved:
+                    continue
+                await publish_event(audio_dir_name, "saved", order_id=order_id)
 
+                # Запись для API уже в outbox, ее доставляет outbox.py, повторно папки не обрабатываются
+                with open(processed_files_path, 'a', encoding='utf-8') as f:
+                    f.write(f"{form_data_dir_name}\n")
+                    f.write(f"{audio_dir_name}\n")
 
-                api_url = "http://127.0.0.1:8000/test-api"
-                async with aiohttp.ClientSession() as session:
+                # Оригиналы перекодируются в архив только после коммита записи звонка
+                # (archive_call отпускает запись outbox с путем к архиву)
+                if hold_seconds:
+                    archive_path = None
                     try:
-                        async with session.post(api_url, json=record) as response:
-                            if response.status == 200:
-                                print(f"Ma'lumot muvaffaqiyatli yuborildi: {record}")
-
-                                # Mark directories as processed
-                                with open(processed_files_path, 'a', encoding='utf-8') as f:
-                                    f.write(f"{form_data_dir_name}\n")
-                                    f.write(f"{audio_dir_name}\n")
-                            else:
-                                print(f"Ma'lumot yuborishda xato: {record}, Status: {response.status}")
+                        archive_path = await archive_call(order_id, matched_form_data["upload_dir"])
+                        if archive_path:
+                            await publish_event(audio_dir_name, "archived", audio_path=archive_path)
                     except Exception as e:
-                        print(f"API ga yuborishda xato: {str(e)}")
+                        print(f"Audio arxivlashda xato: {str(e)}")
+                    if not archive_path:
+                        # Архивирование отложено или не удалось: запись отпустит компактор
+                        await hold_result(order_id)
 
         except Exception as e:
             print(f"json faylini ishlashda xato: {str(e)}")
@@ -206,54 +223,83 @@ async def send_result_to_api():
 
 
 
-async def save_data_to_db(data):
+async def cached_id(session: AsyncSession, cache: TTLCache, key, id_column, key_column, new_ids: dict,
+                    used_keys: list):
+    """
+    id оператора (по имени) или клиента (по телефону): из вставленных в текущей транзакции,
+    из кэша или из БД (с сохранением в кэш). None, если записи нет.
+    """
+    if (cache, key) in new_ids:
+        return new_ids[(cache, key)]
+    value = cache.get(key)
+    if value is not None:
+        used_keys.append((cache, key))
+        return value
+    value = (await session.execute(select(id_column).where(key_column == key).limit(1))).scalar()
+    cache.put(key, value)
+    used_keys.append((cache, key))
+    return value
+
+
+def forget_ids(used_keys: list):
+    """Удаляет из кэша ключи откатившейся транзакции: их id могли устареть."""
+    for cache, key in used_keys:
+        cache.discard(key)
+
+
+async def save_data_to_db(data, calls: List[str] = None, hold_seconds: float = 0):
     """
     Сохраняет обработанные данные в базе данных, обеспечивая, что операторы, клиенты 
     и заказы правильно вставляются без дублирования.
 
-    Эта функция сначала проверяет, существуют ли оператор и клиент в базе данных. 
+    Эта функция сначала проверяет, существуют ли оператор и клиент в базе данных
+    (id берутся из кэша `id_cache`, запрос к БД - только при промахе). 
     Если они не существуют, то вставляются. Также проверяется, существует ли заказ с 
-    данным идентификатором. Если заказа нет, он вставляется в таблицу `call_info_table`. 
+    данным идентификатором. Если заказа нет, он вставляется в таблицу `call_info_table`, 
+    а в той же транзакции сохраняются флаги анализа звонка, обновляются KPI оператора за день
+    и запись ставится в `result_outbox` для отправки во внешний API (`outbox.py`).
     Функция использует SQLAlchemy для выполнения операций с базой данных асинхронно.
 
     Аргументы:
         data (list): Список записей для сохранения в базе данных.
+        calls (list, optional): Имена папок запросов записей (для событий отправки).
+        hold_seconds (float): Отложить отправку записей в API (до архивации аудио).
+
+    Возвращает:
+        bool: True, если транзакция зафиксирована.
     """
+    started = time.perf_counter()
+    saved = False
+    # id, вставленные в этой транзакции (в кэш после фиксации), и ключи, прочитанные из кэша
+    new_ids, used_keys = {}, []
+    # Записи для API и папки их запросов, пишутся в outbox одним запросом перед коммитом
+    outbox_records, outbox_calls = [], []
     async for session in get_async_session():
         try:
-            for record in data:
+            for index, record in enumerate(data):
 
-                operator_stmt = select(operator_table).where(operator_table.c.name == record["operator"]["name"])
-                result = await session.execute(operator_stmt)
-                existing_operator = result.fetchall()
-
-                if existing_operator:
-                    operator_id = existing_operator[0].id
-                else:
-                    operator_name = record["operator"]["name"]
+                operator_name = record["operator"]["name"]
+                operator_id = await cached_id(session, operator_ids, operator_name, operator_table.c.id,
+                                              operator_table.c.name, new_ids, used_keys)
+                if operator_id is None:
                     operator_stmt = insert(operator_table).values(
                         name=operator_name
                     ).returning(operator_table.c.id)
                     res = await session.execute(operator_stmt)
                     operator_id = res.scalar()
+                    new_ids[(operator_ids, operator_name)] = operator_id
 
-
-                client_stmt = select(client_table).where(client_table.c.phone == record["client"]["phone"])
-                result = await session.execute(client_stmt)
-                existing_client = result.fetchall()
-
-
-                if existing_client:
-                    client_id = existing_client[0].id
-                else:
+                client_phone = record["client"]["phone"]
+                client_id = await cached_id(session, client_ids, client_phone, client_table.c.id,
+                                            client_table.c.phone, new_ids, used_keys)
+                if client_id is None:
                     client_name = record["client"].get("name", "")
-                    client_phone = record["client"]["phone"]
                     client_stmt = insert(client_table).values(
                         name=client_name,
                         phone=client_phone
-                    )
-                    await session.execute(client_stmt)
-                    client_id = await session.scalar(select(client_table.c.id).where(client_table.c.phone == client_phone))
+                    ).returning(client_table.c.id)
+                    client_id = (await session.execute(client_stmt)).scalar()
+                    new_ids[(client_ids, client_phone)] = client_id
 
                 call_info_check_stmt = select(call_info_table).where(call_info_table.c.order_id == record["order_id"])
                 result = await session.execute(call_info_check_stmt)
@@ -266,25 +312,72 @@ async def save_data_to_db(data):
                     call_info_stmt = insert(call_info_table).values(
                         operator_id=operator_id,
                         client_id=client_id,
-                        operator_txt=None,
-                        client_txt=None,
-                        dialog_txt=None,
+                        operator_txt=record.get("operator_txt"),
+                        client_txt=record.get("client_txt"),
+                        dialog_txt=record.get("dialog_txt"),
                         status_ai=record["status_ai"],
                         status_1c=record["status_1c"],
                         datetime=record["datetime"],
+                        call_ts=call_timestamp(record["datetime"]),
                         order_id=record["order_id"],
                         call_id=record["call_id"],
                         call_info=record["call_info"],
-                        audio_path=record["audio_path"]
-                    )
-                    await session.execute(call_info_stmt)
+                        audio_path=record["audio_path"],
+                        call=calls[index] if calls else None
+                    ).returning(call_info_table.c.id)
+                    call_info_id = (await session.execute(call_info_stmt)).scalar()
+
+                    day = call_day(record["datetime"])
+                    await count_call(session, operator_id, day)
+                    if record.get("flags"):
+                        await record_call_flags(session, call_info_id, operator_id, day, record["flags"])
+                    outbox_records.append(record)
+                    outbox_calls.append(calls[index] if calls else None)
                     print("Ma'lumot bazaga muvaffaqiyatli saqlandi")
 
+            await enqueue_results(session, outbox_records, outbox_calls, hold_seconds)
             await session.commit()
+            saved = True
+            for (cache, key), value in new_ids.items():
+                cache.put(key, value)
 
         except IntegrityError as e:
             await session.rollback()
+            forget_ids(used_keys)
             print(f"Ma'lumotni saqlashda xato yuz berdi (IntegrityError): {str(e)}")
         except Exception as e:
             await session.rollback()
+            forget_ids(used_keys)
             print(f"Ma'lumotni saqlashda xato yuz berdi: {str(e)}")
+    DB_SAVE_SECONDS.observe(time.perf_counter() - started)
+    return saved
+
+
+async def update_call_texts(call: str, texts: dict, flags: dict = None):
+    """
+    Записывает тексты оператора, клиента и диалога и флаги анализа в уже сохраненную
+    запись звонка, KPI оператора обновляются в той же транзакции.
+
+    Звонок определяется по имени папки запроса (`call_info.call`). Если звонок
+    еще не сохранен, тексты и флаги будут записаны при его сохранении.
+    """
+    condition = call_info_table.c.call == call
+    async for session in get_async_session():
+        await session.execute(update(call_info_table).where(condition).values(**texts))
+        if flags:
+            result = await session.execute(
+                select(call_info_table.c.id, call_info_table.c.operator_id, call_info_table.c.datetime).where(condition)
+            )
+            for row in result.fetchall():
+                await record_call_flags(session, row.id, row.operator_id, call_day(row.datetime), flags)
+        await session.commit()
+
+
+async def call_record(session: AsyncSession, call: str):
+    """Сохраненная запись звонка по имени папки запроса (`call_info.call`) или None."""
+    result = await session.execute(
+        select(call_info_table.c.id, call_info_table.c.order_id, call_info_table.c.status_ai,
+               call_info_table.c.audio_path).where(call_info_table.c.call == call)
+    )
+    row = result.fetchone()
+    return dict(row._mapping) if row else None